@@ -2,6 +2,10 @@
 """
 BrSpeech Scores Analysis Script
 Analyzes the scores CSV file generated by the test script.
+
+Scores are loaded in chunks (CSV) or by column (Parquet) into compact arrays,
+so multi-million-row dumps from sliding-window and production scoring fit in
+memory. EER and AUC for every source come from one global sort of the scores.
 """
 
 import pandas as pd
@@ -11,6 +15,12 @@ from sklearn.metrics import roc_curve, auc, confusion_matrix, classification_rep
 import argparse
 import seaborn as sns
 
+# Source codes, in the priority order extract_source checks them
+SOURCES = ['f5tts', 'fish-speech', 'toucantts', 'xtts', 'yourtts', 'real', 'unknown']
+REAL_CODE = SOURCES.index('real')
+UNKNOWN_CODE = SOURCES.index('unknown')
+
+
 def calculate_eer(y_true, y_scores):
     """Calculate Equal Error Rate (EER) and optimal threshold."""
     fpr, tpr, thresholds = roc_curve(y_true, y_scores)
@@ -23,25 +33,6 @@ def calculate_eer(y_true, y_scores):
     
     return eer, eer_threshold, fpr, tpr, thresholds
 
-def analyze_by_source(df):
-    """Analyze performance by TTS model source."""
-    df['source'] = df['path'].apply(lambda x: extract_source(x))
-    
-    results = {}
-    for source in df['source'].unique():
-        source_df = df[df['source'] == source]
-        if len(source_df) > 0:
-            eer, eer_thresh, _, _, _ = calculate_eer(source_df['true_label'], source_df['prediction_score'])
-            acc_05 = np.mean((source_df['prediction_score'] > 0.5) == source_df['true_label']) * 100
-            results[source] = {
-                'count': len(source_df),
-                'eer': eer * 100,
-                'eer_threshold': eer_thresh,
-                'accuracy_05': acc_05
-            }
-    
-    return results
-
 def extract_source(path):
     """Extract TTS model source from file path."""
     if 'f5tts' in path:
@@ -59,29 +50,167 @@ def extract_source(path):
     else:
         return 'unknown'
 
+def classify_sources(paths: pd.Series) -> np.ndarray:
+    """Vectorized extract_source: int8 source codes for a Series of paths."""
+    codes = np.full(len(paths), UNKNOWN_CODE, dtype=np.int8)
+    codes[paths.str.contains('/real/|train/audio', regex=True).to_numpy()] = REAL_CODE
+    # Apply lowest priority first so earlier checks win, as in extract_source
+    for code in reversed(range(REAL_CODE)):
+        codes[paths.str.contains(SOURCES[code], regex=False).to_numpy()] = code
+    return codes
+
+def synth_to_codes(synth: pd.Series) -> np.ndarray:
+    """Source codes from the metadata `synth` column ('bonafide' means real)."""
+    names = synth.replace('bonafide', 'real')
+    codes = pd.Categorical(names, categories=SOURCES).codes.astype(np.int8)
+    codes[codes < 0] = UNKNOWN_CODE
+    return codes
+
+def load_scores(scores_file, metadata_files=(), chunksize=1_000_000):
+    """
+    Load scores as compact arrays: (scores float32, labels int8, source codes int8).
+    Sources come from the metadata `synth` column when metadata CSVs are given,
+    falling back to the path classifier for paths they do not cover.
+    """
+    synth_by_path = None
+    if metadata_files:
+        meta = pd.concat([pd.read_csv(f, usecols=['path', 'synth']) for f in metadata_files])
+        synth_by_path = meta.drop_duplicates('path').set_index('path')['synth']
+
+    if str(scores_file).endswith('.parquet'):
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas() for batch in pq.ParquetFile(scores_file).iter_batches(
+            batch_size=chunksize, columns=['path', 'true_label', 'prediction_score']))
+    else:
+        chunks = pd.read_csv(scores_file, usecols=['path', 'true_label', 'prediction_score'],
+                             chunksize=chunksize)
+
+    scores, labels, sources = [], [], []
+    for chunk in chunks:
+        scores.append(chunk['prediction_score'].to_numpy(np.float32))
+        labels.append(chunk['true_label'].to_numpy().astype(np.int8))
+        codes = classify_sources(chunk['path'])
+        if synth_by_path is not None:
+            synth = chunk['path'].map(synth_by_path)
+            known = synth.notna().to_numpy()
+            codes[known] = synth_to_codes(synth[known])
+        sources.append(codes)
+    return np.concatenate(scores), np.concatenate(labels), np.concatenate(sources)
+
+def sorted_scores(scores, labels, sources):
+    """The single descending sort every ROC/EER/AUC below is computed from."""
+    order = np.argsort(-scores, kind='stable')
+    return scores[order], labels[order], sources[order]
+
+def roc_from_sorted(s_sorted, positives, negatives):
+    """
+    ROC points from scores sorted in descending order and boolean masks of the
+    positive (real) and negative samples to include, in the same order.
+    Returns fpr, tpr, thresholds like sklearn's roc_curve (without dropping points).
+    """
+    last = np.r_[s_sorted[1:] != s_sorted[:-1], True]  # last position of each distinct score
+    tps = np.cumsum(positives, dtype=np.int64)[last]
+    fps = np.cumsum(negatives, dtype=np.int64)[last]
+    tpr = np.r_[0.0, tps / max(tps[-1], 1)]
+    fpr = np.r_[0.0, fps / max(fps[-1], 1)]
+    thresholds = np.r_[np.inf, s_sorted[last]]
+    return fpr, tpr, thresholds
+
+def eer_from_roc(fpr, tpr, thresholds):
+    fnr = 1 - tpr
+    eer_index = np.argmin(np.abs(fpr - fnr))
+    return (fpr[eer_index] + fnr[eer_index]) / 2, thresholds[eer_index]
+
+def analyze_by_source(s_sorted, y_sorted, src_sorted):
+    """
+    Performance per source. Each spoof source is scored against all real
+    samples (real vs that TTS system); the real row reports count and accuracy.
+    """
+    is_real = y_sorted == 1
+    correct = (s_sorted > 0.5) == is_real
+    results = {}
+    for code in np.unique(src_sorted):
+        source = SOURCES[code]
+        mask = src_sorted == code
+        metrics = {
+            'count': int(mask.sum()),
+            'eer': np.nan,
+            'eer_threshold': np.nan,
+            'auc': np.nan,
+            'accuracy_05': correct[mask].mean() * 100,
+        }
+        negatives = mask & ~is_real
+        if negatives.any() and is_real.any():
+            fpr, tpr, thresholds = roc_from_sorted(s_sorted, is_real, negatives)
+            eer, eer_thresh = eer_from_roc(fpr, tpr, thresholds)
+            metrics.update({'eer': eer * 100, 'eer_threshold': eer_thresh, 'auc': np.trapz(tpr, fpr)})
+        results[source] = metrics
+    return results
+
+def bootstrap_ci(scores, labels, mask=None, n_boot=1000, bins=4096, alpha=0.05, seed=0):
+    """
+    Vectorized bootstrap confidence intervals for EER and AUC.
+    Scores are histogrammed once per class; each bootstrap replicate redraws
+    the class histograms with a multinomial, so the cost is O(n_boot * bins)
+    regardless of the number of rows. EER resolution is one bin width.
+    """
+    if mask is not None:
+        scores, labels = scores[mask], labels[mask]
+    pos, neg = scores[labels == 1], scores[labels == 0]
+    if len(pos) == 0 or len(neg) == 0:
+        return None
+    edges = np.linspace(scores.min(), scores.max() + 1e-9, bins + 1)
+    rng = np.random.default_rng(seed)
+    # Replicates of per-bin counts, highest scores first
+    pos_boot = rng.multinomial(len(pos), np.histogram(pos, edges)[0][::-1] / len(pos), size=n_boot)
+    neg_boot = rng.multinomial(len(neg), np.histogram(neg, edges)[0][::-1] / len(neg), size=n_boot)
+    tpr = np.cumsum(pos_boot, axis=1) / len(pos)
+    fpr = np.cumsum(neg_boot, axis=1) / len(neg)
+    fnr = 1 - tpr
+
+    idx = np.argmin(np.abs(fpr - fnr), axis=1)[:, None]
+    eers = ((np.take_along_axis(fpr, idx, 1) + np.take_along_axis(fnr, idx, 1)) / 2).ravel()
+    zeros = np.zeros((n_boot, 1))
+    aucs = np.trapz(np.hstack([zeros, tpr]), np.hstack([zeros, fpr]), axis=1)
+    q = [alpha / 2 * 100, (1 - alpha / 2) * 100]
+    return {'eer_ci': np.percentile(eers, q) * 100, 'auc_ci': np.percentile(aucs, q)}
+
+def det_axis(rates):
+    """Normal deviate scale used by DET plots."""
+    from scipy.stats import norm
+    return norm.ppf(np.clip(rates, 1e-6, 1 - 1e-6))
+
 def main():
     parser = argparse.ArgumentParser(description='Analyze BrSpeech test scores')
-    parser.add_argument('scores_file', help='Path to scores CSV file')
+    parser.add_argument('scores_file', help='Path to scores CSV or Parquet file')
+    parser.add_argument('--metadata', nargs='*', default=[],
+                        help='Metadata CSVs (path, synth) used as the source of truth for TTS sources')
     parser.add_argument('--output_dir', default='./analysis_results', help='Output directory for plots')
     parser.add_argument('--save_plots', action='store_true', help='Save plots to files')
+    parser.add_argument('--bootstrap', type=int, default=0, help='Bootstrap replicates for 95%% CIs (0 = off)')
+    parser.add_argument('--chunksize', type=int, default=1_000_000, help='Rows per CSV chunk')
     
     args = parser.parse_args()
     
     # Load scores
     print(f"Loading scores from: {args.scores_file}")
-    df = pd.read_csv(args.scores_file)
+    scores, labels, sources = load_scores(args.scores_file, args.metadata, args.chunksize)
     
-    print(f"Dataset: {len(df)} samples")
-    print(f"Real samples: {np.sum(df['true_label'] == 1)}")
-    print(f"Fake samples: {np.sum(df['true_label'] == 0)}")
+    print(f"Dataset: {len(scores)} samples")
+    print(f"Real samples: {np.sum(labels == 1)}")
+    print(f"Fake samples: {np.sum(labels == 0)}")
     print()
     
     # Calculate overall EER
-    eer, eer_threshold, fpr, tpr, thresholds = calculate_eer(df['true_label'], df['prediction_score'])
+    s_sorted, y_sorted, src_sorted = sorted_scores(scores, labels, sources)
+    is_real = y_sorted == 1
+    fpr, tpr, thresholds = roc_from_sorted(s_sorted, is_real, ~is_real)
+    eer, eer_threshold = eer_from_roc(fpr, tpr, thresholds)
     
     # Calculate accuracies
-    acc_05 = np.mean(df['predicted_label'] == df['true_label']) * 100
-    acc_eer = np.mean((df['prediction_score'] > eer_threshold) == df['true_label']) * 100
+    predicted = (scores > 0.5).astype(np.int8)
+    acc_05 = np.mean(predicted == labels) * 100
+    acc_eer = np.mean((scores > eer_threshold) == labels) * 100
     
     # AUC
     auc_score = auc(fpr, tpr)
@@ -89,19 +218,31 @@ def main():
     print("=== OVERALL PERFORMANCE ===")
     print(f"EER: {eer*100:.2f}% (threshold: {eer_threshold:.4f})")
     print(f"AUC: {auc_score:.4f}")
+    if args.bootstrap:
+        ci = bootstrap_ci(scores, labels, n_boot=args.bootstrap)
+        if ci is not None:
+            print(f"EER 95% CI: [{ci['eer_ci'][0]:.2f}%, {ci['eer_ci'][1]:.2f}%]")
+            print(f"AUC 95% CI: [{ci['auc_ci'][0]:.4f}, {ci['auc_ci'][1]:.4f}]")
     print(f"Accuracy at threshold 0.5: {acc_05:.2f}%")
     print(f"Accuracy at EER threshold: {acc_eer:.2f}%")
     print()
     
     # Performance by source
     print("=== PERFORMANCE BY SOURCE ===")
-    source_results = analyze_by_source(df)
+    source_results = analyze_by_source(s_sorted, y_sorted, src_sorted)
     for source, metrics in source_results.items():
-        print(f"{source:15} | Count: {metrics['count']:5} | EER: {metrics['eer']:5.2f}% | Acc@0.5: {metrics['accuracy_05']:5.2f}%")
+        line = (f"{source:15} | Count: {metrics['count']:7} | EER: {metrics['eer']:5.2f}% | "
+                f"AUC: {metrics['auc']:.4f} | Acc@0.5: {metrics['accuracy_05']:5.2f}%")
+        if args.bootstrap and source != 'real':
+            code = SOURCES.index(source)
+            ci = bootstrap_ci(scores, labels, (sources == code) | (labels == 1), n_boot=args.bootstrap)
+            if ci is not None:
+                line += f" | EER CI: [{ci['eer_ci'][0]:.2f}, {ci['eer_ci'][1]:.2f}]%"
+        print(line)
     print()
     
     # Confusion Matrix at 0.5 threshold
-    cm = confusion_matrix(df['true_label'], df['predicted_label'])
+    cm = confusion_matrix(labels, predicted, labels=[0, 1])
     print("=== CONFUSION MATRIX (threshold=0.5) ===")
     print("Predicted:  Real  Fake")
     print(f"Real:       {cm[1,1]:4d}  {cm[1,0]:4d}")
@@ -109,12 +250,12 @@ def main():
     print()
     
     # Score statistics
-    real_scores = df[df['true_label'] == 1]['prediction_score']
-    fake_scores = df[df['true_label'] == 0]['prediction_score']
+    real_scores = scores[labels == 1]
+    fake_scores = scores[labels == 0]
     
     print("=== SCORE STATISTICS ===")
-    print(f"Real speech scores  - Mean: {real_scores.mean():.4f}, Std: {real_scores.std():.4f}")
-    print(f"Fake speech scores  - Mean: {fake_scores.mean():.4f}, Std: {fake_scores.std():.4f}")
+    print(f"Real speech scores  - Mean: {real_scores.mean():.4f}, Std: {real_scores.std(ddof=1):.4f}")
+    print(f"Fake speech scores  - Mean: {fake_scores.mean():.4f}, Std: {fake_scores.std(ddof=1):.4f}")
     print()
     
     # Plotting
@@ -123,9 +264,9 @@ def main():
         os.makedirs(args.output_dir, exist_ok=True)
     
     # ROC Curve
-    plt.figure(figsize=(10, 4))
+    plt.figure(figsize=(15, 4))
     
-    plt.subplot(1, 2, 1)
+    plt.subplot(1, 3, 1)
     plt.plot(fpr, tpr, 'b-', linewidth=2, label=f'ROC (AUC = {auc_score:.3f})')
     plt.plot([0, 1], [0, 1], 'r--', linewidth=1, label='Random')
     plt.plot(fpr[np.argmin(np.abs(fpr - (1-tpr)))], tpr[np.argmin(np.abs(fpr - (1-tpr)))], 
@@ -137,7 +278,7 @@ def main():
     plt.grid(True, alpha=0.3)
     
     # Score distributions
-    plt.subplot(1, 2, 2)
+    plt.subplot(1, 3, 2)
     plt.hist(fake_scores, bins=50, alpha=0.6, label='Fake', color='red', density=True)
     plt.hist(real_scores, bins=50, alpha=0.6, label='Real', color='blue', density=True)
     plt.axvline(0.5, color='black', linestyle='--', label='Threshold 0.5')
@@ -147,6 +288,27 @@ def main():
     plt.title('Score Distributions')
     plt.legend()
     plt.grid(True, alpha=0.3)
+
+    # DET curves, overall and per spoof source
+    plt.subplot(1, 3, 3)
+    plt.plot(det_axis(fpr), det_axis(1 - tpr), 'k-', linewidth=2, label='All')
+    for source in source_results:
+        code = SOURCES.index(source)
+        negatives = (src_sorted == code) & ~is_real
+        if source == 'real' or not negatives.any():
+            continue
+        s_fpr, s_tpr, _ = roc_from_sorted(s_sorted, is_real, negatives)
+        plt.plot(det_axis(s_fpr), det_axis(1 - s_tpr), linewidth=1, label=source)
+    ticks = np.array([0.001, 0.01, 0.05, 0.2, 0.5])
+    plt.xticks(det_axis(ticks), [f'{t*100:g}' for t in ticks])
+    plt.yticks(det_axis(ticks), [f'{t*100:g}' for t in ticks])
+    plt.xlim(det_axis(0.0005), det_axis(0.6))
+    plt.ylim(det_axis(0.0005), det_axis(0.6))
+    plt.xlabel('False Acceptance Rate (%)')
+    plt.ylabel('False Rejection Rate (%)')
+    plt.title('DET Curves')
+    plt.legend(fontsize=8)
+    plt.grid(True, alpha=0.3)
     
     plt.tight_layout()
     
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Streaming Metrics Check
+Compares the fixed-memory StreamingMetrics (pipelines/brspeech/src/brspeech_metrics.py)
+with the exact sklearn-based calculate_eer / roc AUC of analyze_scores.py:
+
+    synthetic    score distributions with known properties: separated and
+                 overlapping Gaussians, heavy ties, saturated logits, strong
+                 class imbalance, several fake sources with different difficulty
+    scores files optional --scores CSVs from --test_only, compared pooled and
+                 per source (metadata synth column, as in analyze_scores.py)
+
+A case passes when |EER_stream - EER_exact| is within the reported eer_bound
+plus one clip of the smaller class (the resolution of calculate_eer itself),
+and the AUCs agree to 1e-3. The streaming EER is also checked against the
+exact EER with tied scores resolved by linear interpolation (EER_ties): to
+1e-9 when the bin where the rates cross holds a single distinct score (the
+histogram loses nothing there, as in the tied-scores case), otherwise within
+eer_bound. Exits non-zero if any case fails.
+
+    python check_streaming_metrics.py --scores test_scores_w2v_aasist_<checkpoint>.csv --metadata metadata/test.csv
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.metrics import roc_auc_score
+
+sys.path.insert(0, str(Path(__file__).parent / 'pipelines' / 'brspeech' / 'src'))
+
+from analyze_scores import calculate_eer, load_scores, SOURCES, REAL_CODE  # noqa: E402
+from brspeech_metrics import StreamingMetrics  # noqa: E402
+
+
+def synthetic_cases(rng: np.random.Generator) -> dict:
+    """name -> (logits, labels, sources)"""
+    cases = {}
+
+    def two_class(n_real, n_fake, real_mu, fake_mu, scale=1.0):
+        logits = np.r_[rng.normal(real_mu, scale, n_real), rng.normal(fake_mu, scale, n_fake)]
+        return logits, np.r_[np.ones(n_real, int), np.zeros(n_fake, int)]
+
+    logits, labels = two_class(5000, 5000, 2.0, -2.0)
+    cases['separated'] = (logits, labels, None)
+    logits, labels = two_class(5000, 5000, 0.3, -0.3)
+    cases['overlapping'] = (logits, labels, None)
+    logits, labels = two_class(1000, 40000, 1.5, -1.5)
+    cases['imbalanced_1_to_40'] = (logits, labels, None)
+    logits, labels = two_class(3000, 3000, 1.0, -1.0)
+    cases['ties_rounded_0.5'] = (np.round(logits * 2) / 2, labels, None)
+    logits, labels = two_class(3000, 3000, 25.0, -25.0, scale=10.0)
+    cases['saturated_logits'] = (logits, labels, None)
+
+    # Real clips against five TTS sources of increasing difficulty
+    names = SOURCES[:REAL_CODE]
+    parts = [(rng.normal(2.0, 1.0, 6000), np.ones(6000, int), np.full(6000, 'real'))]
+    for i, name in enumerate(names):
+        parts.append((rng.normal(-3.0 + 0.6 * i, 1.0, 3000), np.zeros(3000, int), np.full(3000, name)))
+    cases['five_sources'] = tuple(np.concatenate(p) for p in zip(*parts))
+    return cases
+
+
+def interpolated_eer(labels, logits) -> float:
+    """Exact EER with tied scores interpolated linearly (accept as real when logit >= threshold)."""
+    values = np.unique(logits)
+    real, fake = np.sort(logits[labels == 1]), np.sort(logits[labels == 0])
+    p_miss = np.r_[np.searchsorted(real, values, 'left'), len(real)] / len(real)
+    p_fa = 1 - np.r_[np.searchsorted(fake, values, 'left'), len(fake)] / len(fake)
+    d = p_miss - p_fa
+    k = int(np.argmax(d >= 0))
+    t = 0.0 if d[k] == d[k - 1] else -d[k - 1] / (d[k] - d[k - 1])
+    return float((p_miss[k - 1] + p_fa[k - 1]) / 2 + t * ((p_miss[k] + p_fa[k]) - (p_miss[k - 1] + p_fa[k - 1])) / 2)
+
+
+def compare(name: str, logits, labels, sources, batch_size: int = 256) -> list:
+    """Stream in batches and compare pooled and per-source metrics with the exact ones."""
+    metrics = StreamingMetrics(sorted(set(sources)) if sources is not None else ())
+    start = time.perf_counter()
+    for b in range(0, len(logits), batch_size):
+        metrics.update(logits[b:b + batch_size], labels[b:b + batch_size],
+                       None if sources is None else sources[b:b + batch_size])
+    stream_seconds = time.perf_counter() - start
+    result = metrics.compute()
+
+    groups = {'pooled': (np.ones(len(labels), bool), result)}
+    if sources is not None:
+        for source, detection in result['per_source'].items():
+            if 'eer' in detection:
+                groups[source] = ((labels == 1) | (sources == source), detection)
+
+    rows = []
+    for group, (mask, detection) in groups.items():
+        exact_eer = calculate_eer(labels[mask], logits[mask])[0]
+        exact_auc = roc_auc_score(labels[mask], logits[mask])
+        n_min = min(int((labels[mask] == 1).sum()), int((labels[mask] == 0).sum()))
+        tolerance = detection['eer_bound'] + 1.0 / n_min
+        ties_eer = interpolated_eer(labels[mask], logits[mask])
+        # Distinct scores in the bin where the rates cross
+        crossing = np.searchsorted(metrics.edges, detection['eer_threshold'], side='right') - 1
+        in_bin = (logits[mask] >= metrics.edges[crossing]) & (logits[mask] < metrics.edges[crossing + 1])
+        ties_tolerance = 1e-9 if len(np.unique(logits[mask][in_bin])) <= 1 else detection['eer_bound']
+        ok = (abs(detection['eer'] - exact_eer) <= tolerance and abs(detection['eer'] - ties_eer) <= ties_tolerance
+              and abs(detection['auc'] - exact_auc) <= 1e-3)
+        rows.append({'case': name, 'group': group, 'eer_exact': exact_eer * 100, 'eer_stream': detection['eer'] * 100,
+                     'tolerance': tolerance * 100, 'eer_ties': ties_eer * 100, 'ties_tolerance': ties_tolerance * 100,
+                     'auc_exact': exact_auc, 'auc_stream': detection['auc'], 'ok': ok})
+    print(f"{name}: {len(logits)} clips streamed in {stream_seconds * 1000:.0f} ms, "
+          f"{metrics.counts.nbytes / 1024:.0f} KB of histograms")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare streaming EER/AUC with the exact sklearn computation')
+    parser.add_argument('--scores', nargs='*', default=[], help='Scores files from --test_only (CSV/Parquet)')
+    parser.add_argument('--metadata', nargs='*', default=[], help='Metadata CSVs with the synth column')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for name, (logits, labels, sources) in synthetic_cases(np.random.default_rng(args.seed)).items():
+        rows += compare(name, logits, labels, sources)
+    for scores_file in args.scores:
+        scores, labels, codes = load_scores(scores_file, args.metadata)
+        probs = np.clip(scores.astype(np.float64), 1e-12, 1 - 1e-12)
+        logits = np.log(probs) - np.log1p(-probs)
+        sources = np.asarray(SOURCES, dtype=object)[codes]
+        rows += compare(Path(scores_file).name, logits, labels.astype(int), sources)
+
+    print(f"\n{'case':22} {'group':12} {'EER exact':>10} {'EER stream':>11} {'tol':>7} {'EER ties':>9} {'tol':>7} "
+          f"{'AUC exact':>10} {'AUC stream':>11}")
+    for r in rows:
+        print(f"{r['case']:22} {r['group']:12} {r['eer_exact']:9.3f}% {r['eer_stream']:10.3f}% {r['tolerance']:6.3f}% "
+              f"{r['eer_ties']:8.3f}% {r['ties_tolerance']:6.3f}% "
+              f"{r['auc_exact']:10.5f} {r['auc_stream']:11.5f}  {'✅' if r['ok'] else '❌'}")
+    failed = [r for r in rows if not r['ok']]
+    print(f"\n{len(rows) - len(failed)}/{len(rows)} comparisons within tolerance")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
-import copy
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from torch.nn import BCEWithLogitsLoss
 from torch.optim import Adam
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 from yaml import safe_load
 
+from brspeech_metrics import ValidationMetrics
+from brspeech_sample_index import SampleIndex
 from configuration.df_train_config import DF_Train_Config
 from configuration.rawboost_config import _RawboostConfig
 from configuration.train_config import _TrainerConfig
@@ -94,7 +96,7 @@ def main():
     )
 
     # merge datasets into train_dataset
-    train_dataset.samples_df = pd.concat([
+    samples_df = pd.concat([
         train_dataset.samples_df,
         test_dataset.samples_df,
         val_dataset.samples_df
@@ -104,18 +106,24 @@ def main():
     # delete val_dataset and test_dataset
     del val_dataset, test_dataset
 
-    # split the dataset into train and validation
-    train_df, val_df = train_test_split(
-        train_dataset.samples_df,
+    # compact, memory-mapped index: forked workers do not copy a DataFrame of path strings
+    out_root = Path(train_config.out_model_dir)
+    samples_index = SampleIndex.from_dataframe(samples_df).save(out_root / "sample_index")
+    del samples_df
+    train_dataset.samples_df = samples_index
+
+    # split the dataset into train and validation as index views (same split as splitting the DataFrame)
+    train_idx, val_idx = train_test_split(
+        np.arange(len(samples_index)),
         test_size=0.2,
         random_state=train_config.seed,
     )
-    val_dataset = copy.deepcopy(train_dataset)
-    train_dataset.samples_df = train_df
-    val_dataset.samples_df = val_df
+    full_dataset = train_dataset
+    train_dataset = Subset(full_dataset, train_idx)
+    val_dataset = Subset(full_dataset, val_idx)
     main_logger.info(f"Dataset sizes train: {len(train_dataset)}, val: {len(val_dataset)}")
 
-    assert len((set(train_dataset.samples_df['path']))& set(val_dataset.samples_df['path']))==0, "Train and validation datasets have common samples"
+    assert len(set(samples_index.take(train_idx)['path']) & set(samples_index.take(val_idx)['path'])) == 0, "Train and validation datasets have common samples"
     # create the data loaders
     train_loader = DataLoader(
         train_dataset,
@@ -134,15 +142,20 @@ def main():
     out_model_dir = Path(train_config.out_model_dir) / f"{model_name}_lr_{train_config.trainer_config.optimizer_parameters['lr']}_wd_{train_config.trainer_config.optimizer_parameters['weight_decay']}"
     out_model_dir.mkdir(parents=True, exist_ok=True)
 
+    # streaming EER / AUC / min DCF of every validation pass, next to the loss and accuracy of train_nn
+    validation_metrics = ValidationMetrics(val_loader, out_model_dir / "val_metrics.jsonl", log=main_logger.info)
+    val_loader = validation_metrics.wrap_loader(val_loader)
+
     # create the trainer
-    config_save_path, checkpoint_path = train_nn(
-        data_train=train_loader,
-        data_test=val_loader,
-        config=train_config,
-        model_config=model_config,
-        out_dir=out_model_dir,
-        device=train_config.device,
-    )
+    with validation_metrics:
+        config_save_path, checkpoint_path = train_nn(
+            data_train=train_loader,
+            data_test=val_loader,
+            config=train_config,
+            model_config=model_config,
+            out_dir=out_model_dir,
+            device=train_config.device,
+        )
 
     main_logger.info(f"Model has been trained. Configuration saved at {config_save_path}")
 
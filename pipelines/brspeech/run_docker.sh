@@ -12,6 +12,9 @@ SPOOF_DATASET_PATH=""
 OUTPUT_PATH="./outputs"
 DOCKER_ARGS=""
 PYTHON_ARGS=""
+METADATA_ARGS=""
+RESUME_STATE=""
+NO_RESUME=false
 
 # Function to log messages
 log() {
@@ -34,6 +37,10 @@ show_usage() {
     echo "  --build                 Build Docker image before running"
     echo "  --test_only             Run only the test phase"
     echo "  --checkpoint_path=<path> Path to checkpoint"
+    echo "  --resume[=<path>]       Resume training from a step-level resume state"
+    echo "                          (default: the latest state of this run's output folder)"
+    echo "  --no-resume             Start training from scratch even if a resume state exists"
+    echo "  --verify-audio          Decode-check every audio file first and leave broken ones out"
     echo "  --help                  Show this help message"
     echo ""
     echo "Examples:"
@@ -96,6 +103,22 @@ while [[ $# -gt 0 ]]; do
             PYTHON_ARGS="$PYTHON_ARGS --checkpoint_path $2"
             shift 2
             ;;
+        --resume=*)
+            RESUME_STATE="${1#*=}"
+            shift
+            ;;
+        --resume)
+            RESUME_STATE="latest"
+            shift
+            ;;
+        --no-resume)
+            NO_RESUME=true
+            shift
+            ;;
+        --verify-audio)
+            METADATA_ARGS="$METADATA_ARGS --verify_audio"
+            shift
+            ;;
         --help|-h)
             show_usage
             exit 0
@@ -165,6 +188,14 @@ if [[ "$PYTHON_ARGS" == *"--test_only"* ]] && [[ "$PYTHON_ARGS" != *"--checkpoin
 fi
 # --- End auto-find ---
 
+# --- Resume state for training ---
+# 'latest' is resolved by train_brspeech.py inside this run's <out_dir>/resume only
+if [[ "$PYTHON_ARGS" != *"--test_only"* ]] && [ "$NO_RESUME" = false ]; then
+    PYTHON_ARGS="$PYTHON_ARGS --resume ${RESUME_STATE:-latest}"
+    log "INFO" "🔁 Resuming from: ${RESUME_STATE:-latest} (use --no-resume to start over)"
+fi
+# --- End resume ---
+
 # Convert to absolute paths
 REAL_DATASET_PATH=$(realpath "$REAL_DATASET_PATH")
 SPOOF_DATASET_PATH=$(realpath "$SPOOF_DATASET_PATH")
@@ -204,6 +235,7 @@ export SPOOF_DATASET_PATH
 export OUTPUT_PATH
 export GPU_ID
 export PYTHON_ARGS
+export METADATA_ARGS
 
 # Detect which docker compose command is available
 if command -v docker-compose &> /dev/null; then
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+BrSpeech Data-Parallel Scaling Benchmark
+Runs DDP training steps on CPU with the gloo backend for 1, 2, 4, ... ranks
+and reports throughput and scaling efficiency. The per-rank batch is fixed
+(weak scaling) and the CPU threads are split evenly between ranks, so the
+efficiency shows how well the hardware is shared, not only the communication.
+Inputs are random waveforms; only the model step is timed.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import time
+from pathlib import Path
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn import BCEWithLogitsLoss
+from torch.optim import Adam
+
+from brspeech_distributed import StateDictDDP, reduce_values
+from train_brspeech import load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_rank(rank: int, world_size: int, port: int, model_config: dict, batch_size: int,
+             steps: int, warmup: int, threads: int, results):
+    from brspeech_models import build_model
+
+    os.environ.update({'MASTER_ADDR': '127.0.0.1', 'MASTER_PORT': str(port)})
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(threads)
+    torch.manual_seed(rank)
+    device = torch.device('cpu')
+
+    model = build_model(model_config, device)
+    model = StateDictDDP(model.train())
+    optimizer = Adam(model.parameters(), lr=model_config['training']['learning_rate'])
+    criterion = BCEWithLogitsLoss()
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+
+    def step():
+        batch_x = torch.randn(batch_size, nb_samp) * 0.1
+        batch_y = torch.randint(0, 2, (batch_size,)).float()
+        loss = criterion(model(batch_x).view(-1), batch_y)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    for _ in range(warmup):
+        step()
+    dist.barrier()
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    dist.barrier()
+    elapsed = reduce_values({'elapsed': time.perf_counter() - start}, 'max')['elapsed']
+    if rank == 0:
+        results.put({'world_size': world_size, 'seconds': elapsed,
+                     'samples': steps * batch_size * world_size})
+    dist.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DDP (gloo, CPU) scaling benchmark for the BrSpeech model')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--world_sizes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--batch_size', type=int, default=None, help='Per-rank batch (default: training.batch_size)')
+    parser.add_argument('--steps', type=int, default=5, help='Timed steps per run')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed steps per run')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='CPU threads shared by all ranks')
+    parser.add_argument('--output', type=str, default='fine_tuned_models/ddp_scaling.json')
+    args = parser.parse_args()
+
+    model_config = load_config(args.config)
+    batch_size = args.batch_size or model_config['training']['batch_size']
+    ctx = mp.get_context('spawn')
+
+    runs = []
+    for world_size in args.world_sizes:
+        threads = max(1, args.threads // world_size)
+        logger.info(f"Running {world_size} rank(s), {threads} thread(s) each...")
+        results = ctx.SimpleQueue()
+        mp.start_processes(run_rank, nprocs=world_size, start_method='spawn',
+                           args=(world_size, free_port(), model_config, batch_size,
+                                 args.steps, args.warmup, threads, results))
+        run = results.get()
+        run['threads_per_rank'] = threads
+        run['samples_per_sec'] = run['samples'] / run['seconds']
+        runs.append(run)
+
+    base = next((r for r in runs if r['world_size'] == 1), runs[0])
+    base_per_rank = base['samples_per_sec'] / base['world_size']
+    logger.info("=== DDP SCALING (gloo, CPU) ===")
+    for run in runs:
+        run['speedup'] = run['samples_per_sec'] / base['samples_per_sec']
+        run['efficiency'] = run['samples_per_sec'] / (run['world_size'] * base_per_rank)
+        logger.info(f"{run['world_size']} rank(s) | {run['samples_per_sec']:7.2f} samples/s | "
+                    f"speedup {run['speedup']:.2f}x | efficiency {run['efficiency'] * 100:.0f}%")
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'batch_size_per_rank': batch_size, 'threads': args.threads, 'runs': runs}, f, indent=2)
+    logger.info(f"Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+BrSpeech Loading Benchmark
+Compares samples/sec of the FLAC and shard dataset backends on the same clips,
+and the per-sample decode time of whole-file vs windowed seek decoding.
+"""
+
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+
+from brspeech_audio import load_audio, load_audio_window, crop_offset, fix_length, SAMPLE_RATE
+from src.datasets.brspeech_dataset import BrSpeechDataset
+from train_brspeech import load_config, build_train_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def time_backend(dataset, indices, batch_size: int, num_workers: int) -> dict:
+    """Iterate the given indices once and return the throughput."""
+    loader = DataLoader(
+        Subset(dataset, indices),
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+    )
+    start = time.perf_counter()
+    n = 0
+    for batch_x, _ in loader:
+        n += len(batch_x)
+    elapsed = time.perf_counter() - start
+    return {'samples': n, 'seconds': elapsed, 'samples_per_sec': n / elapsed}
+
+
+def time_decode_paths(samples_df, indices, nb_samp: int) -> list:
+    """Per-sample latency of whole-file decode + crop vs seek-decoding the crop window."""
+    results = []
+    for name in ('full', 'window'):
+        np.random.seed(0)
+        times = []
+        for i in indices:
+            row = samples_df.iloc[i]
+            num_samples = int(row['num_frames']) * SAMPLE_RATE // int(row['sample_rate'])
+            start = time.perf_counter()
+            offset = crop_offset(num_samples, nb_samp, random_crop=True)
+            if name == 'full':
+                waveform = load_audio(row['path'])[offset:offset + nb_samp]
+            else:
+                waveform = load_audio_window(row['path'], offset, nb_samp, int(row['sample_rate']))
+            fix_length(waveform, nb_samp)
+            times.append(time.perf_counter() - start)
+        times_ms = np.array(times) * 1000
+        results.append({
+            'decode': name,
+            'samples': len(times),
+            'mean_ms': float(times_ms.mean()),
+            'p50_ms': float(np.percentile(times_ms, 50)),
+            'p95_ms': float(np.percentile(times_ms, 95)),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark BrSpeechDataset loading and decoding paths')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--subset', type=str, default='train', choices=['train', 'val', 'test'])
+    parser.add_argument('--num_samples', type=int, default=2000, help='Clips to read per backend')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[0, 4])
+    parser.add_argument('--benchmarks', nargs='+', default=['backends', 'decode'],
+                        choices=['backends', 'decode'])
+    parser.add_argument('--output', type=str, help='Optional JSON file for the results')
+    args = parser.parse_args()
+
+    model_config = load_config(args.config)
+    train_config = build_train_config(model_config, torch.device('cpu'))
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+
+    results = []
+    flac = BrSpeechDataset(train_config, args.subset, backend='flac', nb_samp=nb_samp)
+    rng = np.random.default_rng(0)
+    chosen = rng.choice(len(flac), size=min(args.num_samples, len(flac)), replace=False)
+
+    if 'decode' in args.benchmarks:
+        if not {'num_frames', 'sample_rate'}.issubset(flac.samples_df.columns):
+            raise ValueError("Metadata has no num_frames/sample_rate columns; rerun prepare_brspeech_metadata.py")
+        for res in time_decode_paths(flac.samples_df, chosen, nb_samp):
+            results.append(res)
+            logger.info(f"{res['decode']:6} decode | {res['samples']} samples | mean {res['mean_ms']:.2f} ms | "
+                        f"p50 {res['p50_ms']:.2f} ms | p95 {res['p95_ms']:.2f} ms")
+
+    if 'backends' in args.benchmarks:
+        datasets = {
+            'flac': flac,
+            'shards': BrSpeechDataset(train_config, args.subset, backend='shards',
+                                      shard_dir=model_config['data']['shard_dir'], nb_samp=nb_samp),
+        }
+
+        # Benchmark the same clips on both backends, matched by path
+        flac_paths = flac.samples_df['path']
+        shard_pos = {p: i for i, p in enumerate(datasets['shards'].samples_df['path'])}
+        matched = [i for i in chosen if flac_paths.iloc[i] in shard_pos]
+        indices = {
+            'flac': matched,
+            'shards': [shard_pos[flac_paths.iloc[i]] for i in matched],
+        }
+
+        for num_workers in args.num_workers:
+            for backend, dataset in datasets.items():
+                res = time_backend(dataset, indices[backend], args.batch_size, num_workers)
+                res.update({'backend': backend, 'num_workers': num_workers})
+                results.append(res)
+                logger.info(f"{backend:6} | workers={num_workers} | {res['samples']} samples in "
+                            f"{res['seconds']:.1f}s | {res['samples_per_sec']:.1f} samples/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+BrSpeech Data-Pipeline Benchmark
+CPU-only benchmark of the input pipeline, stage by stage (metadata lookup,
+FLAC decode, crop/pad, RawBoost, collation), plus a sweep of the DataLoader
+worker/prefetch/persistent-worker settings exposed in the `dataloader`
+block of the config. Runs on a sample of the real metadata or on a synthetic
+dataset, and writes a JSON report.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.dataloader import default_collate
+
+from brspeech_audio import load_audio, crop_offset, fix_length, as_model_input
+from configuration.rawboost_config import _RawboostConfig
+from src.datasets.brspeech_dataset import BrSpeechDataset
+from train_brspeech import load_config, build_train_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def rate(n: int, seconds: float) -> dict:
+    return {'samples': n, 'seconds': seconds, 'samples_per_sec': n / seconds if seconds > 0 else float('inf')}
+
+
+def bench_stages(dataset, indices, nb_samp: int, batch_size: int, rawboost_algo: int) -> dict:
+    """Throughput of each stage in isolation, in the main process."""
+    samples_df = dataset.samples_df
+    stages = {}
+
+    start = time.perf_counter()
+    paths = [samples_df.iloc[i]['path'] for i in indices]
+    stages['metadata_lookup_iloc'] = rate(len(indices), time.perf_counter() - start)
+    path_array = samples_df['path'].to_numpy()
+    start = time.perf_counter()
+    _ = [path_array[i] for i in indices]
+    stages['metadata_lookup_array'] = rate(len(indices), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    decoded = [load_audio(p) for p in paths]
+    stages['flac_decode'] = rate(len(indices), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    windows = []
+    for waveform in decoded:
+        offset = crop_offset(len(waveform), nb_samp, random_crop=True)
+        windows.append(as_model_input(fix_length(waveform[offset:], nb_samp)))
+    stages['crop_pad'] = rate(len(indices), time.perf_counter() - start)
+
+    # RawBoost lives in the upstream BaseDataset; its cost is the difference
+    # between BaseDataset.__getitem__ with and without the algorithm enabled.
+    if rawboost_algo:
+        fast_path = dataset.seek_decode, dataset.shards
+        dataset.seek_decode, dataset.shards = False, None
+        start = time.perf_counter()
+        for i in indices:
+            dataset[i]
+        plain = time.perf_counter() - start
+        rawboost_config = dataset.config.rawboost_config
+        dataset.config.rawboost_config = _RawboostConfig(algo_id=rawboost_algo)
+        start = time.perf_counter()
+        for i in indices:
+            dataset[i]
+        boosted = time.perf_counter() - start
+        dataset.config.rawboost_config = rawboost_config
+        dataset.seek_decode, dataset.shards = fast_path
+        stages['getitem'] = rate(len(indices), plain)
+        stages['rawboost'] = rate(len(indices), max(boosted - plain, 1e-9))
+        stages['rawboost']['algo_id'] = rawboost_algo
+
+    labels = [0] * len(windows)
+    start = time.perf_counter()
+    n = 0
+    for b in range(0, len(windows), batch_size):
+        default_collate(list(zip(windows[b:b + batch_size], labels[b:b + batch_size])))
+        n += len(windows[b:b + batch_size])
+    stages['collate'] = rate(n, time.perf_counter() - start)
+    return stages
+
+
+def bench_loader(dataset, indices, batch_size: int, num_workers: int, prefetch_factor, persistent: bool,
+                 epochs: int) -> dict:
+    """samples/sec of a DataLoader setting; epoch 1 includes worker start-up."""
+    kwargs = {'num_workers': num_workers, 'batch_size': batch_size, 'shuffle': False}
+    if num_workers > 0:
+        kwargs['persistent_workers'] = persistent
+        if prefetch_factor is not None:
+            kwargs['prefetch_factor'] = prefetch_factor
+    loader = DataLoader(Subset(dataset, indices), **kwargs)
+    per_epoch = []
+    for _ in range(epochs):
+        start = time.perf_counter()
+        n = sum(len(batch_x) for batch_x, _ in loader)
+        per_epoch.append(rate(n, time.perf_counter() - start))
+    return {
+        'num_workers': num_workers,
+        'prefetch_factor': prefetch_factor,
+        'persistent_workers': persistent,
+        'epochs': per_epoch,
+        'steady_samples_per_sec': per_epoch[-1]['samples_per_sec'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the BrSpeech input pipeline on CPU')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--synthetic', action='store_true', help='Benchmark a generated dataset instead of metadata')
+    parser.add_argument('--subset', type=str, default='train', choices=['train', 'val', 'test'])
+    parser.add_argument('--num_samples', type=int, default=512, help='Clips sampled from the subset')
+    parser.add_argument('--batch_size', type=int, default=None, help='Default: training batch size')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4, 8])
+    parser.add_argument('--prefetch', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--persistent', type=int, nargs='+', default=[0, 1], help='persistent_workers values (0/1)')
+    parser.add_argument('--epochs', type=int, default=2, help='Epochs per loader setting')
+    parser.add_argument('--rawboost_algo', type=int, default=0, help='Also time this RawBoost algorithm')
+    parser.add_argument('--output', type=str, default='fine_tuned_models/pipeline_benchmark.json')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    model_config = load_config(args.config)
+    if args.synthetic:
+        from brspeech_synthetic import make_synthetic_dataset
+
+        tmp_dir = tempfile.mkdtemp(prefix='brspeech_bench_')
+        per_source = max(1, args.num_samples // 6)
+        model_config['data']['root_dir'] = str(make_synthetic_dataset(tmp_dir, per_source))
+        logger.info(f"Synthetic dataset written to {tmp_dir}")
+
+    train_config = build_train_config(model_config, torch.device('cpu'))
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+    batch_size = args.batch_size or model_config['training']['batch_size']
+    dataset = BrSpeechDataset(
+        train_config, args.subset,
+        backend=model_config['data'].get('backend', 'flac'),
+        shard_dir=model_config['data'].get('shard_dir'),
+        nb_samp=nb_samp,
+        seek_decode=model_config['data'].get('seek_decode', False),
+    )
+    rng = np.random.default_rng(0)
+    indices = rng.choice(len(dataset), size=min(args.num_samples, len(dataset)), replace=False).tolist()
+
+    report = {
+        'host': {'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'config': {'subset': args.subset, 'samples': len(indices), 'batch_size': batch_size,
+                   'synthetic': args.synthetic, 'backend': dataset.backend,
+                   'seek_decode': dataset.seek_decode},
+    }
+
+    logger.info("=== STAGES ===")
+    report['stages'] = bench_stages(dataset, indices, nb_samp, batch_size, args.rawboost_algo)
+    for stage, res in report['stages'].items():
+        logger.info(f"{stage:22} | {res['samples_per_sec']:10.1f} samples/s")
+
+    logger.info("=== DATALOADER SWEEP ===")
+    report['loader_sweep'] = []
+    for num_workers, prefetch, persistent in itertools.product(args.workers, args.prefetch, args.persistent):
+        if num_workers == 0 and (prefetch != args.prefetch[0] or persistent):
+            continue  # prefetch/persistence only apply to worker processes
+        res = bench_loader(dataset, indices, batch_size, num_workers,
+                           prefetch if num_workers else None, bool(persistent) and num_workers > 0, args.epochs)
+        report['loader_sweep'].append(res)
+        logger.info(f"workers={num_workers:2} prefetch={str(res['prefetch_factor']):4} "
+                    f"persistent={str(res['persistent_workers']):5} | "
+                    f"{res['steady_samples_per_sec']:8.1f} samples/s (epoch 1: {res['epochs'][0]['samples_per_sec']:.1f})")
+
+    best = max(report['loader_sweep'], key=lambda r: r['steady_samples_per_sec'])
+    report['recommended_dataloader'] = {
+        'num_workers': best['num_workers'],
+        'persistent_workers': best['persistent_workers'],
+        'prefetch_factor': best['prefetch_factor'],
+    }
+    logger.info(f"Recommended `dataloader` config: {report['recommended_dataloader']}")
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
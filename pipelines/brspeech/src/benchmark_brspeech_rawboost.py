@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+BrSpeech RawBoost Check
+Compares the batched RawBoost (brspeech_rawboost.py) with the per-sample
+reference that runs inside the upstream BaseDataset:
+
+    throughput   reference: BaseDataset.__getitem__ with the algorithm minus
+                 without it (as in benchmark_brspeech_pipeline.py), one clip
+                 at a time; batched: BatchRawBoost on (B, nb_samp) batches on
+                 CPU and, when available, CUDA
+    statistics   per-clip peak, RMS, crest factor, kurtosis, spectral centroid
+                 and energy above 4 kHz of reference- and batch-augmented clips,
+                 compared with two-sample Kolmogorov-Smirnov tests. The
+                 un-augmented clips are tested too, as a baseline of what a
+                 real difference looks like.
+
+The augmentation is random, so outputs are compared as distributions, not
+clip by clip.
+"""
+
+import argparse
+import json
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from scipy import stats
+
+from brspeech_rawboost import BatchRawBoost
+from configuration.rawboost_config import _RawboostConfig
+from src.datasets.brspeech_dataset import BrSpeechDataset
+from train_brspeech import build_train_config, load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+STATISTICS = ['peak', 'rms', 'crest', 'kurtosis', 'spectral_centroid', 'hf_energy_ratio']
+
+
+def clip_statistics(x: np.ndarray, sample_rate: int) -> dict:
+    """Per-clip statistics of a (N, T) array of waveforms."""
+    x = x.astype(np.float64)
+    peak = np.abs(x).max(axis=1)
+    rms = np.sqrt((x ** 2).mean(axis=1))
+    power = np.abs(np.fft.rfft(x, axis=1)) ** 2
+    freqs = np.fft.rfftfreq(x.shape[1], 1 / sample_rate)
+    total = power.sum(axis=1) + 1e-20
+    return {
+        'peak': peak,
+        'rms': rms,
+        'crest': peak / (rms + 1e-12),
+        'kurtosis': stats.kurtosis(x, axis=1),
+        'spectral_centroid': (power * freqs).sum(axis=1) / total,
+        'hf_energy_ratio': power[:, freqs >= 4000].sum(axis=1) / total,
+    }
+
+
+def compare(a: dict, b: dict) -> dict:
+    result = {}
+    for name in STATISTICS:
+        ks = stats.ks_2samp(a[name], b[name])
+        result[name] = {'ks': float(ks.statistic), 'p_value': float(ks.pvalue),
+                        'median_a': float(np.median(a[name])), 'median_b': float(np.median(b[name]))}
+    return result
+
+
+def load_clips(dataset, indices, algo_id: int):
+    """dataset[i] for each index with the reference RawBoost set to algo_id; returns (N, T) and seconds."""
+    rawboost_config = dataset.config.rawboost_config
+    dataset.config.rawboost_config = _RawboostConfig(algo_id=algo_id)
+    start = time.perf_counter()
+    clips = [np.asarray(dataset[i][0], dtype=np.float32).reshape(-1) for i in indices]
+    seconds = time.perf_counter() - start
+    dataset.config.rawboost_config = rawboost_config
+    return np.stack(clips), seconds
+
+
+def bench_batched(rawboost: BatchRawBoost, clips: np.ndarray, batch_size: int, device: str, repeats: int) -> dict:
+    batch = torch.from_numpy(clips[:batch_size]).to(device)
+    rawboost(batch)  # warm-up (FFT plans, CUDA context)
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        rawboost(batch)
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    seconds = time.perf_counter() - start
+    return {'device': device, 'batch_size': len(batch), 'seconds': seconds,
+            'samples_per_sec': repeats * len(batch) / seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batched vs per-sample RawBoost: throughput and output statistics')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--synthetic', action='store_true', help='Use a generated dataset instead of metadata')
+    parser.add_argument('--subset', type=str, default='train', choices=['train', 'val', 'test'])
+    parser.add_argument('--algos', type=int, nargs='+', default=[1, 2, 3, 4, 5, 6, 7, 8])
+    parser.add_argument('--num_samples', type=int, default=512, help='Clips per algorithm')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[32, 128])
+    parser.add_argument('--repeats', type=int, default=5, help='Timed batched calls per batch size')
+    parser.add_argument('--threads', type=int, default=1, help='CPU threads (1 = one DataLoader worker)')
+    parser.add_argument('--output', type=str, default='fine_tuned_models/rawboost_check.json')
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model_config = load_config(args.config)
+    if args.synthetic:
+        from brspeech_synthetic import make_synthetic_dataset
+
+        tmp_dir = tempfile.mkdtemp(prefix='brspeech_rawboost_')
+        per_source = max(1, args.num_samples // 6)
+        model_config['data']['root_dir'] = str(make_synthetic_dataset(tmp_dir, per_source))
+        logger.info(f"Synthetic dataset written to {tmp_dir}")
+
+    train_config = build_train_config(model_config, torch.device('cpu'))
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+    # The reference RawBoost only runs on the plain decode path
+    dataset = BrSpeechDataset(train_config, args.subset, backend='flac', nb_samp=nb_samp, seek_decode=False)
+    rng = np.random.default_rng(0)
+    indices = rng.choice(len(dataset), size=min(args.num_samples, len(dataset)), replace=False).tolist()
+    params = model_config.get('augmentation', {}).get('rawboost_params', {})
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+
+    clean, plain_seconds = load_clips(dataset, indices, 0)
+    clean_stats = clip_statistics(clean, 16000)
+    report = {'subset': args.subset, 'clips': len(indices), 'threads': args.threads, 'algos': {}}
+    for algo_id in args.algos:
+        reference, boosted_seconds = load_clips(dataset, indices, algo_id)
+        rawboost = BatchRawBoost(algo_id, **params)
+        batched = rawboost(torch.from_numpy(clean)).numpy()
+
+        reference_stats = clip_statistics(reference, 16000)
+        result = {
+            'reference_samples_per_sec': len(indices) / max(boosted_seconds - plain_seconds, 1e-9),
+            'batched': [bench_batched(rawboost, clean, bs, device, args.repeats)
+                        for device in devices for bs in args.batch_sizes],
+            'reference_vs_batched': compare(reference_stats, clip_statistics(batched, 16000)),
+            'reference_vs_clean': compare(reference_stats, clean_stats),
+        }
+        report['algos'][algo_id] = result
+
+        worst = max(STATISTICS, key=lambda s: result['reference_vs_batched'][s]['ks'])
+        fastest = max(result['batched'], key=lambda r: r['samples_per_sec'])
+        logger.info(f"algo {algo_id} | reference {result['reference_samples_per_sec']:8.1f} clips/s | "
+                    f"batched {fastest['samples_per_sec']:9.1f} clips/s ({fastest['device']}, B={fastest['batch_size']}) | "
+                    f"max KS vs reference {result['reference_vs_batched'][worst]['ks']:.3f} ({worst}), "
+                    f"vs clean {max(v['ks'] for v in result['reference_vs_clean'].values()):.3f}")
+        if result['reference_vs_batched'][worst]['p_value'] < 0.01:
+            logger.warning(f"⚠️ algo {algo_id}: {worst} distribution differs from the reference "
+                           f"(p={result['reference_vs_batched'][worst]['p_value']:.2g})")
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+BrSpeech SSL Depth Sweep
+Trains the model with the first K wav2vec2 transformer layers for each K
+(model.parameters.ssl_num_layers) and reports, per K:
+
+    seconds per epoch    wall clock of train_brspeech.py divided by --epochs,
+                         plus the instrumented training throughput
+    inference latency    batch-1 p50/p95 and batched clips/s on CPU, fresh process
+    EER                  on a class-balanced sample of the test metadata
+
+Each K trains in its own train_brspeech.py process and output directory.
+"""
+
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from brspeech_eval import eer_auc
+from brspeech_export import benchmark_artifact, in_fresh_process, load_runner, sample_inputs, score_all
+from train_brspeech import load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def train_run(config_path: Path, out_dir: Path, epochs: int, device: str, extra_args) -> float:
+    """Train one configuration in a subprocess; returns its wall-clock seconds."""
+    cmd = [sys.executable, str(Path(__file__).parent / 'train_brspeech.py'),
+           '--config', str(config_path), '--epochs', str(epochs), '--device', device,
+           '--out_dir', str(out_dir), '--instrument', *extra_args]
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True)
+    return time.perf_counter() - start
+
+
+def training_throughput(out_dir: Path):
+    """Mean samples/s over the instrumentation records of a run, if any."""
+    metrics_path = out_dir / 'train_metrics.jsonl'
+    if not metrics_path.exists():
+        return None
+    with open(metrics_path, 'r') as f:
+        rates = [r['samples_per_sec'] for r in map(json.loads, f) if r.get('samples_per_sec')]
+    return float(np.mean(rates)) if rates else None
+
+
+def latest_checkpoint(out_dir: Path) -> Path:
+    checkpoints = sorted(out_dir.rglob('*.pth'), key=lambda p: p.stat().st_mtime)
+    if not checkpoints:
+        raise FileNotFoundError(f"No .pth checkpoint written to {out_dir}")
+    return checkpoints[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep the number of wav2vec2 layers kept: epoch time, latency, EER')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--layers', type=int, nargs='+', default=[4, 6, 8, 12], help='Values of K to try')
+    parser.add_argument('--epochs', type=int, default=1, help='Training epochs per K')
+    parser.add_argument('--device', type=str, default='cuda', help='Training device')
+    parser.add_argument('--out_dir', type=str, default='fine_tuned_models/ssl_layer_sweep')
+    parser.add_argument('--eval_samples', type=int, default=1000, help='Balanced test clips for the EER')
+    parser.add_argument('--threads', type=int, default=4, help='CPU threads for the latency benchmark')
+    parser.add_argument('--bench_runs', type=int, default=50, help='Batch-1 runs per K')
+    parser.add_argument('--bench_batch', type=int, default=32)
+    parser.add_argument('--train_args', nargs=argparse.REMAINDER, default=[],
+                        help='Extra arguments passed to train_brspeech.py (must come last)')
+    args = parser.parse_args()
+
+    base_config = load_config(args.config)
+    out_root = Path(args.out_dir)
+    out_root.mkdir(parents=True, exist_ok=True)
+    waveforms, labels = sample_inputs(base_config, Path(base_config['data']['root_dir']) / 'test.csv', args.eval_samples)
+    logger.info(f"Evaluation sample: {len(labels)} clips")
+
+    report = {'epochs': args.epochs, 'eval_clips': len(labels), 'runs': []}
+    for num_layers in args.layers:
+        run_dir = out_root / f"L{num_layers}"
+        run_dir.mkdir(parents=True, exist_ok=True)
+        model_config = load_config(args.config)
+        model_config['model']['parameters']['ssl_num_layers'] = num_layers
+        config_path = run_dir / 'config.yaml'
+        with open(config_path, 'w') as f:
+            yaml.safe_dump(model_config, f, sort_keys=False)
+
+        logger.info(f"=== K={num_layers}: training {args.epochs} epoch(s) ===")
+        seconds = train_run(config_path, run_dir, args.epochs, args.device, args.train_args)
+        checkpoint = latest_checkpoint(run_dir)
+
+        run = load_runner('fp32', checkpoint, model_config, args.threads)
+        scores = score_all(run, waveforms, args.bench_batch)
+        del run
+        eer, auc = eer_auc(labels, scores)
+        bench = in_fresh_process(benchmark_artifact, 'fp32', str(checkpoint), model_config,
+                                 waveforms[:args.bench_batch], args.threads, args.bench_runs, args.bench_batch)
+        result = {
+            'ssl_num_layers': num_layers,
+            'checkpoint': str(checkpoint),
+            'train_seconds': seconds,
+            'seconds_per_epoch': seconds / args.epochs,
+            'train_samples_per_sec': training_throughput(run_dir),
+            'eer': eer * 100,
+            'auc': auc,
+            **bench,
+        }
+        report['runs'].append(result)
+        logger.info(f"✅ K={num_layers}: {result['seconds_per_epoch']:.0f}s/epoch | EER {result['eer']:.2f}% | "
+                    f"batch-1 p50 {bench['latency_p50_ms']:.1f}ms | {bench['batch_clips_per_sec']:.1f} clips/s")
+
+    logger.info("=== SSL DEPTH SWEEP ===")
+    for result in report['runs']:
+        logger.info(f"K={result['ssl_num_layers']:2} | {result['seconds_per_epoch']:7.0f} s/epoch | "
+                    f"EER {result['eer']:6.2f}% | p50 {result['latency_p50_ms']:7.1f} ms | "
+                    f"p95 {result['latency_p95_ms']:7.1f} ms | peak RSS {result['peak_rss_mb']:6.0f} MB")
+
+    report_path = out_root / 'ssl_layer_sweep.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved to: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+BrSpeech Start-up Benchmark
+Measures time-to-first-score of a --test_only style scoring job, each run in
+a fresh process: imports, model build (including the wav2vec2 backbone
+load), fine-tuned checkpoint load and the first scored batch.
+
+    torch.load          the original path (BRSPEECH_FAST_LOAD=0)
+    safetensors         memory-mapped copies of the backbone and the checkpoint
+    safetensors_fp16    the same with fp16 storage
+
+The copies are written to a temporary directory and the config is pointed at
+them, so nothing next to the real checkpoints changes. Each variant runs
+--repeats times; the first run reads from disk unless the files are already
+in the page cache, later runs are warm.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+PHASES = ['imports', 'build', 'load', 'first_score']
+
+
+def run_child(args):
+    """One cold start, timed from the parent's launch; prints a JSON line."""
+    import torch
+
+    from brspeech_checkpoints import fast_loading, load_state
+    from brspeech_models import build_model
+    from train_brspeech import load_config
+
+    model_config = load_config(args.config)
+    if args.ssl_path:
+        model_config['model']['parameters']['ssl_pretrained_path'] = args.ssl_path
+    device = torch.device(args.device if args.device == 'cpu' or torch.cuda.is_available() else 'cpu')
+    times = {'imports': time.time()}
+
+    # The steps of brspeech_eval.load_model, timed separately
+    with fast_loading(overwrite=True):
+        model = build_model(model_config, device)
+    times['build'] = time.time()
+    model.load_state_dict(load_state(args.checkpoint_path, map_location=device))
+    model.to(device)
+    model.eval()
+    times['load'] = time.time()
+
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+    with torch.inference_mode():
+        model(torch.randn(args.batch_size, nb_samp, device=device) * 0.1)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    times['first_score'] = time.time()
+
+    result, previous = {}, args.t0
+    for phase in PHASES:
+        result[phase] = times[phase] - previous
+        previous = times[phase]
+    result['time_to_first_score'] = times['first_score'] - args.t0
+    result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(result))
+
+
+def launch(script_args: list, env: dict) -> dict:
+    t0 = time.time()
+    output = subprocess.run([sys.executable, __file__, *script_args, '--t0', repr(t0)], env=env,
+                            capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(f"Start-up run failed:\n{output.stderr[-2000:]}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time-to-first-score with torch.load vs safetensors checkpoints')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--checkpoint_path', type=str,
+                        help='Fine-tuned .pth (default: a freshly built model saved to a temporary directory)')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per variant')
+    parser.add_argument('--output', type=str, default='fine_tuned_models/startup_benchmark.json')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--ssl_path', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--t0', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    import torch
+
+    from brspeech_checkpoints import convert_checkpoint
+    from brspeech_models import build_model
+    from train_brspeech import load_config
+
+    model_config = load_config(args.config)
+    ssl_path = model_config['model']['parameters']['ssl_pretrained_path']
+    tmp_dir = Path(tempfile.mkdtemp(prefix='brspeech_startup_'))
+    checkpoint_path = args.checkpoint_path
+    if checkpoint_path is None:
+        checkpoint_path = tmp_dir / 'model.pth'
+        torch.save(build_model(model_config, torch.device('cpu')).state_dict(), checkpoint_path)
+        logger.info(f"Saved a freshly built model as the fine-tuned checkpoint: {checkpoint_path}")
+
+    variants = {'torch.load': (str(ssl_path), str(checkpoint_path))}
+    for name, fp16 in (('safetensors', False), ('safetensors_fp16', True)):
+        out_dir = tmp_dir / name
+        variants[name] = (str(convert_checkpoint(ssl_path, out_dir / 'model.safetensors', fp16=fp16)),
+                          str(convert_checkpoint(checkpoint_path, out_dir / 'finetuned.safetensors', fp16=fp16)))
+    sizes = {name: sum(os.path.getsize(p) for p in paths) / 2**20 for name, paths in variants.items()}
+
+    report = {'device': args.device, 'batch_size': args.batch_size, 'variants': {}}
+    for name, (variant_ssl, variant_checkpoint) in variants.items():
+        env = {**os.environ, 'BRSPEECH_FAST_LOAD': '0' if name == 'torch.load' else '1'}
+        script_args = ['--child', '--config', args.config, '--ssl_path', variant_ssl,
+                       '--checkpoint_path', variant_checkpoint, '--device', args.device,
+                       '--batch_size', str(args.batch_size)]
+        runs = []
+        for repeat in range(args.repeats):
+            runs.append(launch(script_args, env))
+            logger.info(f"{name} run {repeat + 1}: {runs[-1]['time_to_first_score']:.2f}s to first score")
+        warm = runs[1:] or runs
+        report['variants'][name] = {
+            'checkpoint_mb': sizes[name],
+            'first_run': runs[0],
+            'warm_median': {k: statistics.median(r[k] for r in warm) for k in runs[0]},
+            'runs': runs,
+        }
+
+    base = report['variants']['torch.load']['warm_median']['time_to_first_score']
+    logger.info("=== TIME TO FIRST SCORE (warm median) ===")
+    logger.info(f"{'variant':18} {'MB':>7} " + ' '.join(f"{p:>11}" for p in PHASES) + f" {'total':>8} {'speedup':>8} {'RSS MB':>8}")
+    for name, variant in report['variants'].items():
+        median = variant['warm_median']
+        variant['speedup'] = base / median['time_to_first_score']
+        logger.info(f"{name:18} {variant['checkpoint_mb']:7.0f} "
+                    + ' '.join(f"{median[p]:10.2f}s" for p in PHASES)
+                    + f" {median['time_to_first_score']:7.2f}s {variant['speedup']:7.2f}x {median['max_rss_mb']:8.0f}")
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+BrSpeech Training-Mode Benchmark
+Compares samples/sec and peak RSS of training steps on CPU with gradient
+accumulation, bf16 autocast and activation checkpointing on and off.
+Every mode runs in its own process so peak RSS is measured per mode;
+inputs are random waveforms so only the model step is timed.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import time
+from pathlib import Path
+
+import torch
+from torch.nn import BCEWithLogitsLoss
+from torch.optim import Adam
+
+from brspeech_instrument import peak_rss_mb
+from brspeech_mixed_precision import TrainingMode
+from train_brspeech import load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def benchmark_modes(micro_batch: int, accum: int) -> dict:
+    """name -> (batch_size, TrainingMode kwargs)."""
+    return {
+        'full_batch_fp32': (micro_batch * accum, {}),
+        'micro_batch_fp32': (micro_batch, {}),
+        'accum_fp32': (micro_batch, {'grad_accum_steps': accum}),
+        'accum_bf16': (micro_batch, {'grad_accum_steps': accum, 'precision': 'bf16'}),
+        'accum_bf16_ckpt': (micro_batch, {'grad_accum_steps': accum, 'precision': 'bf16',
+                                          'activation_checkpointing': True}),
+    }
+
+
+def run_mode(model_config: dict, batch_size: int, mode_kwargs: dict, updates: int, warmup: int, threads: int) -> dict:
+    """Time `updates` optimizer updates (each of grad_accum_steps micro-batches) in this process."""
+    from brspeech_models import build_model
+
+    torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    device = torch.device('cpu')
+    mode = TrainingMode(device, **mode_kwargs)
+    model = mode.transform(build_model(model_config, device))
+    model.train()
+    optimizer = mode.optimizer(Adam)(model.parameters(), lr=model_config['training']['learning_rate'])
+    criterion = mode.criterion(BCEWithLogitsLoss)()
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+
+    def micro_step():
+        batch_x = torch.randn(batch_size, nb_samp) * 0.1
+        batch_y = torch.randint(0, 2, (batch_size,)).float()
+        output = model(batch_x).view(-1)
+        loss = criterion(output, batch_y)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    for _ in range(warmup * mode.grad_accum_steps):
+        micro_step()
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    for _ in range(updates * mode.grad_accum_steps):
+        micro_step()
+    elapsed = time.perf_counter() - start
+    samples = updates * mode.grad_accum_steps * batch_size
+    return {
+        'batch_size': batch_size,
+        'effective_batch': batch_size * mode.grad_accum_steps,
+        **mode_kwargs,
+        'samples': samples,
+        'seconds': elapsed,
+        'samples_per_sec': samples / elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_mb_after_warmup': rss_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU benchmark of gradient accumulation / bf16 / activation checkpointing')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--micro_batch', type=int, default=None, help='Default: training.batch_size')
+    parser.add_argument('--accum', type=int, default=8, help='Accumulation steps (full batch = micro_batch * accum)')
+    parser.add_argument('--updates', type=int, default=3, help='Timed optimizer updates per mode')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed optimizer updates per mode')
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--modes', nargs='+', help='Subset of modes to run (default: all)')
+    parser.add_argument('--output', type=str, default='fine_tuned_models/training_mode_benchmark.json')
+    args = parser.parse_args()
+
+    model_config = load_config(args.config)
+    micro_batch = args.micro_batch or model_config['training']['batch_size']
+    modes = benchmark_modes(micro_batch, args.accum)
+    selected = args.modes or list(modes)
+
+    # A fresh process per mode, so ru_maxrss reflects that mode alone
+    ctx = mp.get_context('spawn')
+    report = {'threads': args.threads, 'micro_batch': micro_batch, 'accum': args.accum, 'modes': {}}
+    for name in selected:
+        batch_size, mode_kwargs = modes[name]
+        logger.info(f"Running {name} (batch {batch_size}, {mode_kwargs or 'fp32'})...")
+        with ctx.Pool(1) as pool:
+            result = pool.apply(run_mode, (model_config, batch_size, mode_kwargs, args.updates, args.warmup, args.threads))
+        report['modes'][name] = result
+        logger.info(f"{name:18} | {result['samples_per_sec']:7.2f} samples/s | peak RSS {result['peak_rss_mb']:8.0f} MB")
+
+    logger.info("=== SUMMARY ===")
+    for name, result in report['modes'].items():
+        logger.info(f"{name:18} | effective batch {result['effective_batch']:3} | "
+                    f"{result['samples_per_sec']:7.2f} samples/s | peak RSS {result['peak_rss_mb']:8.0f} MB")
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
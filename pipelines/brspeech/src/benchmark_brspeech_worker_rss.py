@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+BrSpeech DataLoader Worker Memory Check
+Runs one full pass over a metadata subset with forked DataLoader workers that
+read their rows from either
+
+    dataframe  a pandas DataFrame of the CSV (the previous samples_df)
+    index      the compact SampleIndex (brspeech_sample_index.py)
+
+and samples each worker's memory from /proc/<pid>/smaps_rollup during the pass.
+Private memory (USS) that grows with the pass is heap copied on read.
+By default rows are only read (path + label), as the dataset does before
+decoding, so a full 444k-row pass takes seconds; --decode also decodes audio.
+Each mode runs in its own process.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from brspeech_audio import crop_offset, fix_length, label_to_int, load_audio
+from brspeech_sample_index import load_csv_index
+from train_brspeech import load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MODES = ['dataframe', 'index']
+
+
+class RowReader(Dataset):
+    """Reads one row per item the way BaseDataset does: samples_df.iloc[i]."""
+
+    def __init__(self, samples_df, nb_samp: int, decode: bool):
+        self.samples_df = samples_df
+        self.nb_samp = nb_samp
+        self.decode = decode
+
+    def __len__(self) -> int:
+        return len(self.samples_df)
+
+    def __getitem__(self, index):
+        row = self.samples_df.iloc[index]
+        label = label_to_int(row['label'])
+        if not self.decode:
+            return len(row['path']), label
+        waveform = load_audio(row['path'])
+        offset = crop_offset(len(waveform), self.nb_samp, random_crop=True)
+        return torch.from_numpy(fix_length(waveform[offset:], self.nb_samp)), label
+
+
+def memory_kb(pid: int) -> dict:
+    """Rss, Pss and private (USS) memory of a process in KB."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def child_pids() -> list:
+    pids = []
+    for tid in os.listdir('/proc/self/task'):
+        try:
+            with open(f'/proc/self/task/{tid}/children', 'r') as f:
+                pids += [int(p) for p in f.read().split()]
+        except OSError:
+            continue
+    return pids
+
+
+class MemorySampler(threading.Thread):
+    """Samples every child process (the DataLoader workers) at a fixed interval."""
+
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = {}
+        self._done = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        while not self._done.is_set():
+            for pid in child_pids():
+                try:
+                    self.samples.setdefault(pid, []).append((time.perf_counter() - start, memory_kb(pid)))
+                except OSError:
+                    continue
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def run_mode(mode: str, csv_path: str, nb_samp: int, workers: int, batch_size: int,
+             decode: bool, interval: float) -> dict:
+    start = time.perf_counter()
+    samples_df = pd.read_csv(csv_path) if mode == 'dataframe' else load_csv_index(csv_path)
+    load_seconds = time.perf_counter() - start
+    parent_kb = memory_kb(os.getpid())
+
+    loader = DataLoader(RowReader(samples_df, nb_samp, decode), batch_size=batch_size, shuffle=True,
+                        num_workers=workers, multiprocessing_context='fork')
+    sampler = MemorySampler(interval)
+    sampler.start()
+    start = time.perf_counter()
+    rows = sum(len(batch[1]) for batch in loader)
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+
+    # First and peak sample of each worker; growth = peak - first
+    per_worker = []
+    for pid, series in sampler.samples.items():
+        if len(series) < 2:
+            continue
+        first, peak = series[0][1], {k: max(s[1][k] for s in series) for k in ('rss', 'pss', 'uss')}
+        per_worker.append({'pid': pid, 'first': first, 'peak': peak,
+                           'uss_growth_mb': (peak['uss'] - first['uss']) / 1024})
+    return {
+        'rows': rows,
+        'load_seconds': load_seconds,
+        'pass_seconds': elapsed,
+        'parent_rss_mb': parent_kb['rss'] / 1024,
+        'workers': per_worker,
+        'worker_peak_uss_mb': float(np.mean([w['peak']['uss'] for w in per_worker]) / 1024) if per_worker else None,
+        'worker_peak_pss_mb': float(np.mean([w['peak']['pss'] for w in per_worker]) / 1024) if per_worker else None,
+        'worker_uss_growth_mb': float(np.mean([w['uss_growth_mb'] for w in per_worker])) if per_worker else None,
+    }
+
+
+def _run_mode_to_queue(queue, *args):
+    queue.put(run_mode(*args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-worker memory over a full pass: DataFrame vs compact sample index')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--subset', type=str, default='train')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--decode', action='store_true', help='Also decode audio (slow: a real epoch)')
+    parser.add_argument('--interval', type=float, default=0.5, help='Seconds between memory samples')
+    parser.add_argument('--output', type=str, default='fine_tuned_models/worker_rss.json')
+    args = parser.parse_args()
+
+    model_config = load_config(args.config)
+    csv_path = str(Path(model_config['data']['root_dir']) / f"{args.subset}.csv")
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+
+    report = {'csv': csv_path, 'workers': args.workers, 'decode': args.decode, 'modes': {}}
+    for mode in args.modes:
+        logger.info(f"Running {mode} ({args.workers} workers)...")
+        # A plain (non-daemon) process: pool workers may not start DataLoader workers
+        ctx = mp.get_context('spawn')
+        queue = ctx.SimpleQueue()
+        process = ctx.Process(target=_run_mode_to_queue, args=(queue, mode, csv_path, nb_samp, args.workers,
+                                                               args.batch_size, args.decode, args.interval))
+        process.start()
+        result = queue.get()
+        process.join()
+        report['modes'][mode] = result
+        if result['worker_peak_uss_mb'] is None:
+            logger.warning(f"⚠️ {mode}: pass too short to sample the workers, lower --interval")
+            continue
+        logger.info(f"{mode:10} | {result['rows']} rows in {result['pass_seconds']:.1f}s | "
+                    f"worker USS peak {result['worker_peak_uss_mb']:.0f} MB "
+                    f"(+{result['worker_uss_growth_mb']:.0f} MB over the pass)")
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Out-of-band checkpoint evaluation.
+Watches a training output directory and scores every checkpoint (*.pth) that
+train_nn saves on the full val (and test) sets, in this process, on spare CPU
+cores or another GPU, while training continues. One record per checkpoint
+and subset is appended to <watch_dir>/async_eval.jsonl: EER, AUC, accuracy
+and the EER of each TTS source against the real clips. Scores files go to
+<watch_dir>/async_eval/scores/.
+
+train_brspeech.py starts it when validation.async_eval is set and touches
+<watch_dir>/async_eval/DONE when training ends; the evaluator then scores
+the remaining checkpoints and exits. It also runs standalone, e.g. on a
+second GPU or another machine sharing the output directory:
+
+    python brspeech_async_eval.py --config configs/aasist_w2v_brspeech.yaml \
+        --watch_dir fine_tuned_models/run --device cuda:1 --subsets val test
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+import torch
+
+from brspeech_eval import evaluate, load_model
+from brspeech_validation import ASYNC_DIR, ASYNC_RESULTS, metrics_record
+from src.datasets.brspeech_dataset import BrSpeechDataset
+from train_brspeech import build_train_config, load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Directories of the training output that never hold train_nn checkpoints
+SKIP_DIRS = {'resume', ASYNC_DIR, 'profiler'}
+
+
+def find_checkpoints(watch_dir: Path) -> list:
+    """train_nn checkpoints under `watch_dir`, oldest first."""
+    found = [p for p in watch_dir.rglob('*.pth') if not SKIP_DIRS & set(p.relative_to(watch_dir).parts[:-1])]
+    return sorted(found, key=lambda p: p.stat().st_mtime_ns)
+
+
+def evaluated_keys(results_path: Path) -> set:
+    if not results_path.exists():
+        return set()
+    with open(results_path, 'r') as f:
+        return {(r['checkpoint'], r['mtime_ns'], r['subset']) for r in map(json.loads, f) if r}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score every new checkpoint of a training run in the background')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--watch_dir', type=str, required=True, help='Training output directory')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--threads', type=int, default=max(1, (os.cpu_count() or 4) // 4),
+                        help='CPU threads (default: a quarter of the cores)')
+    parser.add_argument('--subsets', nargs='+', default=['val'], choices=['val', 'test'])
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=2)
+    parser.add_argument('--poll', type=float, default=30.0, help='Seconds between directory scans')
+    parser.add_argument('--settle', type=float, default=10.0,
+                        help='Seconds a checkpoint must be unmodified before it is read')
+    parser.add_argument('--once', action='store_true', help='Score the current checkpoints and exit')
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model_config = load_config(args.config)
+    device = torch.device(args.device if args.device == 'cpu' or torch.cuda.is_available() else 'cpu')
+    watch_dir = Path(args.watch_dir)
+    results_path = watch_dir / ASYNC_RESULTS
+    done_file = watch_dir / ASYNC_DIR / 'DONE'
+    scores_dir = watch_dir / ASYNC_DIR / 'scores'
+    scores_dir.mkdir(parents=True, exist_ok=True)
+
+    train_config = build_train_config(model_config, device)
+    datasets = {
+        subset: BrSpeechDataset(
+            train_config, subset,
+            backend=model_config['data'].get('backend', 'flac'),
+            shard_dir=model_config['data'].get('shard_dir'),
+            nb_samp=model_config['model']['parameters'].get('nb_samp', 64600),
+            seek_decode=model_config['data'].get('seek_decode', False),
+        )
+        for subset in args.subsets
+    }
+    sources = {
+        subset: dataset.samples_df['synth' if 'synth' in dataset.samples_df.columns else 'label'].to_numpy()
+        for subset, dataset in datasets.items()
+    }
+    logger.info(f"Watching {watch_dir} on {device} ({args.threads} threads): "
+                + ", ".join(f"{s} {len(d)} clips" for s, d in datasets.items()))
+
+    done = evaluated_keys(results_path)
+    while True:
+        finished = done_file.exists()  # read before the scan, so the final checkpoints are included
+        for checkpoint in find_checkpoints(watch_dir):
+            stat = checkpoint.stat()
+            if not finished and time.time() - stat.st_mtime < args.settle:
+                continue  # possibly still being written
+            pending = [s for s in args.subsets if (str(checkpoint), stat.st_mtime_ns, s) not in done]
+            if not pending:
+                continue
+            model = load_model(model_config, checkpoint, device)
+            for subset in pending:
+                name = '_'.join(checkpoint.relative_to(watch_dir).with_suffix('').parts)
+                scores_file = scores_dir / f"{name}_{subset}.csv"
+                results = evaluate(model, datasets[subset], scores_file, device,
+                                   batch_size=args.batch_size, num_workers=args.num_workers)
+                # Scores are written in dataset order
+                scores = pd.read_csv(scores_file)
+                record = {
+                    'checkpoint': str(checkpoint),
+                    'mtime_ns': stat.st_mtime_ns,
+                    'subset': subset,
+                    **metrics_record(scores['true_label'].to_numpy(), scores['prediction_score'].to_numpy(),
+                                     sources[subset]),
+                    'loss': results['loss'],
+                    'seconds': results['seconds'],
+                    'scores_file': str(scores_file),
+                    'time': time.time(),
+                }
+                with open(results_path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+                done.add((str(checkpoint), stat.st_mtime_ns, subset))
+                per_source = ' | '.join(f"{k} {v:.2f}%" for k, v in record['per_source_eer'].items())
+                logger.info(f"✅ {checkpoint.name} {subset}: EER {record['eer']:.2f}% | AUC {record['auc']:.4f} | "
+                            f"{per_source} ({results['seconds']:.0f}s)")
+            del model
+        if finished or args.once:
+            break
+        time.sleep(args.poll)
+    logger.info(f"Evaluator finished: {len(done)} results in {results_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Audio helpers shared by the BrSpeech dataset backends and tools.
+"""
+
+import math
+
+import numpy as np
+import torch
+import torchaudio
+
+SAMPLE_RATE = 16000
+INT16_SCALE = 32768.0
+
+
+def label_to_int(label: str) -> int:
+    """Map a metadata label to the training target (1=real, 0=fake)."""
+    return 1 if label == 'bonafide' else 0
+
+
+def load_audio(path: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Decode a file to a mono float32 array at `sample_rate`."""
+    waveform, sr = torchaudio.load(path)
+    waveform = waveform.mean(dim=0)
+    if sr != sample_rate:
+        waveform = torchaudio.functional.resample(waveform, sr, sample_rate)
+    return waveform.numpy().astype(np.float32, copy=False)
+
+
+def probe_audio(path: str):
+    """Return (num_frames, sample_rate) from the file header without decoding."""
+    info = torchaudio.info(path)
+    return info.num_frames, info.sample_rate
+
+
+def load_audio_window(path: str, start: int, length: int, source_rate: int,
+                      sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Decode only samples [start, start + length) of a file, expressed at
+    `sample_rate`, by seeking to the matching frame range at `source_rate`.
+    Returns fewer samples when the file ends inside the window.
+    """
+    ratio = source_rate / sample_rate
+    frame_offset = int(start * ratio)
+    num_frames = int(math.ceil(length * ratio))
+    waveform, sr = torchaudio.load(path, frame_offset=frame_offset, num_frames=num_frames)
+    waveform = waveform.mean(dim=0)
+    if sr != sample_rate:
+        waveform = torchaudio.functional.resample(waveform, sr, sample_rate)
+    return waveform[:length].numpy().astype(np.float32, copy=False)
+
+
+def to_int16(waveform: np.ndarray) -> np.ndarray:
+    """Quantize a float waveform in [-1, 1] to int16 PCM."""
+    return (np.clip(waveform, -1.0, 1.0 - 1.0 / INT16_SCALE) * INT16_SCALE).astype(np.int16)
+
+
+def crop_offset(num_samples: int, nb_samp: int, random_crop: bool) -> int:
+    """Start of the `nb_samp` window: random for training, 0 for evaluation."""
+    if not random_crop or num_samples <= nb_samp:
+        return 0
+    return int(np.random.randint(0, num_samples - nb_samp + 1))
+
+
+def fix_length(waveform: np.ndarray, nb_samp: int) -> np.ndarray:
+    """Truncate to `nb_samp`, or repeat-pad short clips up to `nb_samp`."""
+    if len(waveform) >= nb_samp:
+        return waveform[:nb_samp]
+    if len(waveform) == 0:
+        return np.zeros(nb_samp, dtype=np.float32)
+    num_repeats = int(nb_samp / len(waveform)) + 1
+    return np.tile(waveform, num_repeats)[:nb_samp]
+
+
+def as_model_input(waveform: np.ndarray) -> torch.Tensor:
+    """Float32 tensor from a float or int16 window."""
+    if waveform.dtype == np.int16:
+        waveform = waveform.astype(np.float32) / INT16_SCALE
+    return torch.from_numpy(np.ascontiguousarray(waveform, dtype=np.float32))
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+Memory-mapped safetensors checkpoints for fast start-up.
+
+torch.load unpickles a checkpoint and copies every tensor into fresh memory;
+for the wav2vec2 backbone and a fine-tuned model that is several hundred MB,
+twice, before the first clip is scored. This module keeps a safetensors copy
+next to each checkpoint, optionally with float tensors stored as fp16:
+
+    checkpoints/w2v_base/pytorch_model.bin -> checkpoints/w2v_base/model.safetensors
+    fine_tuned_models/run/best.pth         -> fine_tuned_models/run/best.safetensors
+
+The copy records the size and mtime of its source and is only used while
+they match. safetensors files are memory-mapped and read straight into the
+destination tensors (or onto the GPU), without unpickling.
+
+fast_loading() serves torch.load calls from these copies while a model is
+built, so get_model's backbone load needs no changes upstream. With
+overwrite=True (a full fine-tuned checkpoint is loaded right after the build)
+it also skips the random weight init and the backbone copy, since every
+weight is about to be overwritten.
+
+Set BRSPEECH_FAST_LOAD=0 to disable all of this (plain torch.load).
+
+    python brspeech_checkpoints.py checkpoints/w2v_base/pytorch_model.bin fine_tuned_models/run/*.pth --fp16
+    python brspeech_checkpoints.py --config configs/aasist_w2v_brspeech.yaml
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+import torch
+import torch.nn as nn
+from torch.nn.modules.module import _IncompatibleKeys
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+FORMAT = 'brspeech-safetensors-1'
+_torch_load = torch.load
+
+
+def enabled() -> bool:
+    return os.getenv('BRSPEECH_FAST_LOAD', '1') != '0'
+
+
+def safetensors_path(path) -> Path:
+    """Where the safetensors copy of a checkpoint lives (Hugging Face naming for pytorch_model.bin)."""
+    path = Path(path)
+    if path.suffix == '.safetensors':
+        return path
+    if path.name == 'pytorch_model.bin':
+        return path.with_name('model.safetensors')
+    return path.with_suffix('.safetensors')
+
+
+def _read_metadata(path: Path) -> dict:
+    from safetensors import safe_open
+
+    with safe_open(str(path), framework='pt') as f:
+        return f.metadata() or {}
+
+
+def resolve(path) -> Optional[Path]:
+    """The safetensors file to read for `path`, or None to fall back to torch.load."""
+    path = Path(path)
+    if path.suffix == '.safetensors':
+        return path
+    if not enabled():
+        return None
+    candidate = safetensors_path(path)
+    if not candidate.exists() or not path.exists():
+        return None
+    try:
+        metadata = _read_metadata(candidate)
+    except ImportError:
+        return None
+    stat = os.stat(path)
+    if metadata.get('source_size') != str(stat.st_size) or metadata.get('source_mtime_ns') != str(stat.st_mtime_ns):
+        logger.warning(f"⚠️ {candidate} is out of date for {path}; loading {path.name} (reconvert to speed this up)")
+        return None
+    return candidate
+
+
+def _device(map_location) -> str:
+    if isinstance(map_location, (str, torch.device)):
+        device = torch.device(map_location)
+        if device.type == 'cuda' and device.index is None:
+            device = torch.device('cuda', torch.cuda.current_device())
+        return str(device)
+    return 'cpu'
+
+
+def load_safetensors(path, map_location='cpu', restore_dtype: bool = False) -> dict:
+    """
+    State dict of a safetensors file. fp16-stored tensors stay fp16 (load_state_dict
+    casts them while copying) unless restore_dtype asks for the original dtypes.
+    """
+    from safetensors.torch import load_file
+
+    state = load_file(str(path), device=_device(map_location))
+    if restore_dtype:
+        for key in json.loads(_read_metadata(Path(path)).get('fp16_keys', '[]')):
+            state[key] = state[key].float()
+    return state
+
+
+def load_state(path, map_location='cpu') -> dict:
+    """A checkpoint's state dict, from its safetensors copy when there is a current one."""
+    fast = resolve(path)
+    if fast is not None:
+        return load_safetensors(fast, map_location)
+    return _torch_load(path, map_location=map_location)
+
+
+def convert_checkpoint(path, out_path=None, fp16: bool = False) -> Path:
+    """Write the safetensors copy of a torch checkpoint (a state dict, or {'state_dict'/'model': ...})."""
+    from safetensors.torch import save_file
+
+    path = Path(path)
+    out_path = Path(out_path) if out_path else safetensors_path(path)
+    try:
+        state = _torch_load(path, map_location='cpu', mmap=True, weights_only=True)
+    except RuntimeError:  # legacy (non-zip) checkpoints cannot be memory-mapped
+        state = _torch_load(path, map_location='cpu')
+    for key in ('state_dict', 'model'):
+        if isinstance(state.get(key), dict):
+            state = state[key]
+    tensors, seen, fp16_keys = {}, set(), []
+    for key, tensor in state.items():
+        if not torch.is_tensor(tensor):
+            continue
+        if fp16 and tensor.dtype == torch.float32:
+            tensor = tensor.half()
+            fp16_keys.append(key)
+        # safetensors stores no shared or strided storage
+        if tensor.untyped_storage().data_ptr() in seen or not tensor.is_contiguous():
+            tensor = tensor.contiguous().clone()
+        seen.add(tensor.untyped_storage().data_ptr())
+        tensors[key] = tensor
+    stat = os.stat(path)
+    metadata = {
+        'format': FORMAT,
+        'source': str(path.resolve()),
+        'source_size': str(stat.st_size),
+        'source_mtime_ns': str(stat.st_mtime_ns),
+        'fp16_keys': json.dumps(fp16_keys),
+    }
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_suffix('.safetensors.tmp')
+    save_file(tensors, str(tmp_path), metadata=metadata)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class _Overwritten(dict):
+    """State dict whose weights will be overwritten; load_state_dict skips it during fast_loading(overwrite=True)."""
+
+
+@contextlib.contextmanager
+def skip_init():
+    """Build modules without running their random weight init (the weights must be loaded afterwards)."""
+    originals = {name: fn for name, fn in vars(nn.init).items()
+                 if name.endswith('_') and not name.startswith('_') and callable(fn)}
+
+    def keep(tensor, *args, **kwargs):
+        return tensor
+
+    for name in originals:
+        setattr(nn.init, name, keep)
+    try:
+        with contextlib.ExitStack() as stack:
+            try:
+                from transformers.modeling_utils import no_init_weights
+
+                stack.enter_context(no_init_weights())
+            except ImportError:
+                pass
+            yield
+    finally:
+        for name, fn in originals.items():
+            setattr(nn.init, name, fn)
+
+
+@contextlib.contextmanager
+def fast_loading(overwrite: bool = False):
+    """
+    Serve torch.load of checkpoints with a current safetensors copy from that
+    copy. With overwrite=True every weight loaded or initialized inside the
+    block is assumed to be replaced afterwards (by a strict load of a full
+    checkpoint), so init and state-dict copies are skipped.
+    """
+    if not enabled():
+        yield
+        return
+
+    def load(f, map_location=None, *args, **kwargs):
+        fast = resolve(f) if isinstance(f, (str, os.PathLike)) else None
+        if fast is not None:
+            state = load_safetensors(fast, map_location, restore_dtype=not overwrite)
+        else:
+            state = _torch_load(f, map_location, *args, **kwargs)
+        return _Overwritten(state) if overwrite and isinstance(state, dict) else state
+
+    original_load_state_dict = nn.Module.load_state_dict
+
+    def load_state_dict(module, state_dict, *args, **kwargs):
+        if isinstance(state_dict, _Overwritten):
+            return _IncompatibleKeys([], [])
+        return original_load_state_dict(module, state_dict, *args, **kwargs)
+
+    torch.load = load
+    try:
+        with contextlib.ExitStack() as stack:
+            if overwrite:
+                nn.Module.load_state_dict = load_state_dict
+                stack.callback(setattr, nn.Module, 'load_state_dict', original_load_state_dict)
+                stack.enter_context(skip_init())
+            yield
+    finally:
+        torch.load = _torch_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write memory-mapped safetensors copies of checkpoints')
+    parser.add_argument('checkpoints', nargs='*', help='pytorch_model.bin / .pth files')
+    parser.add_argument('--config', type=str, help="Also convert the config's ssl_pretrained_path")
+    parser.add_argument('--fp16', action='store_true', help='Store float32 tensors as fp16 (half the bytes to read)')
+    args = parser.parse_args()
+
+    paths = list(args.checkpoints)
+    if args.config:
+        from train_brspeech import load_config
+
+        paths.append(load_config(args.config)['model']['parameters']['ssl_pretrained_path'])
+    if not paths:
+        parser.error('no checkpoints given')
+    for path in paths:
+        start = time.perf_counter()
+        out_path = convert_checkpoint(path, fp16=args.fp16)
+        logger.info(f"✅ {path} -> {out_path} ({os.path.getsize(out_path) / 2**20:.0f} MB"
+                    f"{', fp16' if args.fp16 else ''}, {time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
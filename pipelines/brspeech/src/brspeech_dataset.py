@@ -1,24 +1,60 @@
 from pathlib import Path
-import pandas as pd
-from typing import Literal
+import numpy as np
+from typing import Literal, Optional
 
 from src.datasets.base_dataset import BaseDataset
 from configuration.df_train_config import DF_Train_Config
+from brspeech_audio import SAMPLE_RATE, label_to_int, crop_offset, fix_length, as_model_input, load_audio_window
+from brspeech_sample_index import load_csv_index
 
 
 class BrSpeechDataset(BaseDataset):
     """
     Dataset class for BrSpeech metadata CSVs.
     Inherits from BaseDataset to reuse audio loading and processing logic.
+
+    backend='flac' decodes the files listed in the metadata CSV (default).
+    With seek_decode and the num_frames/sample_rate columns written by
+    prepare_brspeech_metadata.py, only the nb_samp crop window is decoded.
+    backend='shards' reads pre-decoded int16 windows from the memmap shards
+    written by brspeech_shards.py. RawBoost is not applied on either fast path.
+
+    samples_df is a SampleIndex (brspeech_sample_index.py), not a DataFrame,
+    so DataLoader workers reading rows do not copy the metadata heap.
     """
-    def __init__(self, config: DF_Train_Config, subset: Literal['train', 'val', 'test']):
-        
-        # Load metadata CSV
-        csv_path = Path(config.root_dir) / f"{subset}.csv"
-        if not csv_path.exists():
-            raise FileNotFoundError(f"Metadata file not found at: {csv_path}")
-        
-        samples_df = pd.read_csv(csv_path)
+    def __init__(
+        self,
+        config: DF_Train_Config,
+        subset: Literal['train', 'val', 'test'],
+        backend: Literal['flac', 'shards'] = 'flac',
+        shard_dir: Optional[str] = None,
+        nb_samp: int = 64600,
+        seek_decode: bool = False,
+    ):
+        self.subset = subset
+        self.backend = backend
+        self.nb_samp = nb_samp
+        self.shards = None
+
+        if backend == 'shards':
+            from brspeech_shards import ShardReader
+
+            if shard_dir is None:
+                raise ValueError("shard_dir is required for the 'shards' backend")
+            subset_dir = Path(shard_dir) / subset
+            if not (subset_dir / 'index.csv').exists():
+                raise FileNotFoundError(f"Shard index not found at: {subset_dir / 'index.csv'}")
+            self.shards = ShardReader(subset_dir)
+            samples_df = load_csv_index(subset_dir / 'index.csv')
+        elif backend == 'flac':
+            # Load metadata CSV (as a compact, memory-mapped index)
+            csv_path = Path(config.root_dir) / f"{subset}.csv"
+            if not csv_path.exists():
+                raise FileNotFoundError(f"Metadata file not found at: {csv_path}")
+
+            samples_df = load_csv_index(csv_path)
+        else:
+            raise ValueError(f"Unknown dataset backend: {backend}")
 
         # Initialize parent class
         super().__init__(
@@ -26,6 +62,32 @@ class BrSpeechDataset(BaseDataset):
             config=config,
             subset=subset
         )
+        self.seek_decode = (
+            backend == 'flac' and seek_decode
+            and {'num_frames', 'sample_rate'}.issubset(samples_df.columns)
+        )
+        self._labels = samples_df.map_categories('label', label_to_int, np.int8)
+        if self.seek_decode:
+            self._source_rates = samples_df.codes('sample_rate').astype(np.int64)
+            # Clip lengths expressed at the model sample rate
+            self._num_samples = samples_df.codes('num_frames').astype(np.int64) * SAMPLE_RATE // self._source_rates
 
     def __len__(self) -> int:
-        return len(self.samples_df) 
\ No newline at end of file
+        return len(self.samples_df)
+
+    def __getitem__(self, index):
+        if self.seek_decode:
+            return self._get_window(index)
+        if self.shards is None:
+            return super().__getitem__(index)
+
+        num_samples = self.shards.num_samples(index)
+        start = crop_offset(num_samples, self.nb_samp, random_crop=self.subset == 'train')
+        window = self.shards.read(index, start, self.nb_samp)
+        return as_model_input(fix_length(window, self.nb_samp)), int(self._labels[index])
+
+    def _get_window(self, index):
+        """Choose the crop first, then decode only that frame range."""
+        start = crop_offset(int(self._num_samples[index]), self.nb_samp, random_crop=self.subset == 'train')
+        window = load_audio_window(self.samples_df.path(index), start, self.nb_samp, int(self._source_rates[index]))
+        return as_model_input(fix_length(window, self.nb_samp)), int(self._labels[index])
@@ -0,0 +1,186 @@
+"""
+Data-parallel training for train_brspeech.py, launched with torchrun.
+
+    torchrun --nproc_per_node 4 train_brspeech.py --config configs/aasist_w2v_brspeech.yaml
+
+Every rank runs train_nn. The model train_nn builds is wrapped in
+DistributedDataParallel through model_transform, and the train loader
+shards the data per rank with drop-last and per-epoch shuffling. Only rank 0
+writes train_nn's checkpoints and logs at INFO level. NCCL is used on GPUs and
+gloo on CPU, so a multi-process run also works on a CPU-only machine.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DistributedSampler
+
+logger = logging.getLogger(__name__)
+
+
+class DistributedContext:
+    """Rank, world size and device of this process (world_size 1 when not launched by torchrun)."""
+
+    def __init__(self, rank: int = 0, world_size: int = 1, local_rank: int = 0,
+                 device: Optional[torch.device] = None, backend: Optional[str] = None):
+        self.rank = rank
+        self.world_size = world_size
+        self.local_rank = local_rank
+        self.device = device
+        self.backend = backend
+
+    @property
+    def enabled(self) -> bool:
+        return self.world_size > 1
+
+    @property
+    def is_main(self) -> bool:
+        return self.rank == 0
+
+
+def launched_with_torchrun() -> bool:
+    return int(os.environ.get('WORLD_SIZE', '1')) > 1
+
+
+def init_distributed(device_type: str, backend: Optional[str] = None) -> DistributedContext:
+    """Join the process group set up by torchrun (env:// rendezvous)."""
+    if not launched_with_torchrun():
+        return DistributedContext(device=torch.device(device_type))
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    if device_type == 'cuda':
+        torch.cuda.set_device(local_rank)
+        device = torch.device('cuda', local_rank)
+    else:
+        device = torch.device('cpu')
+    backend = backend or ('nccl' if device.type == 'cuda' else 'gloo')
+    dist.init_process_group(backend=backend)
+    ctx = DistributedContext(dist.get_rank(), dist.get_world_size(), local_rank, device, backend)
+    setup_rank_logging(ctx)
+    return ctx
+
+
+def setup_rank_logging(ctx: DistributedContext):
+    """Prefix log lines with the rank; ranks other than 0 only log warnings and errors."""
+    root = logging.getLogger()
+    for handler in root.handlers:
+        handler.setFormatter(logging.Formatter(f'%(asctime)s - [rank {ctx.rank}] %(levelname)s - %(message)s'))
+    if not ctx.is_main:
+        root.setLevel(logging.WARNING)
+
+
+def cleanup_distributed():
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
+
+
+class StateDictDDP(DistributedDataParallel):
+    """
+    DistributedDataParallel whose state_dict/load_state_dict and attribute
+    lookups go to the wrapped model, so train_nn's checkpoints keep the
+    single-process key names and can be loaded by every other script.
+    """
+
+    def state_dict(self, *args, **kwargs):
+        return self.module.state_dict(*args, **kwargs)
+
+    def load_state_dict(self, state_dict, strict: bool = True, **kwargs):
+        return self.module.load_state_dict(state_dict, strict=strict, **kwargs)
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.module, name)
+
+
+def ddp_transform(ctx: DistributedContext, find_unused_parameters: bool = False):
+    """model_transform callable wrapping the model built by train_nn in DDP."""
+
+    def transform(model: torch.nn.Module) -> torch.nn.Module:
+        model.to(ctx.device)
+        device_ids = [ctx.local_rank] if ctx.device.type == 'cuda' else None
+        return StateDictDDP(model, device_ids=device_ids, find_unused_parameters=find_unused_parameters)
+
+    return transform
+
+
+class _EpochLoader:
+    """Proxy around a DataLoader with a DistributedSampler that calls set_epoch on every pass."""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._epoch = 0
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def __iter__(self):
+        self._loader.sampler.set_epoch(self._epoch)
+        self._epoch += 1
+        return iter(self._loader)
+
+
+def distributed_sampler(dataset, ctx: DistributedContext, seed: int) -> DistributedSampler:
+    return DistributedSampler(dataset, num_replicas=ctx.world_size, rank=ctx.rank,
+                              shuffle=True, seed=seed, drop_last=True)
+
+
+def wrap_epoch_loader(loader):
+    return _EpochLoader(loader)
+
+
+def reduce_values(values: dict, op: str = 'sum') -> dict:
+    """All-reduce a dict of numbers across ranks (sum, max or mean); identity without a process group."""
+    if not (dist.is_available() and dist.is_initialized()):
+        return dict(values)
+    keys = sorted(values)
+    tensor = torch.tensor([float(values[k]) for k in keys], dtype=torch.float64)
+    if dist.get_backend() == 'nccl':
+        tensor = tensor.cuda()
+    reduce_op = dist.ReduceOp.MAX if op == 'max' else dist.ReduceOp.SUM
+    dist.all_reduce(tensor, op=reduce_op)
+    if op == 'mean':
+        tensor /= dist.get_world_size()
+    return dict(zip(keys, tensor.cpu().tolist()))
+
+
+def reduce_array(array: np.ndarray) -> np.ndarray:
+    """Sum a float64 array across ranks; identity without a process group."""
+    if not (dist.is_available() and dist.is_initialized()):
+        return array
+    tensor = torch.from_numpy(np.ascontiguousarray(array, dtype=np.float64))
+    if dist.get_backend() == 'nccl':
+        tensor = tensor.cuda()
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.cpu().numpy()
+
+
+class RankOutputDir:
+    """train_nn output directory: the real one on rank 0, a throw-away one elsewhere."""
+
+    def __init__(self, out_dir, ctx: DistributedContext):
+        self.out_dir = out_dir
+        self.ctx = ctx
+        self._tmp = None
+
+    def __enter__(self):
+        if self.ctx.is_main:
+            return self.out_dir
+        self._tmp = Path(tempfile.mkdtemp(prefix=f'brspeech_rank{self.ctx.rank}_'))
+        return self._tmp
+
+    def __exit__(self, *exc):
+        if self._tmp is not None:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+        return False
@@ -0,0 +1,260 @@
+"""
+Batched evaluation engine for BrSpeech checkpoints.
+Runs a dataset through the model under inference_mode with a large batch,
+looks paths up from returned sample indices, and streams scores to disk in
+chunks (CSV or Parquet) so memory stays bounded on any test set size.
+"""
+
+import contextlib
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+logger = logging.getLogger(__name__)
+
+SCORE_COLUMNS = ['path', 'true_label', 'prediction_score', 'predicted_label']
+
+
+class IndexedDataset(Dataset):
+    """Wraps a (x, y) dataset so each item also carries its sample index."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        x, y = self.dataset[index]
+        return x, y, index
+
+
+class TimedIndexedDataset(IndexedDataset):
+    """IndexedDataset that also returns when the sample's decode started (time.monotonic, same clock in workers)."""
+
+    def __getitem__(self, index):
+        start = time.monotonic()
+        x, y = self.dataset[index]
+        return x, y, index, start
+
+
+class ScoreWriter:
+    """
+    Appends score chunks to a CSV or Parquet file. Parquet needs pyarrow and
+    is picked from the file extension.
+    """
+
+    def __init__(self, path, extra_columns=()):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.columns = SCORE_COLUMNS + list(extra_columns)
+        self.parquet = self.path.suffix == '.parquet'
+        self.rows_written = 0
+        self._writer = None
+        if not self.parquet:
+            pd.DataFrame(columns=self.columns).to_csv(self.path, index=False)
+
+    def write(self, chunk: pd.DataFrame):
+        chunk = chunk[self.columns]
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            chunk.to_csv(self.path, mode='a', header=False, index=False)
+        self.rows_written += len(chunk)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OnnxModel(torch.nn.Module):
+    """Runs an exported ONNX graph (brspeech_export.py) behind the torch model interface, on CPU."""
+
+    def __init__(self, path):
+        super().__init__()
+        import onnxruntime as ort
+
+        self.session = ort.InferenceSession(str(path), providers=['CPUExecutionProvider'])
+
+    def forward(self, x):
+        logits = self.session.run(None, {'waveform': x.detach().float().cpu().numpy()})[0]
+        return torch.from_numpy(logits).reshape(len(x), -1)
+
+
+def load_model(model_config: dict, checkpoint_path, device: torch.device):
+    """
+    Build the model through build_model and load a fine-tuned checkpoint for inference.
+    Artifacts from brspeech_export.py load directly: TorchScript int8 (.pt) and ONNX (.onnx), CPU only.
+    Checkpoints with a safetensors copy (brspeech_checkpoints.py) are memory-mapped; since the
+    checkpoint replaces every weight, the build skips weight init and the backbone copy.
+    """
+    suffix = Path(checkpoint_path).suffix
+    if suffix == '.onnx':
+        return OnnxModel(checkpoint_path).eval()
+    if suffix == '.pt':
+        return torch.jit.load(str(checkpoint_path), map_location='cpu').eval()
+
+    from brspeech_checkpoints import fast_loading, load_state
+    from brspeech_models import build_model
+
+    with fast_loading(overwrite=True):
+        model = build_model(model_config, device)
+    model.load_state_dict(load_state(checkpoint_path, map_location=device))
+    model.to(device)
+    model.eval()
+    return model
+
+
+def autocast_context(device: torch.device, bf16: bool):
+    """bf16 autocast when requested (CPU or GPU), otherwise a no-op."""
+    if not bf16:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+
+
+def latency_summary(batch_seconds, clip_seconds) -> dict:
+    """
+    Percentiles of the per-batch wall time and of the end-to-end clip latency:
+    from the start of a clip's decode to its score on the host (decode, any
+    wait in the prefetch queue, transfer and forward).
+    """
+    batch_ms = np.asarray(batch_seconds) * 1000
+    clip_ms = np.asarray(clip_seconds) * 1000
+    return {
+        'batch_p50_ms': float(np.percentile(batch_ms, 50)),
+        'batch_p95_ms': float(np.percentile(batch_ms, 95)),
+        'batch_p99_ms': float(np.percentile(batch_ms, 99)),
+        'clip_p50_ms': float(np.percentile(clip_ms, 50)),
+        'clip_p99_ms': float(np.percentile(clip_ms, 99)),
+    }
+
+
+def evaluate(model, dataset, scores_file, device: torch.device, batch_size: int = 64,
+             num_workers: int = 4, bf16: bool = False, chunk_size: int = 50000) -> dict:
+    """
+    Score every sample of `dataset` and stream the results to `scores_file`.
+    Returns loss, accuracy, class counts, throughput and latency percentiles.
+    """
+    loader = DataLoader(
+        TimedIndexedDataset(dataset),
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        pin_memory=device.type == 'cuda',
+    )
+    paths = dataset.samples_df['path'].to_numpy()
+    criterion = torch.nn.BCEWithLogitsLoss(reduction='sum')
+
+    model.eval()
+    loss_sum, n_correct, n_real, n_total = 0.0, 0, 0, 0
+    pending, pending_rows = [], 0
+    batch_seconds, clip_seconds = [], []
+
+    with ScoreWriter(scores_file) as writer, torch.inference_mode():
+        start = time.perf_counter()
+        batch_start = start
+        for batch_x, batch_y, batch_idx, decode_start in loader:
+            batch_x = batch_x.to(device, non_blocking=True)
+            labels = batch_y.to(device).float().unsqueeze(1)
+
+            with autocast_context(device, bf16):
+                output = model(batch_x)
+            output = output.float()
+            loss_sum += criterion(output, labels).item()
+
+            scores = torch.sigmoid(output).cpu().numpy().ravel()
+            labels = batch_y.numpy().ravel()
+            predicted = (scores > 0.5).astype(int)
+            n_correct += int(np.sum(predicted == labels))
+            n_real += int(np.sum(labels == 1))
+            n_total += len(labels)
+
+            pending.append(pd.DataFrame({
+                'path': paths[batch_idx.numpy()],
+                'true_label': labels,  # 1=real, 0=fake
+                'prediction_score': scores,
+                'predicted_label': predicted,
+            }))
+            pending_rows += len(labels)
+            if pending_rows >= chunk_size:
+                writer.write(pd.concat(pending, ignore_index=True))
+                pending, pending_rows = [], 0
+
+            clip_seconds.append(time.monotonic() - decode_start.numpy())
+            now = time.perf_counter()
+            batch_seconds.append(now - batch_start)
+            batch_start = now
+
+        if pending:
+            writer.write(pd.concat(pending, ignore_index=True))
+        elapsed = time.perf_counter() - start
+
+    results = {
+        'loss': loss_sum / max(n_total, 1),
+        'accuracy': n_correct / max(n_total, 1) * 100,
+        'n_real': n_real,
+        'n_fake': n_total - n_real,
+        'clips': n_total,
+        'seconds': elapsed,
+        'clips_per_sec': n_total / elapsed if elapsed > 0 else 0.0,
+    }
+    if batch_seconds:
+        results.update(latency_summary(batch_seconds, np.concatenate(clip_seconds)))
+    return results
+
+
+def eer_auc(labels, scores):
+    """Exact EER and ROC AUC (real = positive class) from one descending sort."""
+    labels = np.asarray(labels)
+    scores = np.asarray(scores, dtype=np.float64)
+    order = np.argsort(-scores, kind='stable')
+    s, real = scores[order], labels[order] == 1
+    if real.all() or not real.any():
+        return float('nan'), float('nan')
+    last = np.r_[s[1:] != s[:-1], True]
+    tpr = np.r_[0.0, np.cumsum(real)[last] / real.sum()]
+    fpr = np.r_[0.0, np.cumsum(~real)[last] / (~real).sum()]
+    fnr = 1 - tpr
+    i = np.argmin(np.abs(fpr - fnr))
+    return float((fpr[i] + fnr[i]) / 2), float(np.trapz(tpr, fpr))
+
+
+def source_eers(labels, scores, sources) -> dict:
+    """EER of the real clips against each fake source separately: {source: eer}."""
+    labels, scores, sources = np.asarray(labels), np.asarray(scores), np.asarray(sources)
+    real = labels == 1
+    return {
+        str(source): eer_auc(labels[real | (sources == source)], scores[real | (sources == source)])[0]
+        for source in np.unique(sources[~real])
+    }
+
+
+def log_results(results: dict, scores_file):
+    logger.info(f"Test Set Results:")
+    logger.info(f"  Loss: {results['loss']:.4f}")
+    logger.info(f"  Accuracy (threshold=0.5): {results['accuracy']:.2f}%")
+    logger.info(f"  Dataset: {results['n_real']} real, {results['n_fake']} fake samples")
+    logger.info(f"  Throughput: {results['clips_per_sec']:.1f} clips/s ({results['clips']} clips in {results['seconds']:.1f}s)")
+    if 'batch_p50_ms' in results:
+        logger.info(f"  Batch latency: p50 {results['batch_p50_ms']:.1f} ms | p95 {results['batch_p95_ms']:.1f} ms | "
+                    f"p99 {results['batch_p99_ms']:.1f} ms")
+        logger.info(f"  Clip latency (decode to score): p50 {results['clip_p50_ms']:.1f} ms | "
+                    f"p99 {results['clip_p99_ms']:.1f} ms")
+    logger.info(f"  Scores saved to: {scores_file}")
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+CPU Inference Export
+Turns a trained W2V+AASIST checkpoint into CPU deployment artifacts:
+
+    int8       TorchScript model with dynamic int8 quantization of the
+               wav2vec2 nn.Linear layers (model_int8.pt)
+    onnx       ONNX graph with a fixed nb_samp input and dynamic batch (model.onnx)
+    onnx_int8  the ONNX graph with dynamic int8 weights via onnxruntime (model_int8.onnx)
+
+Each artifact is checked against the fp32 model on a sample of the metadata
+(score drift, decision agreement, EER delta) and benchmarked for load time,
+batch-1 latency, batched throughput and peak RSS, one process per artifact.
+Results go to export_report.json next to the artifacts.
+
+ONNX export needs the `onnx` package; ONNX scoring and int8 ONNX need `onnxruntime`.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader
+
+from brspeech_audio import label_to_int
+from brspeech_eval import eer_auc, load_model
+from brspeech_instrument import peak_rss_mb
+from brspeech_models import find_ssl_encoder, module_prefix
+from brspeech_ssl_cache import FixedCropDataset
+from train_brspeech import load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+FORMATS = ['int8', 'onnx', 'onnx_int8']
+ARTIFACTS = {'int8': 'model_int8.pt', 'onnx': 'model.onnx', 'onnx_int8': 'model_int8.onnx'}
+
+
+# --- export -----------------------------------------------------------------
+
+def quantize_ssl_linears(model: torch.nn.Module) -> torch.nn.Module:
+    """Dynamic int8 quantization of the nn.Linear layers inside the wav2vec2 encoder only."""
+    from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+
+    prefix = module_prefix(model, find_ssl_encoder(model))
+    qconfig_spec = {
+        name: default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and name.startswith(prefix)
+    }
+    logger.info(f"Quantizing {len(qconfig_spec)} wav2vec2 linear layers to int8")
+    return quantize_dynamic(model, qconfig_spec=qconfig_spec, dtype=torch.qint8)
+
+
+def export_int8(model, example: torch.Tensor, path: Path):
+    quantized = quantize_ssl_linears(model)
+    with torch.inference_mode():
+        traced = torch.jit.trace(quantized, example, strict=False, check_trace=False)
+    torch.jit.save(traced, str(path))
+
+
+def export_onnx(model, example: torch.Tensor, path: Path, opset: int):
+    torch.onnx.export(
+        model, example, str(path),
+        input_names=['waveform'],
+        output_names=['logit'],
+        dynamic_axes={'waveform': {0: 'batch'}, 'logit': {0: 'batch'}},
+        opset_version=opset,
+        do_constant_folding=True,
+    )
+
+
+def export_onnx_int8(onnx_path: Path, path: Path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(onnx_path), str(path), weight_type=QuantType.QInt8)
+
+
+# --- runners ----------------------------------------------------------------
+
+def load_runner(kind: str, path, model_config: dict, threads: int):
+    """Callable float32 (B, nb_samp) array -> logits array, for the fp32 model or an artifact."""
+    torch.set_num_threads(threads)
+    if kind in ('onnx', 'onnx_int8'):
+        # Own session so the thread count applies
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        return lambda x: session.run(None, {'waveform': x})[0].ravel()
+
+    model = load_model(model_config, path, torch.device('cpu'))
+
+    def run(x):
+        with torch.inference_mode():
+            return model(torch.from_numpy(x)).float().numpy().ravel()
+
+    return run
+
+
+def sample_inputs(model_config: dict, metadata: Path, num_samples: int, seed: int = 0):
+    """Fixed-crop waveforms and labels for a class-balanced random sample of a metadata CSV."""
+    samples_df = pd.read_csv(metadata)
+    labels = samples_df['label'].map(label_to_int)
+    per_class = num_samples // 2
+    samples_df = pd.concat([
+        group.sample(n=min(per_class, len(group)), random_state=seed)
+        for _, group in samples_df.groupby(labels)
+    ], ignore_index=True)
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+    rates = samples_df['sample_rate'].to_numpy() if 'sample_rate' in samples_df else None
+    loader = DataLoader(FixedCropDataset(samples_df['path'], nb_samp, rates), batch_size=32, num_workers=4)
+    waveforms = np.concatenate([batch_x.numpy() for batch_x, _ in loader])
+    return waveforms.astype(np.float32), samples_df['label'].map(label_to_int).to_numpy()
+
+
+def score_all(run, waveforms: np.ndarray, batch_size: int) -> np.ndarray:
+    logits = np.concatenate([run(waveforms[i:i + batch_size]) for i in range(0, len(waveforms), batch_size)])
+    return 1 / (1 + np.exp(-logits))
+
+
+def parity(reference: np.ndarray, scores: np.ndarray, labels: np.ndarray) -> dict:
+    drift = np.abs(scores - reference)
+    eer_ref = eer_auc(labels, reference)[0]
+    eer = eer_auc(labels, scores)[0]
+    return {
+        'score_drift_mean': float(drift.mean()),
+        'score_drift_p99': float(np.percentile(drift, 99)),
+        'score_drift_max': float(drift.max()),
+        'decision_agreement': float(np.mean((scores > 0.5) == (reference > 0.5)) * 100),
+        'eer_fp32': eer_ref * 100,
+        'eer': eer * 100,
+        'eer_delta': (eer - eer_ref) * 100,
+    }
+
+
+def benchmark_artifact(kind: str, path: str, model_config: dict, waveforms: np.ndarray,
+                       threads: int, runs: int, batch_size: int) -> dict:
+    """Load time, latency and peak RSS of one runner; executed in a fresh process."""
+    rss_start = peak_rss_mb()
+    start = time.perf_counter()
+    run = load_runner(kind, path, model_config, threads)
+    load_seconds = time.perf_counter() - start
+    run(waveforms[:1])  # warm-up
+
+    single = []
+    for i in range(runs):
+        start = time.perf_counter()
+        run(waveforms[i % len(waveforms):i % len(waveforms) + 1])
+        single.append((time.perf_counter() - start) * 1000)
+    batch = waveforms[:batch_size]
+    start = time.perf_counter()
+    for _ in range(max(1, runs // 10)):
+        run(batch)
+    batch_seconds = (time.perf_counter() - start) / max(1, runs // 10)
+    return {
+        'load_seconds': load_seconds,
+        'latency_p50_ms': float(np.percentile(single, 50)),
+        'latency_p95_ms': float(np.percentile(single, 95)),
+        'batch_clips_per_sec': len(batch) / batch_seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - rss_start,
+    }
+
+
+def in_fresh_process(fn, *args):
+    with mp.get_context('spawn').Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a checkpoint to int8 TorchScript / ONNX for CPU scoring')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--checkpoint_path', type=str, required=True, help='Fine-tuned checkpoint (.pth)')
+    parser.add_argument('--formats', nargs='+', default=['int8', 'onnx'], choices=FORMATS)
+    parser.add_argument('--out_dir', type=str, default='fine_tuned_models/export')
+    parser.add_argument('--opset', type=int, default=17, help='ONNX opset')
+    parser.add_argument('--metadata', type=str, help='Parity sample source (default: <root_dir>/test.csv)')
+    parser.add_argument('--parity_samples', type=int, default=512)
+    parser.add_argument('--threads', type=int, default=4, help='CPU threads for parity and benchmark')
+    parser.add_argument('--bench_runs', type=int, default=50, help='Batch-1 runs per artifact')
+    parser.add_argument('--bench_batch', type=int, default=32)
+    parser.add_argument('--skip_benchmark', action='store_true')
+    args = parser.parse_args()
+
+    model_config = load_config(args.config)
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    torch.set_num_threads(args.threads)
+
+    model = load_model(model_config, args.checkpoint_path, torch.device('cpu'))
+    example = torch.zeros(1, nb_samp)
+    artifacts = {}
+    for kind in args.formats:
+        path = out_dir / ARTIFACTS[kind]
+        start = time.perf_counter()
+        if kind == 'int8':
+            export_int8(model, example, path)
+        elif kind == 'onnx':
+            export_onnx(model, example, path, args.opset)
+        else:
+            onnx_path = out_dir / ARTIFACTS['onnx']
+            if not onnx_path.exists():
+                export_onnx(model, example, onnx_path, args.opset)
+            export_onnx_int8(onnx_path, path)
+        artifacts[kind] = path
+        logger.info(f"✅ {kind}: {path} ({path.stat().st_size / 2 ** 20:.1f} MB, {time.perf_counter() - start:.1f}s)")
+
+    # Parity on a labelled sample
+    metadata = args.metadata or Path(model_config['data']['root_dir']) / 'test.csv'
+    waveforms, labels = sample_inputs(model_config, metadata, args.parity_samples)
+    logger.info(f"Parity set: {len(labels)} clips from {metadata}")
+    with torch.inference_mode():
+        reference = score_all(lambda x: model(torch.from_numpy(x)).float().numpy().ravel(), waveforms, args.bench_batch)
+    del model
+
+    report = {
+        'checkpoint': args.checkpoint_path,
+        'nb_samp': nb_samp,
+        'checkpoint_mb': Path(args.checkpoint_path).stat().st_size / 2 ** 20,
+        'artifacts': {},
+    }
+    for kind, path in artifacts.items():
+        run = load_runner(kind, path, model_config, args.threads)
+        result = {'path': str(path), 'size_mb': path.stat().st_size / 2 ** 20}
+        result.update(parity(reference, score_all(run, waveforms, args.bench_batch), labels))
+        report['artifacts'][kind] = result
+        logger.info(f"{kind:10} | drift mean {result['score_drift_mean']:.2e} max {result['score_drift_max']:.2e} | "
+                    f"agreement {result['decision_agreement']:.2f}% | "
+                    f"EER {result['eer']:.2f}% (fp32 {result['eer_fp32']:.2f}%, delta {result['eer_delta']:+.2f})")
+
+    # Latency / memory, each runner in its own process
+    if not args.skip_benchmark:
+        bench_inputs = waveforms[:max(args.bench_batch, 1)]
+        runners = {'fp32': args.checkpoint_path, **{k: str(p) for k, p in artifacts.items()}}
+        logger.info("=== CPU BENCHMARK ===")
+        for kind, path in runners.items():
+            bench = in_fresh_process(benchmark_artifact, kind, path, model_config, bench_inputs,
+                                     args.threads, args.bench_runs, args.bench_batch)
+            report.setdefault('benchmark', {})[kind] = bench
+            logger.info(f"{kind:10} | load {bench['load_seconds']:.2f}s | batch-1 p50 {bench['latency_p50_ms']:.1f}ms "
+                        f"p95 {bench['latency_p95_ms']:.1f}ms | {bench['batch_clips_per_sec']:.1f} clips/s | "
+                        f"peak RSS {bench['peak_rss_mb']:.0f} MB")
+
+    report_path = out_dir / 'export_report.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved to: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Incremental directory index for BrSpeech metadata generation.
+Lists directories in bulk with os.scandir (one call per directory instead of
+one stat per file) and caches the listings in an on-disk manifest keyed by
+directory mtime and size, so unchanged directories are never re-listed.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_VERSION = 1
+
+
+class DirectoryIndex:
+    """
+    Cached, parallel directory lister.
+
+    The manifest maps each directory to its (mtime_ns, size) signature and the
+    names of the files and subdirectories it contains. A directory is only
+    re-listed when its signature changes; adding, removing or renaming an
+    entry always bumps the mtime of the directory that holds it.
+    """
+
+    def __init__(self, manifest_path: str, workers: int = 16, full_rescan: bool = False):
+        self.manifest_path = manifest_path
+        self.workers = workers
+        self.dirs = {} if full_rescan else self._load_manifest(manifest_path)
+        self.stats = {'dirs_scanned': 0, 'dirs_reused': 0, 'files': 0, 'probed': 0}
+        self._seen = set()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    @staticmethod
+    def _load_manifest(path: str) -> dict:
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            print(f"⚠️  Ignoring unreadable index manifest: {path}")
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            return {}
+        return manifest.get('dirs', {})
+
+    def save(self):
+        """Atomically write the manifest, dropping directories not visited in this run."""
+        dirs = {d: entry for d, entry in self.dirs.items() if d in self._seen}
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'dirs': dirs}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _list_dir(self, path: str):
+        """Return the cached entry for `path`, re-listing it only if it changed."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        signature = [st.st_mtime_ns, st.st_size]
+        cached = self.dirs.get(path)
+        if cached is not None and cached['sig'] == signature:
+            return cached, False
+
+        files, subdirs = [], []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=True):
+                    subdirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+        files.sort()
+        subdirs.sort()
+        return {'sig': signature, 'files': files, 'subdirs': subdirs}, True
+
+    def list_dirs(self, paths) -> dict:
+        """List several directories in parallel. Missing directories map to None."""
+        paths = list(dict.fromkeys(paths))
+        result = {}
+        for path, listed in zip(paths, self._pool.map(self._list_dir, paths)):
+            self._seen.add(path)
+            if listed is None:
+                result[path] = None
+                continue
+            entry, rescanned = listed
+            self.dirs[path] = entry
+            self.stats['dirs_scanned' if rescanned else 'dirs_reused'] += 1
+            self.stats['files'] += len(entry['files'])
+            result[path] = entry
+        return result
+
+    def probe(self, paths, probe_fn) -> dict:
+        """
+        Return {path: probe_fn(path)} for files in already listed directories.
+        Results are cached next to the directory listing, so they are only
+        recomputed for directories whose signature changed.
+        """
+        results, missing = {}, []
+        for path in paths:
+            entry = self.dirs.get(os.path.dirname(path))
+            cached = entry.get('info', {}).get(os.path.basename(path)) if entry else None
+            if cached is not None:
+                results[path] = tuple(cached)
+            else:
+                missing.append(path)
+
+        def _probe(path):
+            try:
+                return probe_fn(path)
+            except Exception as e:
+                print(f"⚠️  Could not read audio header: {path} ({e})")
+                return None
+
+        for path, info in zip(missing, self._pool.map(_probe, missing)):
+            results[path] = info
+            entry = self.dirs.get(os.path.dirname(path))
+            if info is not None and entry is not None:
+                entry.setdefault('info', {})[os.path.basename(path)] = list(info)
+        self.stats['probed'] += len(missing)
+        return results
+
+    def walk(self, roots, suffix: str = '') -> dict:
+        """
+        Recursively collect files under each root, breadth-first, listing every
+        level of every root in one parallel batch. Returns {root: [file paths]}.
+        """
+        found = {root: [] for root in roots}
+        frontier = [(root, root) for root in roots]
+        while frontier:
+            listings = self.list_dirs(path for _, path in frontier)
+            next_frontier = []
+            for root, path in frontier:
+                entry = listings.get(path)
+                if entry is None:
+                    continue
+                found[root].extend(
+                    os.path.join(path, name) for name in entry['files'] if name.endswith(suffix)
+                )
+                next_frontier.extend((root, os.path.join(path, name)) for name in entry['subdirs'])
+            frontier = next_frontier
+        return found
+
+
+class Timer:
+    """Wall-clock timer with a files/sec report line."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+    def report(self, n_files: int, stats: dict) -> str:
+        rate = n_files / self.elapsed if self.elapsed > 0 else float('inf')
+        return (f"⏱️  Indexed {n_files} files in {self.elapsed:.2f}s ({rate:,.0f} files/s) - "
+                f"{stats['dirs_scanned']} directories scanned, {stats['dirs_reused']} reused from manifest, "
+                f"{stats['probed']} audio headers read")
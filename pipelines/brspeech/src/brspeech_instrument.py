@@ -0,0 +1,249 @@
+"""
+Step-level training instrumentation for the BrSpeech pipeline.
+
+train_nn owns the training loop, so the step is timed from the outside:
+the train DataLoader is wrapped, hooks are attached to the model that
+train_nn builds (through model_transform) and global optimizer step hooks
+mark the end of each step. Each training step is split into
+
+    data_wait  next(loader) until the batch is returned
+    h2d        batch returned until the model forward starts (device copy)
+    forward    model forward
+    backward   forward end until optimizer.step() (loss + backward)
+    optimizer  optimizer.step()
+
+Rolling averages, throughput and peak memory are appended to a JSONL file.
+An optional torch.profiler window exports a trace for a range of steps.
+In distributed runs the records are reduced over ranks and written by rank 0
+only (pass write=False elsewhere). Nothing is installed when instrumentation is off.
+"""
+
+import contextlib
+import json
+import logging
+import resource
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+from brspeech_models import model_transform
+
+logger = logging.getLogger(__name__)
+
+PHASES = ['data_wait', 'h2d', 'forward', 'backward', 'optimizer']
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _TimedLoader:
+    """Proxy around the train DataLoader that reports when each batch arrives."""
+
+    def __init__(self, loader, instrumentation: 'StepInstrumentation'):
+        self._loader = loader
+        self._instrumentation = instrumentation
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def __iter__(self):
+        instrumentation = self._instrumentation
+        iterator = iter(self._loader)
+        while True:
+            instrumentation.mark_wait()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            instrumentation.mark_batch(batch)
+            yield batch
+
+
+class StepInstrumentation:
+    """
+    Per-step phase timers for a train_nn run.
+
+    Usage:
+        instrumentation = StepInstrumentation(out_dir / 'train_metrics.jsonl', device)
+        train_loader = instrumentation.wrap_loader(train_loader)
+        with instrumentation:
+            train_nn(...)
+    """
+
+    def __init__(self, metrics_path, device: torch.device, log_every: int = 50,
+                 profile_steps: Optional[Tuple[int, int]] = None, profile_dir=None, write: bool = True):
+        self.metrics_path = Path(metrics_path)
+        self.write = write
+        self.device = device
+        self.log_every = log_every
+        self.profile_steps = profile_steps
+        self.profile_dir = Path(profile_dir) if profile_dir else self.metrics_path.parent / 'profiler'
+        self.step = 0
+        self._marks = {}
+        self._batch_size = 0
+        self._window = {phase: [] for phase in PHASES}
+        self._window_samples = 0
+        self._window_start = None
+        self._file = None
+        self._profiler = None
+        self._stack = contextlib.ExitStack()
+        self._sync = device.type == 'cuda'
+
+    # --- time marks -------------------------------------------------------
+
+    def _now(self) -> float:
+        if self._sync:
+            torch.cuda.synchronize(self.device)
+        return time.perf_counter()
+
+    def mark_wait(self):
+        self._marks = {'wait': self._now()}
+        if self._window_start is None:
+            self._window_start = self._marks['wait']
+
+    def mark_batch(self, batch):
+        self._marks['batch'] = self._now()
+        first = batch[0] if isinstance(batch, (list, tuple)) else batch
+        self._batch_size = len(first)
+
+    def _forward_pre_hook(self, module, inputs):
+        if module.training and torch.is_grad_enabled() and 'batch' in self._marks:
+            self._marks.setdefault('forward', self._now())
+
+    def _forward_hook(self, module, inputs, output):
+        if module.training and torch.is_grad_enabled() and 'forward' in self._marks:
+            self._marks['forward_end'] = self._now()
+
+    def _step_pre_hook(self, optimizer, args, kwargs):
+        if 'forward_end' in self._marks:
+            self._marks['step'] = self._now()
+
+    def _step_post_hook(self, optimizer, args, kwargs):
+        marks = self._marks
+        if 'step' not in marks:
+            return
+        end = self._now()
+        durations = {
+            'data_wait': marks['batch'] - marks['wait'],
+            'h2d': marks['forward'] - marks['batch'],
+            'forward': marks['forward_end'] - marks['forward'],
+            'backward': marks['step'] - marks['forward_end'],
+            'optimizer': end - marks['step'],
+        }
+        for phase, seconds in durations.items():
+            self._window[phase].append(seconds)
+        self._window_samples += self._batch_size
+        self._marks = {}
+        self.step += 1
+
+        if self._profiler is not None:
+            self._profiler.step()
+        if self.step % self.log_every == 0:
+            self._flush(end)
+
+    # --- output -----------------------------------------------------------
+
+    def _flush(self, now: float, reduce: bool = True):
+        steps = len(self._window['optimizer'])
+        if not steps:
+            return
+        elapsed = now - self._window_start
+        record = {
+            'step': self.step,
+            'steps': steps,
+            'samples': self._window_samples,
+            'samples_per_sec': self._window_samples / elapsed if elapsed > 0 else None,
+            'step_ms': 1000 * elapsed / steps,
+        }
+        for phase in PHASES:
+            values = np.asarray(self._window[phase]) * 1000
+            record[f'{phase}_ms'] = float(values.mean())
+            record[f'{phase}_p95_ms'] = float(np.percentile(values, 95))
+        record['peak_rss_mb'] = peak_rss_mb()
+        if self.device.type == 'cuda':
+            record['peak_cuda_mb'] = torch.cuda.max_memory_allocated(self.device) / 2 ** 20
+            torch.cuda.reset_peak_memory_stats(self.device)
+        if reduce and torch.distributed.is_available() and torch.distributed.is_initialized():
+            record = self._reduce(record, elapsed)
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+        self._window = {phase: [] for phase in PHASES}
+        self._window_samples = 0
+        self._window_start = None
+        logger.info(f"step {self.step}: {record['samples_per_sec']:.1f} samples/s | "
+                    + " | ".join(f"{p} {record[f'{p}_ms']:.1f}ms" for p in PHASES))
+
+    @staticmethod
+    def _reduce(record: dict, elapsed: float) -> dict:
+        """Combine the records of all ranks: summed throughput, mean phase times, max peaks."""
+        from brspeech_distributed import reduce_values
+
+        total = reduce_values({'samples': record['samples']}, 'sum')
+        slowest = reduce_values({'elapsed': elapsed, **{k: v for k, v in record.items() if k.startswith('peak_')}}, 'max')
+        means = reduce_values({k: v for k, v in record.items() if k.endswith('_ms')}, 'mean')
+        record.update(means)
+        record.update({k: v for k, v in slowest.items() if k != 'elapsed'})
+        record['samples'] = int(total['samples'])
+        record['samples_per_sec'] = total['samples'] / slowest['elapsed'] if slowest['elapsed'] > 0 else None
+        record['world_size'] = torch.distributed.get_world_size()
+        return record
+
+    # --- installation -----------------------------------------------------
+
+    def wrap_loader(self, loader):
+        return _TimedLoader(loader, self)
+
+    def _attach(self, model):
+        model.register_forward_pre_hook(self._forward_pre_hook)
+        model.register_forward_hook(self._forward_hook)
+        return model
+
+    def _start_profiler(self):
+        first, last = self.profile_steps
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.device.type == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self._profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=max(first - 1, 0), warmup=1 if first > 0 else 0,
+                                             active=last - first + 1, repeat=1),
+            on_trace_ready=torch.profiler.tensorboard_trace_handler(str(self.profile_dir)),
+            record_shapes=True,
+            profile_memory=True,
+        )
+        self._stack.enter_context(self._profiler)
+        logger.info(f"Profiling steps {first}-{last}; trace goes to {self.profile_dir}")
+
+    def __enter__(self):
+        from torch.optim.optimizer import register_optimizer_step_pre_hook, register_optimizer_step_post_hook
+
+        if self.write:
+            self.metrics_path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self._stack.enter_context(open(self.metrics_path, 'a'))
+        self._stack.enter_context(model_transform(self._attach))
+        self._stack.callback(register_optimizer_step_pre_hook(self._step_pre_hook).remove)
+        self._stack.callback(register_optimizer_step_post_hook(self._step_post_hook).remove)
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        if self.profile_steps:
+            self._start_profiler()
+        logger.info(f"Step instrumentation on: metrics every {self.log_every} steps to {self.metrics_path}")
+        return self
+
+    def __exit__(self, *exc):
+        # Leaving through an exception, the other ranks may never reach the collectives:
+        # write this rank's own record instead of blocking in the all-reduce
+        self._flush(time.perf_counter(), reduce=exc[0] is None)
+        self._stack.close()
+        return False
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""
+Deep audio integrity scan for BrSpeech.
+Fully decodes every file in a process pool and records duration, sample
+rate, channel count and a hash of the decoded PCM, so truncated or corrupt
+files are found before training instead of hours into an epoch.
+
+Results are cached in a CSV index keyed by path, size and mtime; reruns only
+decode new or modified files. prepare_brspeech_metadata.py --verify_audio
+uses the same index to leave broken files out of the metadata and to report
+(or drop) audio duplicated across train/dev/test.
+
+Standalone use scans the files listed in metadata CSVs and/or found under
+directories:
+
+    python brspeech_integrity.py metadata/train.csv metadata/val.csv metadata/test.csv
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from pathlib import Path
+
+INDEX_PATH = os.getenv("BRSPEECH_INTEGRITY_INDEX", os.path.join("metadata", ".integrity_index.csv"))
+INDEX_FIELDS = ['path', 'size', 'mtime_ns', 'status', 'error', 'num_frames', 'sample_rate',
+                'channels', 'duration', 'sha1']
+AUDIO_SUFFIXES = ('.flac', '.wav')
+# Where a clip shared by several splits is kept when duplicates are dropped
+SPLIT_PRIORITY = ['test', 'dev', 'val', 'train']
+
+
+def _init_worker():
+    import torch
+
+    torch.set_num_threads(1)
+
+
+def check_file(path: str) -> dict:
+    """Decode a whole file and describe it; status is 'ok' or 'error'."""
+    import numpy as np
+    import torch
+    import torchaudio
+
+    from brspeech_audio import to_int16
+
+    record = {'path': path}
+    try:
+        st = os.stat(path)
+        record.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+        info = torchaudio.info(path)
+        waveform, sample_rate = torchaudio.load(path)
+        channels, num_frames = waveform.shape
+        if num_frames == 0:
+            raise ValueError("no audio samples")
+        if info.num_frames and num_frames < info.num_frames:
+            raise ValueError(f"truncated: decoded {num_frames} of {info.num_frames} frames")
+        if not torch.isfinite(waveform).all():
+            raise ValueError("non-finite samples")
+        pcm = to_int16(waveform.numpy().T)  # interleaved, as stored
+        record.update(
+            status='ok', error='',
+            num_frames=num_frames, sample_rate=sample_rate, channels=channels,
+            duration=round(num_frames / sample_rate, 4),
+            sha1=hashlib.sha1(np.ascontiguousarray(pcm).tobytes()).hexdigest(),
+        )
+    except Exception as e:
+        record.update(status='error', error=f"{type(e).__name__}: {e}")
+    return record
+
+
+def _stat(path: str):
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    except OSError:
+        return None
+
+
+class IntegrityIndex:
+    """
+    Cached results of check_file. An entry is reused while the file's size
+    and mtime are unchanged; the index is saved periodically during a scan,
+    so an interrupted scan resumes where it stopped.
+    """
+
+    def __init__(self, index_path: str = INDEX_PATH, workers: int = os.cpu_count(),
+                 full_rescan: bool = False, save_every: int = 5000):
+        self.index_path = index_path
+        self.workers = workers
+        self.save_every = save_every
+        self.records = {} if full_rescan else self._load(index_path)
+        self.stats = {'checked': 0, 'reused': 0, 'missing': 0, 'broken': 0}
+        self._seen = set()
+
+    @staticmethod
+    def _load(path: str) -> dict:
+        if not os.path.exists(path):
+            return {}
+        records = {}
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                for key in ('size', 'mtime_ns', 'num_frames', 'sample_rate', 'channels'):
+                    row[key] = int(row[key]) if row[key] else None
+                row['duration'] = float(row['duration']) if row['duration'] else None
+                records[row['path']] = row
+        return records
+
+    def save(self, prune: bool = True):
+        """Atomically write the index; with prune, drop files not seen in this run."""
+        records = [r for p, r in self.records.items() if not prune or p in self._seen]
+        os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        os.replace(tmp_path, self.index_path)
+
+    def scan(self, paths) -> dict:
+        """Return {path: record} for `paths`, decoding only new or modified files."""
+        paths = list(dict.fromkeys(paths))
+        self._seen.update(paths)
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            signatures = list(pool.map(_stat, paths))
+
+        results, todo = {}, []
+        for path, signature in zip(paths, signatures):
+            cached = self.records.get(path)
+            if signature is None:
+                results[path] = {'path': path, 'status': 'error', 'error': 'FileNotFoundError'}
+                self.stats['missing'] += 1
+            elif cached is not None and (cached['size'], cached['mtime_ns']) == signature:
+                results[path] = cached
+                self.stats['reused'] += 1
+            else:
+                todo.append(path)
+
+        if todo:
+            print(f"🔎 Decoding {len(todo)} new or modified files with {self.workers} workers "
+                  f"({self.stats['reused']} unchanged)...")
+            start = time.perf_counter()
+            with Pool(self.workers, initializer=_init_worker) as pool:
+                for n, record in enumerate(pool.imap_unordered(check_file, todo, chunksize=8), 1):
+                    results[record['path']] = self.records[record['path']] = record
+                    if n % self.save_every == 0:
+                        self.save(prune=False)
+                        rate = n / (time.perf_counter() - start)
+                        print(f"  {n}/{len(todo)} files ({rate:.0f} files/s)")
+            self.stats['checked'] += len(todo)
+
+        self.stats['broken'] += sum(1 for r in results.values() if r['status'] != 'ok')
+        return results
+
+
+def find_duplicates(records: dict, split_of: dict) -> list:
+    """Groups of files with identical decoded audio: [{'sha1', 'paths', 'splits'}], cross-split first."""
+    by_hash = defaultdict(list)
+    for path, record in records.items():
+        if record['status'] == 'ok':
+            by_hash[record['sha1']].append(path)
+    groups = [
+        {'sha1': sha1, 'paths': sorted(paths), 'splits': sorted({split_of.get(p, '') for p in paths})}
+        for sha1, paths in by_hash.items() if len(paths) > 1
+    ]
+    return sorted(groups, key=lambda g: (len(g['splits']) == 1, g['sha1']))
+
+
+def leaked_copies(duplicates: list, split_of: dict) -> set:
+    """Paths to drop so that each cross-split duplicate stays only in its highest-priority split."""
+    dropped = set()
+    for group in duplicates:
+        if len(group['splits']) < 2:
+            continue
+        keep = min(group['splits'], key=lambda s: SPLIT_PRIORITY.index(s) if s in SPLIT_PRIORITY else len(SPLIT_PRIORITY))
+        dropped.update(p for p in group['paths'] if split_of.get(p) != keep)
+    return dropped
+
+
+def write_report(path: str, records: dict, duplicates: list, stats: dict, dropped=()):
+    broken = [{'path': p, 'error': r['error']} for p, r in sorted(records.items()) if r['status'] != 'ok']
+    report = {
+        'files': len(records),
+        'broken': broken,
+        'duplicate_groups': len(duplicates),
+        'cross_split_duplicate_groups': sum(1 for g in duplicates if len(g['splits']) > 1),
+        'duplicates': duplicates,
+        'dropped_duplicates': sorted(dropped),
+        'stats': stats,
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def _collect(inputs) -> dict:
+    """{path: split} from metadata CSVs (split = file stem) and directories (split = '')."""
+    split_of = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                split_of.update({os.path.join(root, f): '' for f in files if f.endswith(AUDIO_SUFFIXES)})
+        else:
+            with open(item, newline='') as f:
+                split_of.update({row['path']: Path(item).stem for row in csv.DictReader(f)})
+    return split_of
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode-check every audio file, with a cached result index')
+    parser.add_argument('inputs', nargs='+', help='Metadata CSVs (path column) and/or audio directories')
+    parser.add_argument('--index', type=str, default=INDEX_PATH, help='Cached result index (CSV)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--full_rescan', action='store_true', help='Ignore the cached results')
+    parser.add_argument('--report', type=str, default=os.path.join('metadata', 'integrity_report.json'))
+    args = parser.parse_args()
+
+    split_of = _collect(args.inputs)
+    index = IntegrityIndex(args.index, args.workers, args.full_rescan)
+    start = time.perf_counter()
+    records = index.scan(split_of)
+    index.save()
+    duplicates = find_duplicates(records, split_of)
+    write_report(args.report, records, duplicates, index.stats)
+
+    for record in records.values():
+        if record['status'] != 'ok':
+            print(f"❌ {record['path']}: {record['error']}")
+    cross = [g for g in duplicates if len(g['splits']) > 1]
+    for group in cross[:20]:
+        print(f"⚠️  Same audio in {'/'.join(group['splits'])}: {', '.join(group['paths'])}")
+    print(f"✅ {len(records)} files in {time.perf_counter() - start:.1f}s: {index.stats['broken']} broken, "
+          f"{len(duplicates)} duplicate groups ({len(cross)} across splits), "
+          f"{index.stats['checked']} decoded, {index.stats['reused']} reused. Report: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
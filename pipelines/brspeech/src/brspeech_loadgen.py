@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Load generator for brspeech_serve.py.
+Sends scoring requests from concurrent clients and reports throughput and
+latency percentiles, plus the server's own batching metrics.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_RATE = 16000
+
+
+async def open_connection(args):
+    if args.socket:
+        return await asyncio.open_unix_connection(args.socket, limit=2 ** 26)
+    return await asyncio.open_connection(args.host, args.port, limit=2 ** 26)
+
+
+def make_requests(args) -> list:
+    """File requests from a metadata CSV, or synthetic PCM clips."""
+    if args.metadata:
+        paths = pd.read_csv(args.metadata)['path'].tolist()
+        random.Random(0).shuffle(paths)
+        return [{'path': p} for p in paths[:args.num_requests]]
+
+    rng = np.random.default_rng(0)
+    clips = []
+    for _ in range(min(args.num_requests, 64)):
+        pcm = (rng.standard_normal(int(args.clip_seconds * SAMPLE_RATE)) * 3000).astype('<i2')
+        clips.append({'pcm': base64.b64encode(pcm.tobytes()).decode(), 'sample_rate': SAMPLE_RATE})
+    return [clips[i % len(clips)] for i in range(args.num_requests)]
+
+
+async def client(args, requests: list, latencies: list, errors: list):
+    """One connection sending requests back to back (closed-loop)."""
+    reader, writer = await open_connection(args)
+    for request_id, request in requests:
+        start = time.perf_counter()
+        writer.write(json.dumps(dict(request, id=request_id)).encode() + b'\n')
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latencies.append((time.perf_counter() - start) * 1000)
+        if 'error' in response:
+            errors.append(response['error'])
+    writer.close()
+
+
+async def fetch_metrics(args) -> dict:
+    reader, writer = await open_connection(args)
+    writer.write(b'{"cmd": "metrics"}\n')
+    await writer.drain()
+    metrics = json.loads(await reader.readline())
+    writer.close()
+    return metrics
+
+
+async def run(args):
+    requests = list(enumerate(make_requests(args)))
+    per_client = [requests[i::args.concurrency] for i in range(args.concurrency)]
+    latencies, errors = [], []
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(args, reqs, latencies, errors) for reqs in per_client))
+    elapsed = time.perf_counter() - start
+
+    lat = np.asarray(latencies)
+    print(f"Requests: {len(lat)} ({len(errors)} errors) with {args.concurrency} concurrent clients")
+    print(f"Throughput: {len(lat) / elapsed:.1f} clips/s ({elapsed:.1f}s)")
+    print(f"Latency: p50 {np.percentile(lat, 50):.1f} ms | p95 {np.percentile(lat, 95):.1f} ms | "
+          f"p99 {np.percentile(lat, 99):.1f} ms")
+    if errors:
+        print(f"First error: {errors[0]}")
+
+    metrics = await fetch_metrics(args)
+    print(f"Server: mean batch size {metrics['mean_batch_size']:.1f}, "
+          f"max queue depth {metrics['max_queue_depth']}, batches {metrics['batch_size_histogram']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for the BrSpeech scoring server')
+    parser.add_argument('--socket', type=str, help='Unix socket path (default: TCP)')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--metadata', type=str, help='Metadata CSV with audio paths (default: synthetic PCM)')
+    parser.add_argument('--num_requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--clip_seconds', type=float, default=4.0, help='Length of synthetic clips')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+Sliding-window scoring of long recordings.
+Cuts every file into windows of `window` samples with a given stride, packs
+windows from many files into shared full batches, and combines the
+per-window logits back into one score per file (mean, max, min or top-k).
+
+The per-file output uses the --test_only scores schema consumed by
+analyze_scores.py; --window_details also writes one row per window.
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from brspeech_audio import SAMPLE_RATE, label_to_int, load_audio, fix_length
+from brspeech_eval import ScoreWriter, load_model, autocast_context
+from train_brspeech import load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+AGGREGATORS = ['mean', 'max', 'min', 'topk']
+
+
+def window_starts(num_samples: int, window: int, stride: int) -> np.ndarray:
+    """Window offsets covering the whole clip; the last window is aligned to the end."""
+    if num_samples <= window:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.arange(0, num_samples - window + 1, stride, dtype=np.int64)
+    if starts[-1] + window < num_samples:
+        starts = np.append(starts, num_samples - window)
+    return starts
+
+
+class WindowedFiles(Dataset):
+    """Decodes one file per item and returns all its windows as (n, window)."""
+
+    def __init__(self, paths, window: int, stride: int, max_windows: int = None):
+        self.paths = list(paths)
+        self.window = window
+        self.stride = stride
+        self.max_windows = max_windows
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        waveform = load_audio(self.paths[index])
+        starts = window_starts(len(waveform), self.window, self.stride)
+        if self.max_windows and len(starts) > self.max_windows:
+            starts = starts[np.linspace(0, len(starts) - 1, self.max_windows).round().astype(int)]
+        if len(waveform) <= self.window:
+            windows = fix_length(waveform, self.window)[None, :]
+        else:
+            windows = np.stack([waveform[s:s + self.window] for s in starts])
+        return index, starts, windows
+
+
+def _keep_numpy(item):
+    """collate_fn for batch_size=None that keeps the numpy windows as they are."""
+    return item
+
+
+def aggregate(logits: np.ndarray, method: str, topk: int) -> float:
+    if method == 'mean':
+        return float(logits.mean())
+    if method == 'max':
+        return float(logits.max())
+    if method == 'min':
+        return float(logits.min())
+    k = min(topk, len(logits))
+    return float(np.sort(logits)[-k:].mean())
+
+
+def pack_batches(loader, batch_size: int):
+    """Re-batch per-file windows into full batches of `batch_size` windows."""
+    buf_windows, buf_file, buf_win = [], [], []
+    buffered = 0
+    for index, starts, windows in loader:
+        buf_windows.append(windows)
+        buf_file.append(np.full(len(windows), index, dtype=np.int64))
+        buf_win.append(np.arange(len(windows)))
+        buffered += len(windows)
+        yield ('file', index, starts, len(windows))
+        while buffered >= batch_size:
+            windows_all = np.concatenate(buf_windows)
+            file_all, win_all = np.concatenate(buf_file), np.concatenate(buf_win)
+            yield ('batch', windows_all[:batch_size], file_all[:batch_size], win_all[:batch_size])
+            buf_windows, buf_file, buf_win = [windows_all[batch_size:]], [file_all[batch_size:]], [win_all[batch_size:]]
+            buffered -= batch_size
+    if buffered:
+        yield ('batch', np.concatenate(buf_windows), np.concatenate(buf_file), np.concatenate(buf_win))
+
+
+def score_long_audio(model, samples_df: pd.DataFrame, scores_file, device: torch.device,
+                     window: int, stride: int, method: str = 'mean', topk: int = 3,
+                     batch_size: int = 64, num_workers: int = 4, max_windows: int = None,
+                     bf16: bool = False, details_file=None) -> int:
+    """Score every file of `samples_df`; returns the number of files written."""
+    paths = samples_df['path'].to_numpy()
+    labels = samples_df['label'].map(label_to_int).to_numpy()
+    loader = DataLoader(
+        WindowedFiles(paths, window, stride, max_windows),
+        batch_size=None,
+        shuffle=False,
+        num_workers=num_workers,
+        collate_fn=_keep_numpy,
+    )
+
+    pending = {}  # file index -> [starts, logits, windows still missing]
+    rows, detail_rows = [], []
+    n_written = 0
+    details = ScoreWriter(details_file, extra_columns=['window_index', 'start_sample']) if details_file else None
+
+    def finish(file_idx):
+        starts, logits, _ = pending.pop(file_idx)
+        logit = aggregate(logits, method, topk)
+        score = 1 / (1 + np.exp(-logit))
+        rows.append((paths[file_idx], labels[file_idx], score, int(score > 0.5)))
+        if details is not None:
+            window_scores = 1 / (1 + np.exp(-logits))
+            detail_rows.append(pd.DataFrame({
+                'path': paths[file_idx],
+                'true_label': labels[file_idx],
+                'prediction_score': window_scores,
+                'predicted_label': (window_scores > 0.5).astype(int),
+                'window_index': np.arange(len(logits)),
+                'start_sample': starts,
+            }))
+
+    model.eval()
+    with ScoreWriter(scores_file) as writer, torch.inference_mode():
+        for item in pack_batches(loader, batch_size):
+            if item[0] == 'file':
+                _, file_idx, starts, n_windows = item
+                pending[file_idx] = [starts, np.empty(n_windows, dtype=np.float32), n_windows]
+                continue
+
+            _, windows, file_ids, win_ids = item
+            batch_x = torch.from_numpy(np.ascontiguousarray(windows, dtype=np.float32)).to(device)
+            with autocast_context(device, bf16):
+                output = model(batch_x)
+            logits = output.float().cpu().numpy().ravel()
+            for file_idx, win_idx, logit in zip(file_ids, win_ids, logits):
+                entry = pending[file_idx]
+                entry[1][win_idx] = logit
+                entry[2] -= 1
+                if entry[2] == 0:
+                    finish(file_idx)
+
+            if len(rows) >= 10000:
+                writer.write(pd.DataFrame(rows, columns=writer.columns))
+                n_written += len(rows)
+                rows = []
+            if details is not None and len(detail_rows) >= 1000:
+                details.write(pd.concat(detail_rows, ignore_index=True))
+                detail_rows = []
+
+        if rows:
+            writer.write(pd.DataFrame(rows, columns=writer.columns))
+            n_written += len(rows)
+    if details is not None:
+        if detail_rows:
+            details.write(pd.concat(detail_rows, ignore_index=True))
+        details.close()
+    return n_written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sliding-window scoring of long BrSpeech recordings')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--checkpoint_path', type=str, required=True, help='Fine-tuned checkpoint (.pth)')
+    parser.add_argument('--metadata', type=str, help='Metadata CSV to score (default: <root_dir>/test.csv)')
+    parser.add_argument('--window', type=int, help='Window length in samples (default: nb_samp)')
+    parser.add_argument('--stride', type=int, help='Hop between windows in samples (default: window // 2)')
+    parser.add_argument('--aggregate', type=str, default='mean', choices=AGGREGATORS)
+    parser.add_argument('--topk', type=int, default=3, help='Windows averaged by the topk aggregator')
+    parser.add_argument('--max_windows', type=int, help='Cap on windows per file (evenly spaced)')
+    parser.add_argument('--batch_size', type=int, default=64, help='Windows per model batch')
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--device', type=str, default='cuda')
+    parser.add_argument('--bf16', action='store_true', help='bf16 autocast')
+    parser.add_argument('--output', type=str, default='fine_tuned_models/long_scores.csv')
+    parser.add_argument('--window_details', type=str, help='Optional per-window scores file')
+    args = parser.parse_args()
+
+    model_config = load_config(args.config)
+    device = torch.device(args.device if torch.cuda.is_available() else 'cpu')
+    window = args.window or model_config['model']['parameters'].get('nb_samp', 64600)
+    stride = args.stride or window // 2
+    metadata = args.metadata or Path(model_config['data']['root_dir']) / 'test.csv'
+
+    samples_df = pd.read_csv(metadata)
+    model = load_model(model_config, args.checkpoint_path, device)
+    logger.info(f"Scoring {len(samples_df)} files: window {window / SAMPLE_RATE:.2f}s, "
+                f"stride {stride / SAMPLE_RATE:.2f}s, aggregate={args.aggregate}")
+
+    n = score_long_audio(
+        model, samples_df, args.output, device, window, stride,
+        method=args.aggregate, topk=args.topk, batch_size=args.batch_size,
+        num_workers=args.num_workers, max_windows=args.max_windows, bf16=args.bf16,
+        details_file=args.window_details,
+    )
+    logger.info(f"✅ {n} file scores saved to: {args.output}")
+    if args.window_details:
+        logger.info(f"   Per-window scores saved to: {args.window_details}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Fixed-memory streaming detection metrics.
+
+StreamingMetrics takes batches of logits, labels (1 = real, 0 = fake) and
+optional source names, and keeps one histogram of the logits per class and
+source: `num_bins` bins over [-logit_range, logit_range], with the outer bins
+absorbing anything beyond. Memory does not depend on the number of clips.
+From the histograms it computes on demand:
+
+    eer, auc          pooled and per fake source (against all real clips)
+    min_dcf           normalized minimum detection cost of the countermeasure
+                      alone, with the ASVspoof 2019 CM costs (pi_spoof 0.05,
+                      C_miss 1, C_fa 10): the min t-DCF without an ASV system
+    calibration       BCE loss, Brier score, accuracy at 0.5, expected
+                      calibration error over probability bins
+
+The EER is interpolated linearly inside the bin where the miss and false
+alarm rates cross. `eer_bound` is the larger share of real or fake clips in
+that bin. The exact EER of the same scores differs by at most that share.
+With the default 0.004-logit bins this is usually well below 0.1%.
+
+ValidationMetrics feeds train_nn's own validation pass into a StreamingMetrics
+from the outside, like the other training hooks: the val loader is wrapped to
+know the labels and sources of each batch, and a forward hook on the model
+train_nn builds collects the eval-mode outputs.
+"""
+
+import contextlib
+import json
+import logging
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_SOURCE = 'unknown'
+# ASVspoof 2019 countermeasure costs
+P_SPOOF, C_MISS, C_FA = 0.05, 1.0, 10.0
+
+
+def _numpy(values) -> np.ndarray:
+    if torch.is_tensor(values):
+        values = values.detach().float().cpu().numpy()
+    return np.asarray(values).reshape(-1)
+
+
+def loader_sources(loader, columns=('synth', 'label')) -> Optional[np.ndarray]:
+    """Source names of every clip of a loader over a dataset or a Subset, in order (None if unknown)."""
+    dataset, positions = loader.dataset, None
+    if isinstance(dataset, torch.utils.data.Subset):
+        dataset, positions = dataset.dataset, np.asarray(dataset.indices)
+    samples_df = getattr(dataset, 'samples_df', None)
+    column = next((c for c in columns if samples_df is not None and c in samples_df.columns), None)
+    if column is None:
+        return None
+    values = samples_df[column].to_numpy()
+    return values if positions is None else values[positions]
+
+
+def _rates(real_hist: np.ndarray, fake_hist: np.ndarray):
+    """Miss and false-alarm rates at every bin edge (accept as real when logit >= edge)."""
+    real_above = np.r_[np.cumsum(real_hist[::-1])[::-1], 0]
+    fake_above = np.r_[np.cumsum(fake_hist[::-1])[::-1], 0]
+    return 1 - real_above / real_hist.sum(), fake_above / fake_hist.sum()
+
+
+class StreamingMetrics:
+    """Per-source logit histograms with on-demand EER/AUC/min-DCF/calibration; see the module docstring."""
+
+    def __init__(self, sources=(), num_bins: int = 8192, logit_range: float = 16.0, calibration_bins: int = 15):
+        self.sources = [str(s) for s in sources if str(s) != UNKNOWN_SOURCE] + [UNKNOWN_SOURCE]
+        self._index = {name: i for i, name in enumerate(self.sources)}
+        self.num_bins = num_bins
+        self.logit_range = logit_range
+        self.edges = np.linspace(-logit_range, logit_range, num_bins + 1)
+        self.calibration_bins = calibration_bins
+        self.reset()
+
+    def reset(self):
+        # counts[label, source, bin]
+        self.counts = np.zeros((2, len(self.sources), self.num_bins), dtype=np.int64)
+        # per probability bin: clips, sum of probabilities, sum of labels
+        self.calibration = np.zeros((3, self.calibration_bins), dtype=np.float64)
+        self.loss_sum = 0.0
+        self.brier_sum = 0.0
+
+    def source_codes(self, sources, n: int) -> np.ndarray:
+        if sources is None:
+            return np.full(n, self._index[UNKNOWN_SOURCE], dtype=np.int64)
+        sources = np.asarray(sources).reshape(-1)
+        if sources.dtype.kind in 'iu':
+            return sources.astype(np.int64)
+        unknown = self._index[UNKNOWN_SOURCE]
+        return np.array([self._index.get(str(s), unknown) for s in sources], dtype=np.int64)
+
+    def update(self, logits, labels, sources=None):
+        """Add a batch: logits (real-class), labels (1 = real) and source names or codes."""
+        logits = _numpy(logits).astype(np.float64)
+        labels = (_numpy(labels) == 1).astype(np.int64)
+        codes = self.source_codes(sources, len(logits))
+        scaled = (logits + self.logit_range) / (2 * self.logit_range) * self.num_bins
+        bins = np.clip(np.floor(scaled), 0, self.num_bins - 1).astype(np.int64)
+        flat = (labels * len(self.sources) + codes) * self.num_bins + bins
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+        probs = 1 / (1 + np.exp(-logits))
+        cal_bins = np.minimum((probs * self.calibration_bins).astype(np.int64), self.calibration_bins - 1)
+        self.calibration[0] += np.bincount(cal_bins, minlength=self.calibration_bins)
+        self.calibration[1] += np.bincount(cal_bins, weights=probs, minlength=self.calibration_bins)
+        self.calibration[2] += np.bincount(cal_bins, weights=labels, minlength=self.calibration_bins)
+        self.loss_sum += float(np.sum(np.logaddexp(0, logits) - labels * logits))
+        self.brier_sum += float(np.sum((probs - labels) ** 2))
+
+    def merge(self, other: 'StreamingMetrics'):
+        self.counts += other.counts
+        self.calibration += other.calibration
+        self.loss_sum += other.loss_sum
+        self.brier_sum += other.brier_sum
+
+    # --- metrics ----------------------------------------------------------
+
+    def detection(self, real_hist: np.ndarray, fake_hist: np.ndarray) -> dict:
+        """EER (+ threshold and error bound), AUC and min DCF of one real/fake histogram pair."""
+        n_real, n_fake = int(real_hist.sum()), int(fake_hist.sum())
+        if n_real == 0 or n_fake == 0:
+            return {'eer': float('nan'), 'eer_bound': float('nan'), 'eer_threshold': float('nan'),
+                    'auc': float('nan'), 'min_dcf': float('nan'), 'n_real': n_real, 'n_fake': n_fake}
+        p_miss, p_fa = _rates(real_hist, fake_hist)
+        # p_miss - p_fa rises from -1 to 1 over the edges; interpolate its zero crossing
+        d = p_miss - p_fa
+        k = int(np.argmax(d >= 0))
+        t = 0.0 if d[k] == d[k - 1] else -d[k - 1] / (d[k] - d[k - 1])
+        eer = (p_miss[k - 1] + p_fa[k - 1]) / 2 + t * ((p_miss[k] + p_fa[k]) - (p_miss[k - 1] + p_fa[k - 1])) / 2
+        threshold = self.edges[k - 1] + t * (self.edges[k] - self.edges[k - 1])
+        bound = max(real_hist[k - 1] / n_real, fake_hist[k - 1] / n_fake)
+
+        # ROC from the edges, ties inside a bin counted as half (trapezoid)
+        auc = float(np.trapz((1 - p_miss)[::-1], p_fa[::-1]))
+        dcf = C_MISS * (1 - P_SPOOF) * p_miss + C_FA * P_SPOOF * p_fa
+        min_dcf = float(dcf.min() / min(C_MISS * (1 - P_SPOOF), C_FA * P_SPOOF))
+        return {'eer': float(eer), 'eer_bound': float(bound), 'eer_threshold': float(threshold),
+                'auc': auc, 'min_dcf': min_dcf, 'n_real': n_real, 'n_fake': n_fake}
+
+    def compute(self) -> dict:
+        """Pooled and per-source metrics; rates are fractions, thresholds are logits."""
+        real_hist, fake_by_source = self.counts[1].sum(axis=0), self.counts[0]
+        n = int(self.counts.sum())
+        zero = self.num_bins // 2  # edges[zero] == 0 for an even bin count
+        correct = self.counts[1][:, zero:].sum() + self.counts[0][:, :zero].sum()
+        cal_n, cal_p, cal_y = self.calibration
+        filled = cal_n > 0
+        ece = float(np.sum(np.abs(cal_p[filled] - cal_y[filled])) / max(n, 1))
+        result = {
+            'clips': n,
+            **self.detection(real_hist, fake_by_source.sum(axis=0)),
+            'loss': self.loss_sum / max(n, 1),
+            'brier': self.brier_sum / max(n, 1),
+            'accuracy': float(correct / max(n, 1)),
+            'ece': ece,
+            'per_source': {},
+        }
+        for i, name in enumerate(self.sources):
+            if fake_by_source[i].sum():
+                result['per_source'][name] = self.detection(real_hist, fake_by_source[i])
+            elif self.counts[1][i].sum():
+                # Real source: share accepted at the pooled EER threshold
+                accepted = self.counts[1][i][self.edges[:-1] >= result['eer_threshold']].sum()
+                result['per_source'][name] = {'n_real': int(self.counts[1][i].sum()),
+                                              'accept_rate_at_eer': float(accepted / self.counts[1][i].sum())}
+        return result
+
+    def record(self) -> dict:
+        """compute() flattened for logs: EER, accuracy and per-source EER in percent."""
+        metrics = self.compute()
+        return {
+            'clips': metrics['clips'],
+            'eer': metrics['eer'] * 100,
+            'eer_bound': metrics['eer_bound'] * 100,
+            'auc': metrics['auc'],
+            'min_dcf': metrics['min_dcf'],
+            'accuracy': metrics['accuracy'] * 100,
+            'loss': metrics['loss'],
+            'brier': metrics['brier'],
+            'ece': metrics['ece'],
+            'per_source_eer': {k: v['eer'] * 100 for k, v in metrics['per_source'].items() if 'eer' in v},
+        }
+
+
+class _MetricsLoader:
+    """Proxy around the val DataLoader passing each batch's labels and sources to ValidationMetrics."""
+
+    def __init__(self, loader, hook: 'ValidationMetrics'):
+        self._loader = loader
+        self._hook = hook
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def __iter__(self):
+        hook, sources, offset = self._hook, self._hook.sources, 0
+        hook.metrics.reset()
+        try:
+            for batch in self._loader:
+                labels = batch[1]
+                hook.pending = (labels, None if sources is None else sources[offset:offset + len(labels)])
+                offset += len(labels)
+                yield batch
+        finally:
+            hook.pending = None
+        hook.report()
+
+
+class ValidationMetrics:
+    """
+    Streaming metrics for every validation pass train_nn makes over `loader`.
+
+    Usage:
+        validation = ValidationMetrics(val_loader, out_dir / 'val_metrics.jsonl')
+        val_loader = validation.wrap_loader(val_loader)
+        with validation:
+            train_nn(..., data_test=val_loader)
+    """
+
+    def __init__(self, loader, metrics_path=None, write: bool = True, log: Optional[Callable[[str], None]] = None):
+        if isinstance(loader.sampler, torch.utils.data.RandomSampler):
+            raise ValueError("ValidationMetrics needs a val loader without shuffling")
+        self.sources = loader_sources(loader)
+        self.metrics = StreamingMetrics(sorted(set(self.sources)) if self.sources is not None else ())
+        self.metrics_path = Path(metrics_path) if metrics_path else None
+        self.write = write
+        self.log = log or logger.info
+        self.passes = 0
+        self.pending = None
+        self.history = []
+        self._stack = contextlib.ExitStack()
+
+    def wrap_loader(self, loader):
+        return _MetricsLoader(loader, self)
+
+    def _forward_hook(self, module, inputs, output):
+        if module.training or self.pending is None:
+            return
+        labels, sources = self.pending
+        if len(output) == len(labels):
+            self.metrics.update(output, labels, sources)
+            self.pending = None
+
+    def _attach(self, model):
+        model.register_forward_hook(self._forward_hook)
+        return model
+
+    def report(self):
+        self.passes += 1
+        record = {'kind': 'epoch', 'pass': self.passes, **self.metrics.record()}
+        self.history.append(record)
+        if self.write and self.metrics_path is not None:
+            with open(self.metrics_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        worst = max(record['per_source_eer'].items(), key=lambda kv: kv[1], default=('-', float('nan')))
+        self.log(f"Validation pass {self.passes}: EER {record['eer']:.2f}% (±{record['eer_bound']:.2f}) | "
+                 f"AUC {record['auc']:.4f} | min DCF {record['min_dcf']:.4f} | ECE {record['ece']:.4f} | "
+                 f"worst source {worst[0]} {worst[1]:.2f}%")
+
+    def __enter__(self):
+        from brspeech_models import model_transform
+
+        if self.metrics_path is not None and self.write:
+            self.metrics_path.parent.mkdir(parents=True, exist_ok=True)
+        self._stack.enter_context(model_transform(self._attach))
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+        return False
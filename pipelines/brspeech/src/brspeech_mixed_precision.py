@@ -0,0 +1,288 @@
+"""
+Gradient accumulation, autocast mixed precision and activation checkpointing
+for train_nn.
+
+train_nn instantiates the optimizer and criterion classes from the trainer
+config and builds the model through get_model, so the training mode is
+expressed through those three extension points instead of a forked loop:
+
+- the optimizer class only applies an update every `grad_accum_steps`
+  calls to step() and averages the accumulated gradients; the train loader
+  proxy (TrainingMode.wrap_loader) applies a partial accumulation left at
+  the end of an epoch, so it is neither dropped nor carried into the next
+  epoch, and under DDP skips the gradient all-reduce of every micro-batch
+  but the last of an update,
+- the criterion computes the loss in float32 and, for fp16, multiplies the
+  gradient (not the reported loss) by a dynamic loss scale,
+- the model transform runs the forward under torch.autocast and enables
+  gradient checkpointing in the wav2vec2 encoder.
+"""
+
+import functools
+import logging
+from typing import Callable, Optional
+
+import torch
+
+from brspeech_models import find_ssl_encoder
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ['fp32', 'bf16', 'fp16']
+
+
+def resolve_precision(precision: str, device: torch.device) -> Optional[torch.dtype]:
+    """Autocast dtype for a precision name; fp16 falls back to bf16 on CPU."""
+    if precision == 'fp32':
+        return None
+    if precision == 'fp16' and device.type != 'cuda':
+        logger.warning("⚠️ fp16 autocast needs CUDA; using bf16 on CPU")
+        precision = 'bf16'
+    return torch.bfloat16 if precision == 'bf16' else torch.float16
+
+
+class LossScale:
+    """Dynamic loss scale shared by the criterion and the optimizer (fp16 only)."""
+
+    def __init__(self, enabled: bool, init_scale: float = 2.0 ** 16, growth_interval: int = 2000):
+        self.enabled = enabled
+        self.scale = init_scale if enabled else 1.0
+        self.growth_interval = growth_interval
+        self.good_steps = 0
+        self.skipped_steps = 0
+
+    def update(self, finite: bool):
+        if not self.enabled:
+            return
+        if finite:
+            self.good_steps += 1
+            if self.good_steps % self.growth_interval == 0:
+                self.scale *= 2.0
+        else:
+            self.skipped_steps += 1
+            self.good_steps = 0
+            self.scale = max(self.scale / 2.0, 1.0)
+            logger.warning(f"⚠️ Non-finite gradients, skipping update (loss scale -> {self.scale:g})")
+
+
+class _ScaleGrad(torch.autograd.Function):
+    """Identity in forward, multiplies the incoming gradient by `scale` in backward."""
+
+    @staticmethod
+    def forward(ctx, loss, scale):
+        ctx.scale = scale
+        return loss.view_as(loss)
+
+    @staticmethod
+    def backward(ctx, grad):
+        return grad * ctx.scale, None
+
+
+def scaled_criterion(base: type, loss_scale: LossScale) -> type:
+    """Criterion class computing the loss in float32 and applying the loss scale to its gradient."""
+
+    class ScaledCriterion(base):
+        def forward(self, input, target):
+            loss = super().forward(input.float(), target.float())
+            if loss_scale.enabled and torch.is_grad_enabled():
+                loss = _ScaleGrad.apply(loss, loss_scale.scale)
+            return loss
+
+    ScaledCriterion.__name__ = base.__name__
+    return ScaledCriterion
+
+
+def accumulating_optimizer(base: type, grad_accum_steps: int, loss_scale: LossScale,
+                           on_create: Optional[Callable] = None) -> type:
+    """
+    Optimizer class that updates once per `grad_accum_steps` calls to step().
+
+    zero_grad() is ignored while gradients are being accumulated, so it works
+    with either order of zero_grad()/backward() in the training loop. On the
+    update the summed gradients are divided by the number of micro-batches
+    (and by the loss scale) and checked for inf/nan when fp16 is used.
+    flush() applies a partial accumulation (end of epoch) through step(), so
+    step hooks and wrapping optimizer classes see a regular update.
+    """
+
+    class AccumulatingOptimizer(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.micro_steps = 0
+            self._flushing = False
+            if on_create is not None:
+                on_create(self)
+
+        def zero_grad(self, set_to_none: bool = True):
+            if self.micro_steps == 0:
+                super().zero_grad(set_to_none=set_to_none)
+
+        def _grads(self):
+            return [p.grad for group in self.param_groups for p in group['params'] if p.grad is not None]
+
+        def flush(self):
+            if self.micro_steps == 0:
+                return
+            self._flushing = True
+            try:
+                self.step()
+            finally:
+                self._flushing = False
+            self.zero_grad()
+
+        def step(self, closure=None):
+            if not self._flushing:
+                self.micro_steps += 1
+                if self.micro_steps < grad_accum_steps:
+                    return None
+            micro_batches, self.micro_steps = self.micro_steps, 0
+            grads = self._grads()
+            divisor = micro_batches * loss_scale.scale
+            if grads and divisor != 1:
+                torch._foreach_div_(grads, divisor)
+            if loss_scale.enabled:
+                finite = bool(torch.stack([torch.isfinite(g).all() for g in grads]).all()) if grads else True
+                loss_scale.update(finite)
+                if not finite:
+                    super().zero_grad(set_to_none=True)
+                    return None
+            return super().step(closure)
+
+    AccumulatingOptimizer.__name__ = base.__name__
+    return AccumulatingOptimizer
+
+
+def autocast_forward(model: torch.nn.Module, device_type: str, dtype: torch.dtype) -> torch.nn.Module:
+    """Run the model forward under torch.autocast and return float32 outputs."""
+    forward = model.forward
+
+    @functools.wraps(forward)
+    def wrapped(*args, **kwargs):
+        with torch.autocast(device_type=device_type, dtype=dtype):
+            output = forward(*args, **kwargs)
+        return output.float() if torch.is_tensor(output) else output
+
+    model.forward = wrapped
+    return model
+
+
+def enable_activation_checkpointing(model: torch.nn.Module) -> torch.nn.Module:
+    """Recompute wav2vec2 encoder activations in backward instead of storing them."""
+    encoder = find_ssl_encoder(model)
+    try:
+        encoder.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
+    except TypeError:  # older transformers
+        encoder.gradient_checkpointing_enable()
+    return model
+
+
+class _AccumulationLoader:
+    """
+    Proxy around the train DataLoader for gradient accumulation: under DDP it
+    turns the all-reduce off for micro-batches that do not end an update (what
+    model.no_sync() does), and at the end of the epoch it applies the partial
+    accumulation of the remaining micro-batches.
+    """
+
+    def __init__(self, loader, mode: 'TrainingMode'):
+        self._loader = loader
+        self._mode = mode
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def __iter__(self):
+        mode = self._mode
+        num_batches = len(self._loader)
+        try:
+            for position, batch in enumerate(self._loader, start=1):
+                if mode.ddp_model is not None and mode.optimizer_instance is not None:
+                    ends_update = (mode.optimizer_instance.micro_steps + 1 == mode.grad_accum_steps
+                                   or position == num_batches)
+                    mode.ddp_model.require_backward_grad_sync = ends_update
+                yield batch
+        finally:
+            if mode.ddp_model is not None:
+                mode.ddp_model.require_backward_grad_sync = True
+        if mode.optimizer_instance is not None and mode.optimizer_instance.micro_steps:
+            logger.info(f"End of epoch: applying a partial accumulation of "
+                        f"{mode.optimizer_instance.micro_steps}/{mode.grad_accum_steps} micro-batches")
+            mode.optimizer_instance.flush()
+
+
+class TrainingMode:
+    """
+    The `training` block options grad_accum_steps, precision and
+    activation_checkpointing, turned into the optimizer class, criterion class
+    and model transform handed to train_nn.
+    """
+
+    def __init__(self, device: torch.device, grad_accum_steps: int = 1, precision: str = 'fp32',
+                 activation_checkpointing: bool = False):
+        if grad_accum_steps < 1:
+            raise ValueError(f"grad_accum_steps must be >= 1, got {grad_accum_steps}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision} (expected one of {PRECISIONS})")
+        self.device = device
+        self.grad_accum_steps = grad_accum_steps
+        self.precision = precision
+        self.autocast_dtype = resolve_precision(precision, device)
+        self.activation_checkpointing = activation_checkpointing
+        self.loss_scale = LossScale(enabled=self.autocast_dtype == torch.float16)
+        self.optimizer_instance = None
+        self.ddp_model = None
+
+    @classmethod
+    def from_config(cls, model_config: dict, device: torch.device, args=None) -> 'TrainingMode':
+        training = model_config['training']
+        return cls(
+            device,
+            grad_accum_steps=getattr(args, 'grad_accum_steps', None) or training.get('grad_accum_steps', 1),
+            precision=getattr(args, 'precision', None) or training.get('precision', 'fp32'),
+            activation_checkpointing=(getattr(args, 'activation_checkpointing', False)
+                                      or training.get('activation_checkpointing', False)),
+        )
+
+    @property
+    def active(self) -> bool:
+        return self.grad_accum_steps > 1 or self.autocast_dtype is not None or self.activation_checkpointing
+
+    def optimizer(self, base: type) -> type:
+        if self.grad_accum_steps == 1 and not self.loss_scale.enabled:
+            return base
+        return accumulating_optimizer(base, self.grad_accum_steps, self.loss_scale, self._attach_optimizer)
+
+    def _attach_optimizer(self, optimizer):
+        self.optimizer_instance = optimizer
+
+    def attach_model(self, model: torch.nn.Module) -> torch.nn.Module:
+        """model_transform callable, entered after the DDP transform, to find the DDP wrapper."""
+        if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+            self.ddp_model = model
+        return model
+
+    def wrap_loader(self, loader):
+        """Epoch-end flush (and DDP sync control) of gradient accumulation; no-op without it."""
+        if self.grad_accum_steps == 1:
+            return loader
+        return _AccumulationLoader(loader, self)
+
+    def criterion(self, base: type) -> type:
+        if self.autocast_dtype is None:
+            return base
+        return scaled_criterion(base, self.loss_scale)
+
+    def transform(self, model: torch.nn.Module) -> torch.nn.Module:
+        if self.activation_checkpointing:
+            enable_activation_checkpointing(model)
+        if self.autocast_dtype is not None:
+            autocast_forward(model, self.device.type, self.autocast_dtype)
+        return model
+
+    def describe(self, batch_size: int) -> str:
+        return (f"precision={self.precision}, grad_accum_steps={self.grad_accum_steps} "
+                f"(effective batch {batch_size * self.grad_accum_steps}), "
+                f"activation_checkpointing={self.activation_checkpointing}")
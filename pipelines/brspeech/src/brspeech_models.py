@@ -0,0 +1,252 @@
+"""
+Model helpers for the BrSpeech pipeline.
+Locates the SSL front end inside a W2V+AASIST model and lets our scripts
+adjust the model that train_nn builds internally through get_model.
+
+Also implements the SSL layer options of `model.parameters`:
+
+    ssl_num_layers: K         keep only the first K wav2vec2 transformer layers
+    ssl_layer_sum: [i, j, ...] feed the head a learned softmax-weighted sum of
+                              these hidden states (0 = input to the first layer)
+
+These keys are consumed here and never reach get_model. Truncation writes a
+K-layer copy of ssl_pretrained_path / ssl_config_path once, so the dropped
+layers are never loaded when the model is built.
+
+The student models of brspeech_students.py (mel_cnn, raw_cnn) are built here
+too: by build_model directly, and inside train_nn through local_models.
+"""
+
+import contextlib
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+SSL_LAYER_OPTIONS = ('ssl_num_layers', 'ssl_layer_sum')
+TRUNCATED_SSL_DIR = os.getenv('BRSPEECH_SSL_TRUNCATED_DIR', 'fine_tuned_models/ssl_truncated')
+_LAYER_KEY = re.compile(r'(^|\.)encoder\.layers\.(\d+)\.')
+
+
+def _is_hf_wav2vec2(module: nn.Module) -> bool:
+    return type(module).__name__ in ('Wav2Vec2Model', 'Wav2Vec2ForPreTraining')
+
+
+def find_ssl_encoder(model: nn.Module) -> nn.Module:
+    """Return the Hugging Face wav2vec2 encoder inside the model."""
+    for _, module in model.named_modules():
+        if _is_hf_wav2vec2(module):
+            return module
+    raise ValueError(f"No wav2vec2 encoder found in {type(model).__name__}")
+
+
+def find_ssl_frontend(model: nn.Module) -> Tuple[nn.Module, str]:
+    """
+    Return (module, method) for the call that turns waveforms into SSL features.
+
+    Prefers the outermost wrapper exposing `extract_feat` around the wav2vec2
+    encoder, so any post-processing the wrapper does is included; otherwise
+    falls back to the wav2vec2 encoder's own forward.
+    """
+    encoder = find_ssl_encoder(model)
+    for _, module in model.named_modules():
+        if hasattr(module, 'extract_feat') and any(m is encoder for m in module.modules()):
+            return module, 'extract_feat'
+    return encoder, 'forward'
+
+
+def module_prefix(model: nn.Module, module: nn.Module) -> str:
+    """State-dict key prefix of a submodule, e.g. 'ssl_model.'."""
+    for name, candidate in model.named_modules():
+        if candidate is module:
+            return f"{name}." if name else ''
+    raise ValueError("Module is not part of the model")
+
+
+@contextlib.contextmanager
+def model_transform(transform: Callable[[nn.Module], nn.Module]):
+    """
+    Apply `transform` to every model built through get_model while active.
+
+    train_nn creates its own model from the YAML config, so options that change
+    the model (frozen cached front end, truncated encoder, ...) hook the factory
+    used by src.train_models instead of forking the upstream trainer.
+    """
+    import src.models
+    import src.train_models
+
+    targets = [m for m in (src.train_models, src.models) if hasattr(m, 'get_model')]
+    originals = {m: m.get_model for m in targets}
+    factory = originals[src.models]
+
+    def get_model(*args, **kwargs):
+        return transform(factory(*args, **kwargs))
+
+    for m in targets:
+        m.get_model = get_model
+    try:
+        yield
+    finally:
+        for m, fn in originals.items():
+            m.get_model = fn
+
+
+@contextlib.contextmanager
+def local_models():
+    """
+    Serve the student names of brspeech_students.py through get_model while
+    active; other names go to the upstream factory. Enter it before any
+    model_transform, which captures the factory it wraps on entry.
+    """
+    import src.models
+    import src.train_models
+    from brspeech_students import STUDENT_MODELS, build_student
+
+    targets = [m for m in (src.train_models, src.models) if hasattr(m, 'get_model')]
+    originals = {m: m.get_model for m in targets}
+    factory = originals[src.models]
+
+    def get_model(name, *args, **kwargs):
+        if name in STUDENT_MODELS:
+            return build_student(name, *args, **kwargs)
+        return factory(name, *args, **kwargs)
+
+    for m in targets:
+        m.get_model = get_model
+    try:
+        yield
+    finally:
+        for m, fn in originals.items():
+            m.get_model = fn
+
+
+# --- SSL layer options ---------------------------------------------------------
+
+def truncate_ssl_checkpoint(ssl_path: str, config_path: str, num_layers: int,
+                            out_root: str = TRUNCATED_SSL_DIR) -> Tuple[str, str]:
+    """
+    Write (once) a wav2vec2 checkpoint and config keeping only the first
+    `num_layers` transformer layers; returns the new (weights, config) paths.
+    The source is memory-mapped so dropped layers are never read into memory.
+    """
+    source = os.stat(ssl_path)
+    tag = hashlib.sha1(f"{os.path.abspath(ssl_path)}:{source.st_size}:{source.st_mtime_ns}".encode()).hexdigest()[:10]
+    out_dir = Path(out_root) / f"{Path(ssl_path).parent.name}_L{num_layers}_{tag}"
+    weights_path, out_config_path = out_dir / 'pytorch_model.bin', out_dir / 'config.json'
+    if weights_path.exists() and out_config_path.exists():
+        return str(weights_path), str(out_config_path)
+
+    with open(config_path, 'r') as f:
+        ssl_config = json.load(f)
+    if num_layers < 1 or num_layers > ssl_config['num_hidden_layers']:
+        raise ValueError(f"ssl_num_layers must be in 1..{ssl_config['num_hidden_layers']}, got {num_layers}")
+    if Path(ssl_path).suffix == '.safetensors':
+        from brspeech_checkpoints import load_safetensors
+
+        state = load_safetensors(ssl_path, restore_dtype=True)
+    else:
+        try:
+            state = torch.load(ssl_path, map_location='cpu', mmap=True, weights_only=True)
+        except RuntimeError:  # legacy (non-zip) checkpoints cannot be memory-mapped
+            state = torch.load(ssl_path, map_location='cpu', weights_only=True)
+    kept = {}
+    for key, tensor in state.items():
+        match = _LAYER_KEY.search(key)
+        if match is None or int(match.group(2)) < num_layers:
+            kept[key] = tensor.clone()
+    ssl_config['num_hidden_layers'] = num_layers
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    torch.save(kept, weights_path.with_suffix('.bin.tmp'))
+    os.replace(weights_path.with_suffix('.bin.tmp'), weights_path)
+    with open(out_config_path, 'w') as f:
+        json.dump(ssl_config, f, indent=2)
+    logger.info(f"Truncated wav2vec2 to {num_layers} layers: {weights_path} "
+                f"({len(kept)}/{len(state)} tensors kept)")
+    return str(weights_path), str(out_config_path)
+
+
+class LayerWeightedSum(nn.Module):
+    """Softmax-weighted sum of selected wav2vec2 hidden states, weights learned with the model."""
+
+    def __init__(self, layers):
+        super().__init__()
+        self.layers = list(layers)
+        self.weights = nn.Parameter(torch.zeros(len(self.layers)))
+
+    def forward(self, hidden_states):
+        stacked = torch.stack([hidden_states[i] for i in self.layers])
+        weights = torch.softmax(self.weights, dim=0).to(stacked.dtype)
+        return (weights.view(-1, 1, 1, 1) * stacked).sum(0)
+
+
+def add_layer_weighted_sum(model: nn.Module, layers) -> nn.Module:
+    """
+    Make the wav2vec2 encoder return a learned weighted sum of `layers` as its
+    last_hidden_state. The weights live in the encoder ('layer_sum.weights')
+    so they are saved and loaded with the checkpoint.
+    """
+    encoder = find_ssl_encoder(model)
+    num_hidden = encoder.config.num_hidden_layers
+    if layers == 'all':
+        layers = range(num_hidden + 1)
+    if any(i < 0 or i > num_hidden for i in layers):
+        raise ValueError(f"ssl_layer_sum layers must be in 0..{num_hidden}, got {list(layers)}")
+    encoder.layer_sum = LayerWeightedSum(layers).to(next(encoder.parameters()).device)
+    forward = encoder.forward
+
+    def forward_with_layer_sum(*args, **kwargs):
+        kwargs['output_hidden_states'] = True
+        kwargs.setdefault('return_dict', True)
+        output = forward(*args, **kwargs)
+        output.last_hidden_state = encoder.layer_sum(output.hidden_states)
+        return output
+
+    encoder.forward = forward_with_layer_sum
+    return model
+
+
+def prepare_ssl_layers(model_config: dict) -> Tuple[dict, Optional[Callable[[nn.Module], nn.Module]]]:
+    """
+    Resolve the SSL layer options of `model.parameters`.
+    Returns a config for get_model/train_nn (options removed, truncated SSL
+    paths substituted) and the model transform to apply, if any.
+    """
+    if not any(k in model_config['model']['parameters'] for k in SSL_LAYER_OPTIONS):
+        return model_config, None
+    model_config = copy.deepcopy(model_config)
+    params = model_config['model']['parameters']
+    num_layers = params.pop('ssl_num_layers', None)
+    layer_sum = params.pop('ssl_layer_sum', None)
+    if num_layers is not None:
+        if not params.get('ssl_config_path'):
+            raise ValueError("ssl_num_layers needs model.parameters.ssl_config_path")
+        params['ssl_pretrained_path'], params['ssl_config_path'] = truncate_ssl_checkpoint(
+            params['ssl_pretrained_path'], params['ssl_config_path'], int(num_layers))
+    transform = None
+    if layer_sum is not None:
+        transform = lambda model: add_layer_weighted_sum(model, layer_sum)
+    return model_config, transform
+
+
+def build_model(model_config: dict, device) -> nn.Module:
+    """get_model with the SSL layer options of the config applied; student names are built locally."""
+    from brspeech_students import STUDENT_MODELS, build_student
+
+    if model_config['model']['name'] in STUDENT_MODELS:
+        return build_student(model_config['model']['name'], model_config['model']['parameters'], device)
+
+    from src.models import get_model
+
+    model_config, transform = prepare_ssl_layers(model_config)
+    model = get_model(model_config['model']['name'], model_config['model']['parameters'], device)
+    return transform(model) if transform is not None else model
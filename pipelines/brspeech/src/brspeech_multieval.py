@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Multi-checkpoint evaluation.
+Decodes the evaluation set once into an int16 cache, builds the model (and
+loads the wav2vec2 backbone) once, and then runs every checkpoint over the
+cached batches by swapping state dicts. Checkpoints whose SSL front-end
+weights are identical (e.g. a frozen front end) share one SSL pass: the
+features are computed once and only the AASIST heads run per checkpoint.
+
+Writes one scores file per checkpoint plus a leaderboard table.
+"""
+
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader
+
+from brspeech_audio import INT16_SCALE, to_int16
+from brspeech_checkpoints import fast_loading, load_state
+from brspeech_eval import IndexedDataset, ScoreWriter, autocast_context, eer_auc
+from brspeech_models import find_ssl_frontend, module_prefix
+from src.datasets.brspeech_dataset import BrSpeechDataset
+from train_brspeech import load_config, build_train_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def expand_checkpoints(patterns) -> list:
+    """Checkpoint files from globs and/or directories (searched recursively for *.pth)."""
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found.extend(glob.glob(os.path.join(pattern, '**', '*.pth'), recursive=True))
+        else:
+            found.extend(glob.glob(pattern, recursive=True))
+    return sorted(set(found))
+
+
+def decode_once(dataset, cache_path: Path, batch_size: int, num_workers: int):
+    """Decode every clip of `dataset` once into an int16 memmap; returns (waveforms, labels)."""
+    loader = DataLoader(IndexedDataset(dataset), batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    waveforms, labels = None, np.zeros(len(dataset), dtype=np.int8)
+    for batch_x, batch_y, batch_idx in loader:
+        if waveforms is None:
+            waveforms = np.memmap(cache_path, dtype=np.int16, mode='w+', shape=(len(dataset), batch_x.shape[1]))
+        waveforms[batch_idx.numpy()] = to_int16(batch_x.numpy())
+        labels[batch_idx.numpy()] = batch_y.numpy()
+    waveforms.flush()
+    return waveforms, labels
+
+
+def iter_batches(array, batch_size: int):
+    for start in range(0, len(array), batch_size):
+        yield start, array[start:start + batch_size]
+
+
+def frontend_hash(state_dict: dict, prefix: str) -> str:
+    digest = hashlib.sha1()
+    for key in sorted(k for k in state_dict if k.startswith(prefix)):
+        digest.update(key.encode())
+        digest.update(state_dict[key].cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def checkpoint_name(path: str, common_root: str) -> str:
+    return os.path.splitext(os.path.relpath(path, common_root))[0].replace(os.sep, '__')
+
+
+def score_checkpoint(model, inputs, labels, paths, synth, scores_file, device, batch_size, bf16) -> dict:
+    """Run one loaded checkpoint over cached inputs (waveforms or SSL features)."""
+    logits = np.empty(len(labels), dtype=np.float32)
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for offset, batch in iter_batches(inputs, batch_size):
+            batch_x = torch.from_numpy(np.asarray(batch))
+            if batch_x.dtype == torch.int16:
+                batch_x = batch_x.float() / INT16_SCALE
+            with autocast_context(device, bf16):
+                output = model(batch_x.float().to(device))
+            logits[offset:offset + len(batch)] = output.float().cpu().numpy().ravel()
+    elapsed = time.perf_counter() - start
+
+    scores = 1 / (1 + np.exp(-logits))
+    with ScoreWriter(scores_file) as writer:
+        writer.write(pd.DataFrame({
+            'path': paths,
+            'true_label': labels,
+            'prediction_score': scores,
+            'predicted_label': (scores > 0.5).astype(int),
+        }))
+
+    eer, auc_score = eer_auc(labels, scores)
+    row = {
+        'eer': eer * 100,
+        'auc': auc_score,
+        'accuracy_05': np.mean((scores > 0.5) == labels) * 100,
+        'clips_per_sec': len(labels) / elapsed,
+    }
+    # Per-source EER: real vs each TTS system
+    for source in sorted(set(synth) - {'bonafide'}):
+        mask = (synth == source) | (labels == 1)
+        row[f'eer_{source}'] = eer_auc(labels[mask], scores[mask])[0] * 100
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate many checkpoints with a single decode of the test set')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--checkpoints', nargs='+', required=True,
+                        help='Checkpoint globs or directories (e.g. fine_tuned_models/w2v_aasist_lr_*_wd_*)')
+    parser.add_argument('--subset', type=str, default='test', choices=['train', 'val', 'test'])
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--device', type=str, default='cuda')
+    parser.add_argument('--bf16', action='store_true', help='bf16 autocast')
+    parser.add_argument('--out_dir', type=str, default='fine_tuned_models/multi_eval')
+    args = parser.parse_args()
+
+    from brspeech_models import build_model
+    from brspeech_ssl_cache import freeze_with_cached_features
+
+    checkpoints = expand_checkpoints(args.checkpoints)
+    if not checkpoints:
+        raise FileNotFoundError(f"No checkpoints matched: {args.checkpoints}")
+    logger.info(f"Evaluating {len(checkpoints)} checkpoints")
+
+    model_config = load_config(args.config)
+    device = torch.device(args.device if torch.cuda.is_available() else 'cpu')
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # 1. Decode once
+    dataset = BrSpeechDataset(
+        build_train_config(model_config, device), args.subset,
+        backend=model_config['data'].get('backend', 'flac'),
+        shard_dir=model_config['data'].get('shard_dir'),
+        nb_samp=model_config['model']['parameters'].get('nb_samp', 64600),
+        seek_decode=model_config['data'].get('seek_decode', False),
+    )
+    start = time.perf_counter()
+    waveforms, labels = decode_once(dataset, out_dir / f'.{args.subset}_waveforms.i16', args.batch_size, args.num_workers)
+    logger.info(f"Decoded {len(labels)} clips once in {time.perf_counter() - start:.1f}s")
+    paths = dataset.samples_df['path'].to_numpy()
+    synth = dataset.samples_df['synth'].to_numpy()
+
+    # 2. Build the model once and group checkpoints by SSL front-end weights
+    with fast_loading(overwrite=True):  # every checkpoint replaces all weights
+        model = build_model(model_config, device)
+    model.to(device)
+    model.eval()
+    frontend, method = find_ssl_frontend(model)
+    prefix = module_prefix(model, frontend)
+    groups = defaultdict(list)
+    for ckpt in checkpoints:
+        groups[frontend_hash(load_state(ckpt), prefix)].append(ckpt)
+    logger.info(f"{len(groups)} distinct SSL front ends across {len(checkpoints)} checkpoints")
+
+    common_root = os.path.commonpath([os.path.dirname(os.path.abspath(c)) for c in checkpoints])
+    leaderboard = []
+    for group_idx, group in enumerate(groups.values()):
+        inputs = waveforms
+        if len(group) > 1:
+            # Shared front end: run the SSL encoder once for the whole group
+            model.load_state_dict(load_state(group[0], map_location=device))
+            extract = getattr(frontend, method)
+            features = None
+            with torch.inference_mode():
+                for offset, batch in iter_batches(waveforms, args.batch_size):
+                    batch_x = (torch.from_numpy(np.asarray(batch)).float() / INT16_SCALE).to(device)
+                    output = extract(batch_x)
+                    feats = (output if torch.is_tensor(output) else output[0]).to(torch.float16).cpu().numpy()
+                    if features is None:
+                        output_type = 'tensor' if torch.is_tensor(output) else 'model_output'
+                        features = np.memmap(out_dir / f'.ssl_features_{group_idx}.f16', dtype=np.float16, mode='w+',
+                                             shape=(len(labels),) + feats.shape[1:])
+                    features[offset:offset + len(feats)] = feats
+            inputs = features
+            # An instance-level patch (e.g. the ssl_layer_sum forward) must survive the passthrough
+            patched = vars(frontend).get(method)
+            freeze_with_cached_features(model, output_type)
+            logger.info(f"Shared SSL pass done for {len(group)} checkpoints")
+
+        for ckpt in group:
+            model.load_state_dict(load_state(ckpt, map_location=device))
+            name = checkpoint_name(ckpt, common_root)
+            scores_file = out_dir / f"scores_{name}.csv"
+            row = score_checkpoint(model, inputs, labels, paths, synth, scores_file, device, args.batch_size, args.bf16)
+            row.update({'checkpoint': ckpt, 'scores_file': str(scores_file)})
+            leaderboard.append(row)
+            logger.info(f"{name}: EER {row['eer']:.2f}% | AUC {row['auc']:.4f} | {row['clips_per_sec']:.0f} clips/s")
+
+        if len(group) > 1:
+            # Undo the passthrough for the next group
+            if patched is not None:
+                setattr(frontend, method, patched)
+            elif method in vars(frontend):
+                delattr(frontend, method)
+
+    table = pd.DataFrame(leaderboard).sort_values('eer')
+    columns = ['checkpoint', 'eer', 'auc', 'accuracy_05'] + [c for c in table if c.startswith('eer_')] + ['clips_per_sec', 'scores_file']
+    table = table[columns]
+    table.to_csv(out_dir / 'leaderboard.csv', index=False)
+    logger.info("=== LEADERBOARD ===\n" + table.drop(columns=['scores_file']).to_string(index=False, float_format='%.3f'))
+    logger.info(f"Leaderboard saved to: {out_dir / 'leaderboard.csv'}")
+
+    del waveforms
+    for tmp in [out_dir / f'.{args.subset}_waveforms.i16', *out_dir.glob('.ssl_features_*.f16')]:
+        tmp.unlink()
+
+
+if __name__ == "__main__":
+    main()
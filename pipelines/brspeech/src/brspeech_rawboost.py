@@ -0,0 +1,201 @@
+"""
+Batched RawBoost augmentation (Tak et al., ICASSP 2022) on torch tensors.
+
+The reference implementation filters one clip at a time with NumPy/SciPy
+inside the dataset workers. Here every algorithm runs on a whole collated
+(B, T) batch, on CPU or on the training device, with independent random
+parameters per clip:
+
+    1  linear and non-linear convolutive noise (LnL)
+    2  impulsive signal-dependent additive noise (ISD)
+    3  stationary signal-independent coloured additive noise (SSI)
+    4  1 -> 2 -> 3      5  1 -> 2      6  1 -> 3      7  2 -> 3
+    8  1 and 2 in parallel, summed
+
+Notch filters follow the reference: each is a cascade of `n_bands` Hamming
+windowed FIR band-stops (scipy.signal.firwin) with random centre, width and
+odd length, normalised to a random gain. Filtering is done by FFT
+convolution with the same centred alignment as the reference filterFIR.
+ISD picks each sample with probability beta/100 instead of drawing exactly
+that many positions, which has the same expected count.
+"""
+
+import math
+
+import torch
+
+# Defaults of the reference RawBoost command line
+DEFAULT_PARAMS = {
+    'N_f': 5, 'nBands': 5, 'minF': 20, 'maxF': 8000, 'minBW': 100, 'maxBW': 1000,
+    'minCoeff': 10, 'maxCoeff': 100, 'minG': 0, 'maxG': 0,
+    'minBiasLinNonLin': 5, 'maxBiasLinNonLin': 20,
+    'P': 10, 'g_sd': 2, 'SNRmin': 10, 'SNRmax': 40,
+}
+ALGORITHMS = {
+    1: ['lnl'], 2: ['isd'], 3: ['ssi'], 4: ['lnl', 'isd', 'ssi'],
+    5: ['lnl', 'isd'], 6: ['lnl', 'ssi'], 7: ['isd', 'ssi'],
+}
+
+
+def _uniform(low, high, shape, device):
+    # Like np.random.uniform, also valid for low > high
+    return low + (high - low) * torch.rand(shape, device=device)
+
+
+def _norm_wav(x: torch.Tensor, always: bool) -> torch.Tensor:
+    peak = x.abs().amax(dim=-1, keepdim=True).clamp_min(1e-12)
+    if always:
+        return x / peak
+    return torch.where(peak > 1, x / peak, x)
+
+
+class BatchRawBoost:
+    """
+    RawBoost for (B, T) float waveform batches.
+
+    Usage:
+        rawboost = BatchRawBoost(algo_id=4, sample_rate=16000)
+        batch_x = rawboost(batch_x)
+    """
+
+    def __init__(self, algo_id: int, sample_rate: int = 16000, **params):
+        if algo_id not in ALGORITHMS and algo_id != 8:
+            raise ValueError(f"Unknown RawBoost algorithm {algo_id}; expected 1-8")
+        unknown = set(params) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown RawBoost parameters: {sorted(unknown)}")
+        self.algo_id = algo_id
+        self.fs = sample_rate
+        self.p = {**DEFAULT_PARAMS, **params}
+
+    # --- filters ----------------------------------------------------------
+
+    def _notch_filters(self, shape, min_g, max_g, device) -> torch.Tensor:
+        """
+        Random cascaded band-stop FIR filters, one per entry of `shape`:
+        (*shape, n_bands * (L - 1) + 1) coefficients, centred, gain-normalised.
+        """
+        p, fs = self.p, self.fs
+        n_bands = p['nBands']
+        taps = p['maxCoeff'] + 1 if p['maxCoeff'] % 2 == 0 else p['maxCoeff'] + 2  # odd bound on c
+        band_shape = (*shape, n_bands, 1)
+        fc = _uniform(p['minF'], p['maxF'], band_shape, device)
+        bw = _uniform(p['minBW'], p['maxBW'], band_shape, device)
+        c = _uniform(p['minCoeff'], p['maxCoeff'], band_shape, device).floor()
+        c = c + (c % 2 == 0)  # odd number of taps
+        nyq = fs / 2
+        f1 = (fc - bw / 2).clamp_min(1e-3) / nyq
+        f2 = (fc + bw / 2).clamp_max(nyq - 1e-3) / nyq
+
+        # firwin(c, [f1, f2], window='hamming') band-stop, zero-padded to `taps` around its centre
+        m = torch.arange(taps, device=device) - (taps - 1) / 2
+        half = (c - 1) / 2
+        valid = m.abs() <= half
+        h = f1 * torch.sinc(f1 * m) + torch.sinc(m) - f2 * torch.sinc(f2 * m)
+        window = 0.54 - 0.46 * torch.cos(math.pi * (m + half) / half)
+        h = torch.where(valid, h * window, torch.zeros_like(h))
+        h = h / h.sum(dim=-1, keepdim=True)  # unit gain at DC, as firwin(scale=True)
+
+        # Cascade the bands in the frequency domain; >= 513 bins, about freqz's 512 for the gain
+        length = n_bands * (taps - 1) + 1
+        nfft = max(1024, 1 << (length - 1).bit_length())
+        response = torch.fft.rfft(h, nfft).prod(dim=-2)
+        b = torch.fft.irfft(response, nfft)[..., :length]
+        gain = _uniform(min_g, max_g, (*shape, 1), device)
+        return 10 ** (gain / 20) * b / response.abs().amax(dim=-1, keepdim=True)
+
+    @staticmethod
+    def _filter(x: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
+        """Centred FIR filtering of x (..., T) with b (..., L), aligned like the reference filterFIR."""
+        T, L = x.shape[-1], b.shape[-1]
+        nfft = 1 << (T + L - 1).bit_length()
+        full = torch.fft.irfft(torch.fft.rfft(x, nfft) * torch.fft.rfft(b, nfft), nfft)
+        start = (L - 1) // 2 + 1
+        return full[..., start:start + T]
+
+    # --- algorithms -------------------------------------------------------
+
+    def lnl(self, x: torch.Tensor) -> torch.Tensor:
+        """Linear and non-linear convolutive noise: sum of filtered powers x^1 .. x^N_f."""
+        p = self.p
+        n_f, batch = p['N_f'], x.shape[0]
+        # First filter uses [minG, maxG]; the non-linear ones are attenuated by the bias
+        first = self._notch_filters((batch, 1), p['minG'], p['maxG'], x.device)
+        rest = self._notch_filters((batch, n_f - 1), p['minG'] - p['minBiasLinNonLin'],
+                                   p['maxG'] - p['maxBiasLinNonLin'], x.device)
+        b = torch.cat([first, rest], dim=1)
+        powers = torch.stack([x ** (i + 1) for i in range(n_f)], dim=1)
+        y = self._filter(powers, b).sum(dim=1)
+        y = y - y.mean(dim=-1, keepdim=True)
+        return _norm_wav(y, always=False)
+
+    def isd(self, x: torch.Tensor) -> torch.Tensor:
+        """Impulsive signal-dependent noise on a random beta% (beta ~ U(0, P)) of the samples."""
+        beta = _uniform(0, self.p['P'], (x.shape[0], 1), x.device)
+        mask = torch.rand_like(x) < beta / 100
+        f_r = (2 * torch.rand_like(x) - 1) * (2 * torch.rand_like(x) - 1)
+        y = x + mask * (self.p['g_sd'] * x * f_r)
+        return _norm_wav(y, always=False)
+
+    def ssi(self, x: torch.Tensor) -> torch.Tensor:
+        """Coloured stationary noise added at a random SNR in [SNRmin, SNRmax] dB."""
+        p = self.p
+        b = self._notch_filters((x.shape[0],), p['minG'], p['maxG'], x.device)
+        noise = _norm_wav(self._filter(torch.randn_like(x), b), always=True)
+        snr = _uniform(p['SNRmin'], p['SNRmax'], (x.shape[0], 1), x.device)
+        noise = (noise / noise.norm(dim=-1, keepdim=True).clamp_min(1e-12)
+                 * x.norm(dim=-1, keepdim=True) / 10.0 ** (0.05 * snr))
+        return x + noise
+
+    @torch.no_grad()
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        """Augment a (B, T) batch; computed in float32 and returned in the input dtype."""
+        dtype = x.dtype
+        x = x.float()
+        if self.algo_id == 8:
+            y = _norm_wav(self.lnl(x) + self.isd(x), always=False)
+        else:
+            y = x
+            for stage in ALGORITHMS[self.algo_id]:
+                y = getattr(self, stage)(y)
+        return y.to(dtype)
+
+
+class _AugmentedLoader:
+    """Proxy around the train DataLoader applying RawBoost to each collated batch."""
+
+    def __init__(self, loader, rawboost: BatchRawBoost):
+        self._loader = loader
+        self._rawboost = rawboost
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def __iter__(self):
+        for batch_x, *rest in self._loader:
+            yield (self._rawboost(batch_x), *rest)
+
+
+def augment_loader(loader, rawboost: BatchRawBoost):
+    """RawBoost on collated batches in the main process, before the device copy."""
+    return _AugmentedLoader(loader, rawboost)
+
+
+def augment_on_device(rawboost: BatchRawBoost):
+    """
+    Model transform applying RawBoost to the input batch inside the training
+    forward, i.e. on the training device. Evaluation forwards are untouched.
+    """
+
+    def pre_hook(module, inputs):
+        if module.training and torch.is_grad_enabled():
+            return (rawboost(inputs[0]), *inputs[1:])
+
+    def transform(model):
+        model.register_forward_pre_hook(pre_hook)
+        return model
+
+    return transform
@@ -0,0 +1,354 @@
+"""
+Mid-epoch resumable training for train_nn.
+
+train_nn only checkpoints at epoch boundaries. TrainingCheckpointer adds
+periodic step-level resume states holding the model, optimizer, LR
+schedulers, sampler position, RNG states and training-mode state (loss
+scale). It hooks train_nn from the outside, like the other training options:
+
+- the train loader uses ResumableSampler, whose order depends only on
+  (seed, epoch), so a resumed run skips exactly the batches already seen,
+- the optimizer class is subclassed to capture the instance and to take a
+  checkpoint after every N-th update,
+- the model is captured through model_transform, and LR schedulers built on
+  the captured optimizer are picked up when they are created.
+
+States are snapshotted to CPU on the training thread and written by a
+background thread to a temporary file that is then os.replace()d, so a
+crash never leaves a truncated state behind. A finished run removes its
+resume states, or with keep_final replaces them with one state at the end of
+the last epoch, from which a later run with more epochs continues (the sweep
+driver promotes trials this way). In distributed runs only rank 0 writes;
+every rank loads.
+"""
+
+import contextlib
+import glob
+import logging
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+from brspeech_models import model_transform
+
+logger = logging.getLogger(__name__)
+
+STATE_PATTERN = re.compile(r'step_(\d+)\.pt$')
+
+
+def find_latest_state(resume_dir) -> Optional[Path]:
+    """Newest complete resume state (step_XXXXXXXXX.pt) in `resume_dir`, if any."""
+    states = [p for p in glob.glob(os.path.join(resume_dir, 'step_*.pt')) if STATE_PATTERN.search(p)]
+    if not states:
+        return None
+    return Path(max(states, key=lambda p: int(STATE_PATTERN.search(p).group(1))))
+
+
+def _to_cpu(obj):
+    """Deep copy of a (nested) state with every tensor cloned to CPU."""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def rng_state() -> dict:
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: dict):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class ResumableSampler(Sampler):
+    """
+    Random sampler with a per-epoch permutation seeded by (seed, epoch) that
+    can start part-way through an epoch. Each iter() starts the next epoch.
+
+    With num_replicas > 1 it shards like DistributedSampler(drop_last=True):
+    every rank takes a strided slice of the same permutation.
+    """
+
+    def __init__(self, num_samples: int, seed: int = 42, num_replicas: int = 1, rank: int = 0):
+        self.num_samples = num_samples
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.per_rank = num_samples // num_replicas
+        self.epoch = 0
+        self.start = 0
+
+    def set_state(self, epoch: int, start: int):
+        self.epoch = epoch
+        self.start = start
+
+    def __len__(self) -> int:
+        return self.per_rank - self.start
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(self.num_samples, generator=generator)
+        order = order[:self.per_rank * self.num_replicas][self.rank::self.num_replicas][self.start:]
+        self.epoch += 1
+        self.start = 0
+        return iter(order.tolist())
+
+
+class _ResumableLoader:
+    """Proxy around the train DataLoader that tracks the position within the epoch."""
+
+    def __init__(self, loader, checkpointer: 'TrainingCheckpointer'):
+        self._loader = loader
+        self._checkpointer = checkpointer
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def __iter__(self):
+        checkpointer = self._checkpointer
+        checkpointer.restore_rng()
+        sampler = self._loader.sampler
+        epoch, skipped = sampler.epoch, sampler.start // self._loader.batch_size
+        for position, batch in enumerate(self._loader, start=skipped + 1):
+            checkpointer.epoch, checkpointer.batches_done = epoch, position
+            yield batch
+
+
+class TrainingCheckpointer:
+    """
+    Periodic asynchronous resume states for a train_nn run.
+
+    Usage:
+        checkpointer = TrainingCheckpointer(out_dir / 'resume', every_steps=2000, resume_from=path)
+        epochs = checkpointer.remaining_epochs(epochs)
+        train_config = build_train_config(..., checkpointer=checkpointer)
+        train_loader = checkpointer.wrap_loader(DataLoader(..., sampler=checkpointer.sampler(n, seed)))
+        with checkpointer:
+            train_nn(...)
+    """
+
+    def __init__(self, resume_dir, every_steps: int = 2000, every_minutes: float = None,
+                 keep_last: int = 2, resume_from=None, num_replicas: int = 1, rank: int = 0,
+                 keep_final: bool = False):
+        if keep_last < 1:
+            raise ValueError(f"checkpointing.keep_last must be at least 1 (got {keep_last})")
+        self.resume_dir = Path(resume_dir)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.every_steps = every_steps
+        self.every_seconds = every_minutes * 60 if every_minutes else None
+        self.keep_last = keep_last
+        self.keep_final = keep_final
+        self.epoch = 0
+        self.batches_done = 0
+        self.updates = 0
+        self.model = None
+        self.optimizer = None
+        self.schedulers = []
+        self._sampler = None
+        self._batch_size = None
+        self._extra = {}
+        self._writer = None
+        self._last_save = time.monotonic()
+        self._stack = contextlib.ExitStack()
+        self.state = None
+        if resume_from:
+            self.state = torch.load(resume_from, map_location='cpu', weights_only=False)
+            if self.state.get('world_size', 1) != num_replicas:
+                raise ValueError(f"{resume_from} was saved with {self.state.get('world_size', 1)} ranks; "
+                                 f"resume with the same number of ranks (got {num_replicas})")
+            self.epoch, self.batches_done = self.state['epoch'], self.state['batches_done']
+            self.updates = self.state['updates']
+            logger.info(f"Resuming from {resume_from}: epoch {self.epoch + 1}, "
+                        f"after batch {self.batches_done} (update {self.updates})")
+
+    # --- wiring -----------------------------------------------------------
+
+    def remaining_epochs(self, num_epochs: int) -> int:
+        """Epochs left for train_nn, counting the partially finished one; 0 if the resumed state is complete."""
+        if self.state is None:
+            return num_epochs
+        return max(num_epochs - self.epoch, 0)
+
+    def sampler(self, num_samples: int, seed: int, sampler: Optional[ResumableSampler] = None) -> ResumableSampler:
+        """A ResumableSampler over the train set, or `sampler` (a subclass) set to the resumed position."""
+        self._sampler = sampler or ResumableSampler(num_samples, seed, self.num_replicas, self.rank)
+        if self.state is not None:
+            self._sampler.set_state(self.epoch, self.state['batches_done'] * self.state['batch_size'])
+        return self._sampler
+
+    def wrap_loader(self, loader):
+        if not isinstance(loader.sampler, ResumableSampler):
+            raise ValueError("The train loader must use TrainingCheckpointer.sampler()")
+        self._batch_size = loader.batch_size
+        return _ResumableLoader(loader, self)
+
+    def register_state(self, name: str, get_state: Callable[[], dict], set_state: Callable[[dict], None]):
+        """Extra state saved with every resume state (e.g. the fp16 loss scale)."""
+        self._extra[name] = (get_state, set_state)
+        if self.state is not None and name in self.state.get('extra', {}):
+            set_state(self.state['extra'][name])
+
+    def optimizer(self, base: type) -> type:
+        """Optimizer class that registers itself and checkpoints after updates."""
+        checkpointer = self
+
+        class CheckpointingOptimizer(base):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                checkpointer._attach_optimizer(self)
+
+            def step(self, closure=None):
+                result = super().step(closure)
+                # Accumulating optimizers only update when no micro-batches are pending
+                if getattr(self, 'micro_steps', 0) == 0:
+                    checkpointer._after_update()
+                return result
+
+        CheckpointingOptimizer.__name__ = base.__name__
+        return CheckpointingOptimizer
+
+    # --- restore ----------------------------------------------------------
+
+    # Loaded parts are popped from self.state so the resumed weights and optimizer
+    # moments are not kept in CPU memory for the rest of the run
+
+    def _attach_model(self, model):
+        self.model = model
+        if self.state is not None and 'model' in self.state:
+            model.load_state_dict(self.state.pop('model'))
+        return model
+
+    def _attach_optimizer(self, optimizer):
+        self.optimizer = optimizer
+        if self.state is not None and 'optimizer' in self.state:
+            optimizer.load_state_dict(self.state.pop('optimizer'))
+            if hasattr(optimizer, 'micro_steps'):
+                optimizer.micro_steps = 0
+
+    def _attach_scheduler(self, scheduler):
+        if getattr(scheduler, 'optimizer', None) is not self.optimizer:
+            return
+        saved = self.state.get('schedulers', []) if self.state is not None else []
+        if len(self.schedulers) < len(saved):
+            scheduler.load_state_dict(saved[len(self.schedulers)])
+            if len(self.schedulers) + 1 == len(saved):
+                del self.state['schedulers']
+        self.schedulers.append(scheduler)
+
+    def restore_rng(self):
+        """Restore the saved RNG states once, right before the first resumed batch."""
+        if self.state is not None and 'rng' in self.state:
+            set_rng_state(self.state.pop('rng'))
+
+    def _watch_schedulers(self):
+        scheduler_base = getattr(torch.optim.lr_scheduler, 'LRScheduler', None) or torch.optim.lr_scheduler._LRScheduler
+        original_init = scheduler_base.__init__
+        checkpointer = self
+
+        def __init__(self, *args, **kwargs):
+            original_init(self, *args, **kwargs)
+            checkpointer._attach_scheduler(self)
+
+        scheduler_base.__init__ = __init__
+        self._stack.callback(setattr, scheduler_base, '__init__', original_init)
+
+    # --- save -------------------------------------------------------------
+
+    def _after_update(self):
+        self.updates += 1
+        due = self.every_steps and self.updates % self.every_steps == 0
+        if self.every_seconds and time.monotonic() - self._last_save >= self.every_seconds:
+            due = True
+        if due and self.rank == 0:
+            self.save()
+
+    def snapshot(self) -> dict:
+        return _to_cpu({
+            'epoch': self.epoch,
+            'batches_done': self.batches_done,
+            'batch_size': self._batch_size,
+            'updates': self.updates,
+            'world_size': self.num_replicas,
+            'model': self.model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'schedulers': [s.state_dict() for s in self.schedulers],
+            'rng': rng_state(),
+            'extra': {name: get_state() for name, (get_state, _) in self._extra.items()},
+        })
+
+    def save(self):
+        """Snapshot now and write in the background; skipped if the previous write is still running."""
+        if self._writer is not None and self._writer.is_alive():
+            logger.warning("⚠️ Previous resume state still being written, skipping this one")
+            return
+        state = self.snapshot()
+        path = self.resume_dir / f"step_{self.updates:09d}.pt"
+        self._writer = threading.Thread(target=self._write, args=(state, path), daemon=True)
+        self._writer.start()
+        self._last_save = time.monotonic()
+
+    def _write(self, state: dict, path: Path):
+        tmp_path = path.with_suffix('.pt.tmp')
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path)
+        states = sorted(self.resume_dir.glob('step_*.pt'))
+        for old in states[:-self.keep_last]:
+            old.unlink(missing_ok=True)
+        logger.info(f"Resume state saved: {path} (epoch {state['epoch'] + 1}, batch {state['batches_done']})")
+
+    def wait(self):
+        if self._writer is not None:
+            self._writer.join()
+
+    def __enter__(self):
+        self.resume_dir.mkdir(parents=True, exist_ok=True)
+        self._stack.enter_context(model_transform(self._attach_model))
+        self._watch_schedulers()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wait()
+        self._stack.close()
+        if exc_type is None and self.rank == 0:
+            final = self.save_final() if self.keep_final and self.model is not None else None
+            # Training finished: nothing left to resume (except the final state)
+            for path in self.resume_dir.glob('step_*.pt*'):
+                if path != final:
+                    path.unlink()
+        return False
+
+    def save_final(self) -> Path:
+        """Write a state positioned at the start of the next epoch, synchronously."""
+        state = self.snapshot()
+        if self._batch_size and state['batches_done'] >= self._sampler.per_rank // self._batch_size:
+            state['epoch'], state['batches_done'] = state['epoch'] + 1, 0
+        path = self.resume_dir / f"step_{self.updates:09d}.pt"
+        self._write(state, path)
+        return path
@@ -0,0 +1,251 @@
+"""
+Compact, array-backed sample index for the datasets.
+
+A pandas DataFrame of path strings keeps one Python object per row. Forked
+DataLoader workers that read rows update the reference counts of those
+objects, so every worker gradually copies the whole heap. SampleIndex holds
+the same table as a few flat numpy arrays instead:
+
+    path           packed UTF-8 bytes + int64 offsets
+    text columns   small integer codes + one table of category names (label, synth, ...)
+    numeric        numpy arrays as they are (num_frames, sample_rate, ...)
+
+Saved indexes are a directory of .npy files opened with mmap, so every worker
+shares the same page-cache pages. `take()` returns a view over a set of rows
+without copying the columns, which is how train/val splits are made.
+
+The index answers the DataFrame calls the pipelines use on samples_df:
+len(), .columns, .iloc[i] (one row as a Series), index['col'] (one column as a Series).
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+def _code_dtype(num_categories: int) -> np.dtype:
+    for dtype in (np.int8, np.int16, np.int32):
+        if num_categories <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class _RowAccessor:
+    """`index.iloc[i]` -> one row as a pd.Series; other keys -> a view."""
+
+    def __init__(self, index: 'SampleIndex'):
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._index.row(int(key))
+        return self._index.take(np.arange(len(self._index))[key])
+
+
+class SampleIndex:
+    """Column store of a samples table; see the module docstring."""
+
+    def __init__(self, path_bytes: np.ndarray, path_offsets: np.ndarray, columns: dict,
+                 categories: dict, positions: Optional[np.ndarray] = None, source_dir: Optional[Path] = None):
+        self._path_bytes = path_bytes
+        self._path_offsets = path_offsets
+        self._columns = columns
+        self._categories = categories
+        self._positions = positions
+        self.source_dir = source_dir
+
+    # --- construction -----------------------------------------------------
+
+    @classmethod
+    def from_dataframe(cls, samples_df: pd.DataFrame) -> 'SampleIndex':
+        """Pack a samples DataFrame; it must have a 'path' column."""
+        encoded = [str(p).encode('utf-8') for p in samples_df['path']]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in encoded], out=offsets[1:])
+        path_bytes = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+        columns, categories = {}, {}
+        for name in samples_df.columns:
+            if name == 'path':
+                columns[name] = None
+                continue
+            values = samples_df[name]
+            if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+                columns[name] = values.to_numpy()
+            else:
+                codes, names = pd.factorize(values)  # missing values -> -1
+                columns[name] = codes.astype(_code_dtype(len(names)))
+                categories[name] = [str(v) for v in names]
+        return cls(path_bytes, offsets, columns, categories)
+
+    def save(self, out_dir, source: Optional[dict] = None) -> 'SampleIndex':
+        """Write the index (materializing a view) and return it reopened with mmap."""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        meta_path = out_dir / 'meta.json'
+        if meta_path.exists():
+            meta_path.unlink()
+        index = self._compact()
+        np.save(out_dir / 'path_bytes.npy', np.ascontiguousarray(index._path_bytes))
+        np.save(out_dir / 'path_offsets.npy', np.ascontiguousarray(index._path_offsets))
+        for name, values in index._columns.items():
+            if values is not None:
+                np.save(out_dir / f'col_{name}.npy', np.ascontiguousarray(values))
+        meta = {
+            'version': INDEX_VERSION,
+            'num_rows': len(index),
+            'columns': list(index._columns),
+            'categories': index._categories,
+            'source': source or {},
+        }
+        # meta.json last: a directory without it is incomplete
+        with open(out_dir / 'meta.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(out_dir / 'meta.json.tmp', meta_path)
+        return SampleIndex.load(out_dir)
+
+    @classmethod
+    def load(cls, index_dir) -> 'SampleIndex':
+        index_dir = Path(index_dir)
+        with open(index_dir / 'meta.json', 'r') as f:
+            meta = json.load(f)
+        columns = {
+            name: None if name == 'path' else np.load(index_dir / f'col_{name}.npy', mmap_mode='r')
+            for name in meta['columns']
+        }
+        return cls(
+            np.load(index_dir / 'path_bytes.npy', mmap_mode='r'),
+            np.load(index_dir / 'path_offsets.npy', mmap_mode='r'),
+            columns,
+            meta['categories'],
+            source_dir=index_dir,
+        )
+
+    def __getstate__(self):
+        # Spawned workers reopen the files instead of receiving pickled copies
+        if self.source_dir is not None:
+            return {'source_dir': self.source_dir, 'positions': self._positions}
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        if set(state) == {'source_dir', 'positions'}:
+            self.__dict__.update(SampleIndex.load(state['source_dir']).__dict__)
+            self._positions = state['positions']
+        else:
+            self.__dict__.update(state)
+
+    # --- access -----------------------------------------------------------
+
+    def __len__(self) -> int:
+        if self._positions is not None:
+            return len(self._positions)
+        return len(self._path_offsets) - 1
+
+    @property
+    def columns(self) -> pd.Index:
+        return pd.Index(list(self._columns))
+
+    @property
+    def iloc(self) -> _RowAccessor:
+        return _RowAccessor(self)
+
+    def _row(self, i: int) -> int:
+        return int(self._positions[i]) if self._positions is not None else i
+
+    def _rows(self) -> np.ndarray:
+        return self._positions if self._positions is not None else np.arange(len(self))
+
+    def path(self, i: int) -> str:
+        row = self._row(i)
+        start, end = self._path_offsets[row], self._path_offsets[row + 1]
+        return self._path_bytes[start:end].tobytes().decode('utf-8')
+
+    def value(self, column: str, i: int):
+        if column == 'path':
+            return self.path(i)
+        value = self._columns[column][self._row(i)]
+        if column in self._categories:
+            return self._categories[column][value] if value >= 0 else None
+        return value.item()
+
+    def row(self, i: int) -> pd.Series:
+        return pd.Series({name: self.value(name, i) for name in self._columns}, name=i)
+
+    def codes(self, column: str) -> np.ndarray:
+        """Integer category codes (or numeric values) of a column, in index order."""
+        return np.asarray(self._columns[column])[self._rows()]
+
+    def categories(self, column: str) -> list:
+        return self._categories[column]
+
+    def map_categories(self, column: str, fn, dtype=np.int64) -> np.ndarray:
+        """Apply `fn` once per category name and broadcast it over the rows (missing values use fn(None))."""
+        # The extra last entry is what code -1 (missing) indexes
+        table = np.array([fn(name) for name in self._categories[column]] + [fn(None)], dtype=dtype)
+        return table[self.codes(column)]
+
+    def __getitem__(self, column: str) -> pd.Series:
+        if column == 'path':
+            return pd.Series([self.path(i) for i in range(len(self))], name='path')
+        if column not in self._columns:
+            raise KeyError(column)
+        values = self.codes(column)
+        if column in self._categories:
+            values = pd.Categorical.from_codes(values, self._categories[column]).astype(object)
+        return pd.Series(values, name=column)
+
+    def _compact(self) -> 'SampleIndex':
+        """Copy of the rows of a view as a standalone index."""
+        if self._positions is None:
+            return self
+        rows = self._positions
+        starts, ends = self._path_offsets[rows], self._path_offsets[rows + 1]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        path_bytes = np.concatenate([self._path_bytes[s:e] for s, e in zip(starts, ends)] or [np.zeros(0, np.uint8)])
+        columns = {name: None if values is None else np.asarray(values)[rows] for name, values in self._columns.items()}
+        return SampleIndex(path_bytes, offsets, columns, self._categories)
+
+    def take(self, positions) -> 'SampleIndex':
+        """A view over `positions` (relative to this index); columns are shared, not copied."""
+        positions = self._rows()[np.asarray(positions, dtype=np.int64)]
+        return SampleIndex(self._path_bytes, self._path_offsets, self._columns,
+                           self._categories, positions, self.source_dir)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame({name: self[name] for name in self._columns})
+
+
+def load_csv_index(csv_path, index_dir=None) -> SampleIndex:
+    """
+    SampleIndex of a metadata CSV, cached next to it as <name>.index/ and
+    rebuilt when the CSV changes. Falls back to an in-memory index when the
+    cache directory is not writable.
+    """
+    csv_path = Path(csv_path)
+    index_dir = Path(index_dir) if index_dir else csv_path.with_suffix('.index')
+    stat = os.stat(csv_path)
+    source = {'csv': str(csv_path.resolve()), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    meta_path = index_dir / 'meta.json'
+    if meta_path.exists():
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('version') == INDEX_VERSION and meta.get('source') == source:
+            return SampleIndex.load(index_dir)
+
+    index = SampleIndex.from_dataframe(pd.read_csv(csv_path))
+    try:
+        index = index.save(index_dir, source)
+        logger.info(f"Sample index for {csv_path.name}: {len(index)} rows in {index_dir}")
+    except OSError as e:
+        logger.warning(f"⚠️ Could not write sample index to {index_dir} ({e}); using it in memory")
+    return index
@@ -0,0 +1,246 @@
+"""
+Stratified per-epoch subsampling of the train set.
+
+Every epoch StratifiedEpochSampler draws a fixed budget of clips (a fraction
+of the train set or a clip count) with a quota per stratum: per synth source
+(bonafide and each TTS system), or per label when there is no synth column.
+Quotas follow the stratum sizes by default; `label_quota` fixes the share of
+each label, split over its sources proportionally or equally.
+
+Within a stratum clips are taken in rotation from a sequence of
+permutations seeded by (seed, stratum, cycle), so every clip is drawn once
+before any clip is drawn again, i.e. a stratum with n clips and quota q is
+fully covered every ceil(n / q) epochs.
+
+With `hard_fraction` > 0, that part of each quota is drawn instead with
+probability proportional to loss ** hard_power, using the per-sample training
+losses recorded by SampleLossRecorder in earlier epochs. Losses are merged
+into the table at the end of each epoch (across ranks in distributed runs),
+so the order of an epoch depends only on (seed, epoch, table) and resumed
+runs reproduce it.
+"""
+
+import logging
+from typing import Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from brspeech_resume import ResumableSampler
+
+logger = logging.getLogger(__name__)
+
+
+def largest_remainder(total: int, weights) -> np.ndarray:
+    """Integer split of `total` proportional to `weights`."""
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.sum() <= 0:
+        return np.zeros(len(weights), dtype=np.int64)
+    exact = total * weights / weights.sum()
+    counts = np.floor(exact).astype(np.int64)
+    counts[np.argsort(counts - exact)[:total - counts.sum()]] += 1
+    return counts
+
+
+class StratifiedEpochSampler(ResumableSampler):
+    """
+    ResumableSampler over a stratified subset of the train set, drawn anew
+    every epoch; see the module docstring.
+    """
+
+    def __init__(self, strata: np.ndarray, quotas: np.ndarray, names: list, seed: int = 42,
+                 num_replicas: int = 1, rank: int = 0, hard_fraction: float = 0.0, hard_power: float = 1.0,
+                 loss_recorder: Optional['SampleLossRecorder'] = None):
+        super().__init__(int(quotas.sum()), seed, num_replicas, rank)
+        self.names = names
+        self.quotas = quotas
+        self.members = [np.flatnonzero(strata == s) for s in range(len(names))]
+        self.hard_fraction = hard_fraction
+        self.hard_power = hard_power
+        self.loss_recorder = loss_recorder
+        self.order = []
+
+    @classmethod
+    def from_config(cls, samples_df, sampling: dict, seed: int = 42, num_replicas: int = 1, rank: int = 0,
+                    loss_recorder=None) -> 'StratifiedEpochSampler':
+        """Build from the `sampling` block of the config and the dataset's SampleIndex."""
+        column = 'synth' if 'synth' in samples_df.columns else 'label'
+        codes = samples_df.codes(column).astype(np.int64)
+        names = list(samples_df.categories(column))
+        if (codes < 0).any():
+            codes = np.where(codes < 0, len(names), codes)
+            names.append('missing')
+        sizes = np.bincount(codes, minlength=len(names))
+
+        total = len(codes)
+        budget = sampling.get('epoch_budget') or int(round(total * (sampling.get('epoch_fraction') or 1.0)))
+        budget = min(int(budget), total)
+
+        label_quota = sampling.get('label_quota')
+        if label_quota:
+            # Share per label, then split over the label's sources
+            label_codes = samples_df.codes('label')
+            label_names = samples_df.categories('label')
+            labels = np.array([label_names[label_codes[m[0]]] if len(m) and label_codes[m[0]] >= 0 else None
+                               for m in (np.flatnonzero(codes == s) for s in range(len(names)))], dtype=object)
+            unknown = set(label_quota) - set(labels[sizes > 0])
+            if unknown:
+                raise ValueError(f"label_quota names unknown labels: {sorted(unknown)}")
+            per_label = largest_remainder(budget, list(label_quota.values()))
+            quotas = np.zeros(len(names), dtype=np.int64)
+            for label, count in zip(label_quota, per_label):
+                in_label = (labels == label) & (sizes > 0)
+                if sampling.get('source_quota', 'proportional') == 'equal':
+                    split = largest_remainder(count, in_label.astype(np.float64))
+                else:
+                    split = largest_remainder(count, sizes * in_label)
+                quotas += split
+        else:
+            quotas = largest_remainder(budget, sizes)
+
+        sampler = cls(codes, quotas, names, seed, num_replicas, rank,
+                      sampling.get('hard_fraction', 0.0), sampling.get('hard_power', 1.0), loss_recorder)
+        logger.info(f"Stratified sampling: {int(quotas.sum())} of {total} clips per epoch "
+                    f"({', '.join(f'{n} {q}/{s}' for n, q, s in zip(names, quotas, sizes) if s)})")
+        return sampler
+
+    def epochs_to_cover(self) -> int:
+        """Epochs after which every clip has been drawn at least once by the rotation."""
+        rotating = [q - int(round(q * self.hard_fraction)) for q in self.quotas]
+        return max((int(np.ceil(len(m) / r)) for m, r in zip(self.members, rotating) if len(m) and r > 0), default=1)
+
+    def _rotation(self, stratum: int, count: int) -> np.ndarray:
+        """Clips epoch * count .. (epoch + 1) * count - 1 of the stratum's permutation sequence."""
+        members = self.members[stratum]
+        n = len(members)
+        picks, position = [], self.epoch * count
+        while len(picks) < count:
+            cycle, offset = divmod(position, n)
+            permutation = np.random.default_rng([self.seed, stratum, cycle]).permutation(n)
+            take = permutation[offset:offset + count - len(picks)]
+            picks.extend(take)
+            position += len(take)
+        return members[np.asarray(picks, dtype=np.int64)]
+
+    def _hard(self, stratum: int, count: int, exclude: np.ndarray) -> np.ndarray:
+        """`count` clips drawn without replacement with probability ~ loss ** hard_power."""
+        members = self.members[stratum]
+        losses = self.loss_recorder.losses[members] if self.loss_recorder is not None else np.full(len(members), np.nan)
+        known = np.isfinite(losses)
+        # Unseen clips count as an average one
+        fill = losses[known].mean() if known.any() else 1.0
+        weights = np.where(known, losses, fill).clip(min=1e-6) ** self.hard_power
+        rng = np.random.default_rng([self.seed, stratum, self.epoch, 1])
+        if count > len(members) - len(exclude):
+            # Quota above the stratum size: repeats are unavoidable
+            return members[rng.choice(len(members), count, replace=True, p=weights / weights.sum())]
+        weights[np.isin(members, exclude)] = 0
+        return members[rng.choice(len(members), count, replace=False, p=weights / weights.sum())]
+
+    def __iter__(self):
+        chosen = []
+        for stratum, quota in enumerate(self.quotas):
+            if quota == 0 or len(self.members[stratum]) == 0:
+                continue
+            hard = int(round(quota * self.hard_fraction))
+            rotation = self._rotation(stratum, quota - hard) if quota > hard else np.zeros(0, dtype=np.int64)
+            chosen.append(rotation)
+            if hard:
+                chosen.append(self._hard(stratum, hard, rotation))
+        chosen = np.concatenate(chosen) if chosen else np.zeros(0, dtype=np.int64)
+        order = np.random.default_rng([self.seed, self.epoch]).permutation(chosen)
+        order = order[:self.per_rank * self.num_replicas][self.rank::self.num_replicas][self.start:]
+        self.epoch += 1
+        self.start = 0
+        self.order = order.tolist()
+        return iter(self.order)
+
+
+class _RecordingLoader:
+    """Proxy around the train DataLoader telling the recorder which clips each batch holds."""
+
+    def __init__(self, loader, recorder: 'SampleLossRecorder'):
+        self._loader = loader
+        self._recorder = recorder
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def __iter__(self):
+        sampler, batch_size = self._loader.sampler, self._loader.batch_size
+        try:
+            for position, batch in enumerate(self._loader):
+                # The sampler has produced this epoch's order once the first batch exists
+                self._recorder.pending = sampler.order[position * batch_size:(position + 1) * batch_size]
+                yield batch
+        finally:
+            self._recorder.pending = None
+        self._recorder.end_epoch()
+
+
+class SampleLossRecorder:
+    """
+    Per-sample training losses for hard-example sampling.
+
+    train_nn only sees the mean batch loss, so the criterion class is
+    subclassed to also compute the per-sample BCE of each training batch, and
+    the train loader is wrapped to know which clips the batch holds.
+    """
+
+    def __init__(self):
+        self.losses = np.zeros(0, dtype=np.float32)
+        self._fresh = np.zeros(0, dtype=np.float32)
+        self.pending = None
+
+    def allocate(self, num_samples: int):
+        self.losses = np.full(num_samples, np.nan, dtype=np.float32)
+        self._fresh = self.losses.copy()
+
+    def criterion(self, base: type) -> type:
+        """Criterion class recording the per-sample loss of training batches."""
+        if not issubclass(base, torch.nn.BCEWithLogitsLoss):
+            raise ValueError(f"Hard-example sampling needs a BCEWithLogitsLoss criterion, got {base.__name__}")
+        recorder = self
+
+        class RecordingCriterion(base):
+            def forward(self, input, target):
+                loss = super().forward(input, target)
+                indices = recorder.pending
+                if indices is not None and torch.is_grad_enabled() and input.numel() % max(len(indices), 1) == 0:
+                    with torch.no_grad():
+                        per_sample = F.binary_cross_entropy_with_logits(
+                            input.detach().float(), target.detach().float(), weight=self.weight,
+                            pos_weight=self.pos_weight, reduction='none')
+                    recorder._fresh[indices] = per_sample.reshape(len(indices), -1).mean(dim=1).cpu().numpy()
+                return loss
+
+        RecordingCriterion.__name__ = base.__name__
+        return RecordingCriterion
+
+    def wrap_loader(self, loader):
+        if not hasattr(loader.sampler, 'order'):
+            raise ValueError("The train loader must use a StratifiedEpochSampler")
+        return _RecordingLoader(loader, self)
+
+    def end_epoch(self):
+        """Merge this epoch's losses into the table (averaged over ranks that saw a clip)."""
+        from brspeech_distributed import reduce_array
+
+        seen = np.isfinite(self._fresh)
+        totals = reduce_array(np.stack([np.where(seen, self._fresh, 0.0), seen]).astype(np.float64))
+        updated = totals[1] > 0
+        self.losses[updated] = (totals[0][updated] / totals[1][updated]).astype(np.float32)
+        self._fresh[:] = np.nan
+        logger.info(f"Per-sample losses: {int(updated.sum())} updated, "
+                    f"{int(np.isfinite(self.losses).sum())}/{len(self.losses)} known")
+
+    def state(self) -> dict:
+        return {'losses': torch.from_numpy(self.losses.copy())}
+
+    def load_state(self, state: dict):
+        self.losses = state['losses'].numpy().copy()
+        self._fresh = np.full_like(self.losses, np.nan)
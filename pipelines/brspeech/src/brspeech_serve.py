@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+BrSpeech Scoring Server
+Long-lived local inference service for W2V+AASIST checkpoints. The model is
+loaded once; concurrent requests are grouped into micro-batches bounded by a
+maximum batch size and a maximum wait deadline.
+
+Protocol: newline-delimited JSON over a Unix socket or TCP, one object per line.
+    {"id": 1, "path": "/data/clip.flac"}                      score an audio file
+    {"id": 2, "pcm": "<base64 int16 LE>", "sample_rate": 16000} score raw PCM
+    {"cmd": "metrics"}                                        queue/batch metrics
+Responses: {"id": 1, "score": 0.93, "logit": 2.6} or {"id": 1, "error": "..."}.
+Scores are sigmoid outputs (1=real, 0=fake), as in the --test_only scores CSV.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+import torchaudio
+
+from brspeech_audio import SAMPLE_RATE, INT16_SCALE, load_audio_window, probe_audio, fix_length, as_model_input
+from brspeech_eval import load_model, autocast_context
+from train_brspeech import load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class ServerMetrics:
+    """Counters plus a rolling window of request latencies."""
+
+    def __init__(self, window: int = 10000):
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.batch_sizes = Counter()
+        self.latencies_ms = deque(maxlen=window)
+        self.started = time.time()
+
+    def snapshot(self, queue_depth: int) -> dict:
+        lat = np.asarray(self.latencies_ms) if self.latencies_ms else np.zeros(1)
+        clips = sum(size * n for size, n in self.batch_sizes.items())
+        return {
+            'uptime_s': round(time.time() - self.started, 1),
+            'requests': self.requests,
+            'errors': self.errors,
+            'queue_depth': queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'batches': self.batches,
+            'mean_batch_size': clips / self.batches if self.batches else 0.0,
+            'batch_size_histogram': {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            'latency_p50_ms': float(np.percentile(lat, 50)),
+            'latency_p99_ms': float(np.percentile(lat, 99)),
+        }
+
+
+class MicroBatcher:
+    """Collects queued clips into batches and runs them on one model."""
+
+    def __init__(self, model, device, max_batch_size: int, max_wait_ms: float, bf16: bool):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.bf16 = bf16
+        self.queue = asyncio.Queue()
+        self.metrics = ServerMetrics()
+        # A single model thread keeps batches ordered and avoids oversubscription
+        self._model_executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, waveform: torch.Tensor) -> float:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((waveform, future))
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, self.queue.qsize())
+        return await future
+
+    def _forward(self, batch: torch.Tensor) -> np.ndarray:
+        with torch.inference_mode(), autocast_context(self.device, self.bf16):
+            output = self.model(batch.to(self.device))
+        return output.float().cpu().numpy().ravel()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = torch.stack([waveform for waveform, _ in items])
+            try:
+                logits = await loop.run_in_executor(self._model_executor, self._forward, batch)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.metrics.batches += 1
+            self.metrics.batch_sizes[len(items)] += 1
+            for (_, future), logit in zip(items, logits):
+                if not future.done():
+                    future.set_result(float(logit))
+
+
+class ScoringServer:
+    def __init__(self, batcher: MicroBatcher, nb_samp: int, decode_workers: int):
+        self.batcher = batcher
+        self.nb_samp = nb_samp
+        self._decode_executor = ThreadPoolExecutor(max_workers=decode_workers)
+
+    def _decode(self, request: dict) -> torch.Tensor:
+        """Eval crop: the first nb_samp samples, repeat-padded when shorter."""
+        if 'path' in request:
+            _, source_rate = probe_audio(request['path'])
+            waveform = load_audio_window(request['path'], 0, self.nb_samp, source_rate)
+        else:
+            pcm = np.frombuffer(base64.b64decode(request['pcm']), dtype='<i2')
+            waveform = pcm.astype(np.float32) / INT16_SCALE
+            sample_rate = int(request.get('sample_rate', SAMPLE_RATE))
+            if sample_rate != SAMPLE_RATE:
+                waveform = torchaudio.functional.resample(
+                    torch.from_numpy(waveform), sample_rate, SAMPLE_RATE).numpy()
+        return as_model_input(fix_length(waveform, self.nb_samp))
+
+    async def handle_request(self, request: dict) -> dict:
+        if request.get('cmd') == 'metrics':
+            return self.batcher.metrics.snapshot(self.batcher.queue.qsize())
+
+        start = time.perf_counter()
+        response = {'id': request.get('id')}
+        self.batcher.metrics.requests += 1
+        try:
+            loop = asyncio.get_running_loop()
+            waveform = await loop.run_in_executor(self._decode_executor, self._decode, request)
+            logit = await self.batcher.submit(waveform)
+            response.update({'score': float(1 / (1 + np.exp(-logit))), 'logit': logit})
+        except Exception as e:
+            self.batcher.metrics.errors += 1
+            response['error'] = str(e)
+        self.batcher.metrics.latencies_ms.append((time.perf_counter() - start) * 1000)
+        return response
+
+    async def handle_connection(self, reader, writer):
+        write_lock = asyncio.Lock()
+
+        async def respond(line: bytes):
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError(f"expected a JSON object, got {type(request).__name__}")
+                response = await self.handle_request(request)
+            except ValueError as e:
+                response = {'error': f"Invalid request: {e}"}
+            async with write_lock:
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+
+        # Requests on one connection are scored concurrently; responses carry the id
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    model_config = load_config(args.config)
+    device = torch.device(args.device if args.device == 'cpu' or torch.cuda.is_available() else 'cpu')
+    if device.type == 'cpu' and args.threads:
+        torch.set_num_threads(args.threads)
+
+    logger.info(f"Loading checkpoint {args.checkpoint_path} on {device}")
+    model = load_model(model_config, args.checkpoint_path, device)
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+
+    batcher = MicroBatcher(model, device, args.max_batch_size, args.max_wait_ms, args.bf16)
+    server = ScoringServer(batcher, nb_samp, args.decode_workers)
+    batch_task = asyncio.create_task(batcher.run())
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        srv = await asyncio.start_unix_server(server.handle_connection, path=args.socket, limit=2 ** 26)
+        logger.info(f"🚀 Serving on unix:{args.socket}")
+    else:
+        srv = await asyncio.start_server(server.handle_connection, args.host, args.port, limit=2 ** 26)
+        logger.info(f"🚀 Serving on {args.host}:{args.port}")
+    logger.info(f"Micro-batching: max_batch_size={args.max_batch_size}, max_wait_ms={args.max_wait_ms}")
+
+    async with srv:
+        await srv.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve W2V+AASIST scores with dynamic micro-batching')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--checkpoint_path', type=str, required=True, help='Fine-tuned checkpoint (.pth)')
+    parser.add_argument('--socket', type=str, help='Unix socket path (default: TCP)')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--max_batch_size', type=int, default=16)
+    parser.add_argument('--max_wait_ms', type=float, default=10.0, help='Deadline for filling a batch')
+    parser.add_argument('--decode_workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, help='torch intra-op threads on CPU')
+    parser.add_argument('--bf16', action='store_true', help='bf16 autocast')
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
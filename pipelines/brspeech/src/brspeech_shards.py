@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Pre-decoded BrSpeech shard store.
+Converts the metadata CSVs once into fixed-layout int16 PCM shards at 16 kHz,
+with an offset index, so the dataset can read windows through np.memmap
+instead of decoding FLAC on every step.
+
+Layout of <out_dir>/<subset>/:
+    shard_00000.bin ...   raw little-endian int16 samples, clips back to back
+    index.csv             path, label, synth, shard, offset, num_samples
+    meta.json             sample_rate, dtype, number of shards, source CSV
+"""
+
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from brspeech_audio import SAMPLE_RATE, load_audio, to_int16
+
+SHARD_DTYPE = np.dtype('<i2')
+INDEX_COLUMNS = ['path', 'label', 'synth', 'shard', 'offset', 'num_samples']
+
+
+def shard_name(shard_id: int) -> str:
+    return f"shard_{shard_id:05d}.bin"
+
+
+class ShardWriter:
+    """Appends decoded clips to shard files, rolling over at `max_shard_bytes`."""
+
+    def __init__(self, out_dir: Path, max_shard_bytes: int):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.max_shard_samples = max_shard_bytes // SHARD_DTYPE.itemsize
+        self.shard_id = -1
+        self.offset = 0
+        self._fh = None
+        self.rows = []
+
+    def _roll(self):
+        if self._fh is not None:
+            self._fh.close()
+        self.shard_id += 1
+        self.offset = 0
+        self._fh = open(self.out_dir / shard_name(self.shard_id), 'wb')
+
+    def add(self, row, pcm: np.ndarray):
+        if self._fh is None or (self.offset and self.offset + len(pcm) > self.max_shard_samples):
+            self._roll()
+        self._fh.write(pcm.astype(SHARD_DTYPE, copy=False).tobytes())
+        self.rows.append((row.path, row.label, row.synth, self.shard_id, self.offset, len(pcm)))
+        self.offset += len(pcm)
+
+    def close(self, source_csv: Path):
+        if self._fh is not None:
+            self._fh.close()
+        pd.DataFrame(self.rows, columns=INDEX_COLUMNS).to_csv(self.out_dir / 'index.csv', index=False)
+        meta = {
+            'sample_rate': SAMPLE_RATE,
+            'dtype': SHARD_DTYPE.str,
+            'num_shards': self.shard_id + 1,
+            'source_csv': str(source_csv),
+            'source_mtime_ns': os.stat(source_csv).st_mtime_ns,
+        }
+        with open(self.out_dir / 'meta.json', 'w') as f:
+            json.dump(meta, f, indent=2)
+
+
+class ShardReader:
+    """
+    Zero-copy access to a subset's shards. Memmaps are opened lazily so that
+    each DataLoader worker maps the files after fork.
+    """
+
+    def __init__(self, subset_dir: Path):
+        self.subset_dir = Path(subset_dir)
+        with open(self.subset_dir / 'meta.json', 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['sample_rate'] != SAMPLE_RATE:
+            raise ValueError(f"Shards in {self.subset_dir} are {self.meta['sample_rate']} Hz, expected {SAMPLE_RATE}")
+        self.index = pd.read_csv(self.subset_dir / 'index.csv')
+        self._shard_ids = self.index['shard'].to_numpy(np.int32)
+        self._offsets = self.index['offset'].to_numpy(np.int64)
+        self._lengths = self.index['num_samples'].to_numpy(np.int64)
+        self._maps = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_maps'] = {}
+        return state
+
+    def _shard(self, shard_id: int) -> np.memmap:
+        mm = self._maps.get(shard_id)
+        if mm is None:
+            mm = np.memmap(self.subset_dir / shard_name(shard_id), dtype=SHARD_DTYPE, mode='r')
+            self._maps[shard_id] = mm
+        return mm
+
+    def num_samples(self, idx: int) -> int:
+        return int(self._lengths[idx])
+
+    def read(self, idx: int, start: int = 0, length: int = None) -> np.ndarray:
+        """Return an int16 view of samples [start, start + length) of clip `idx`."""
+        clip_len = int(self._lengths[idx])
+        end = clip_len if length is None else min(clip_len, start + length)
+        base = int(self._offsets[idx])
+        return self._shard(int(self._shard_ids[idx]))[base + start:base + end]
+
+
+def _decode(path: str) -> np.ndarray:
+    try:
+        return to_int16(load_audio(path))
+    except Exception as e:
+        print(f"⚠️  Failed to decode {path}: {e}")
+        return None
+
+
+def build_subset(csv_path: Path, out_dir: Path, workers: int, max_shard_bytes: int):
+    samples_df = pd.read_csv(csv_path)
+    writer = ShardWriter(out_dir, max_shard_bytes)
+    start = time.perf_counter()
+    total_samples = 0
+    with Pool(workers) as pool:
+        decoded = pool.imap(_decode, samples_df['path'], chunksize=16)
+        for row, pcm in zip(samples_df.itertuples(index=False), decoded):
+            if pcm is None:
+                continue
+            writer.add(row, pcm)
+            total_samples += len(pcm)
+    writer.close(csv_path)
+    elapsed = time.perf_counter() - start
+    print(f"✅ {csv_path.stem}: {len(writer.rows)} clips, {writer.shard_id + 1} shards, "
+          f"{total_samples / SAMPLE_RATE / 3600:.1f} h of audio in {elapsed:.1f}s "
+          f"({len(writer.rows) / max(elapsed, 1e-9):.0f} clips/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert BrSpeech metadata CSVs to int16 memmap shards')
+    parser.add_argument('--metadata_dir', type=str, default='metadata', help='Directory with train/val/test CSVs')
+    parser.add_argument('--out_dir', type=str, default='fine_tuned_models/shards', help='Shard output directory')
+    parser.add_argument('--subsets', nargs='+', default=['train', 'val', 'test'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max_shard_mb', type=int, default=2048, help='Maximum size of one shard file')
+    args = parser.parse_args()
+
+    for subset in args.subsets:
+        build_subset(
+            Path(args.metadata_dir) / f"{subset}.csv",
+            Path(args.out_dir) / subset,
+            args.workers,
+            args.max_shard_mb * 1024 * 1024,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""
+Frozen-SSL Feature Cache
+Runs the wav2vec2 front end once over fixed-crop inputs and stores the
+features as float16 in a memory-mapped store keyed by metadata path, so
+AASIST-head-only training never repeats the SSL forward pass.
+
+Layout of <cache_dir>/<subset>/:
+    features.f16   float16 array of shape (num_clips, frames, dim)
+    index.csv      path, label, synth (row i of features.f16 is row i here)
+    meta.json      cache key, shape and output type of the front end
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+import yaml
+from torch.utils.data import DataLoader, Dataset
+
+from brspeech_audio import label_to_int, load_audio, load_audio_window, fix_length, as_model_input
+from brspeech_models import SSL_LAYER_OPTIONS, build_model, find_ssl_frontend
+from brspeech_sample_index import load_csv_index
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Features are always taken from the first nb_samp samples of each clip
+CROP_MODE = 'head'
+
+
+@functools.lru_cache(maxsize=None)
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(model_config: dict) -> dict:
+    """Everything that changes the cached features; a mismatch invalidates the cache."""
+    params = model_config['model']['parameters']
+    key = {
+        'model': model_config['model']['name'],
+        'ssl_checkpoint_sha256': file_sha256(params['ssl_pretrained_path']),
+        'nb_samp': params.get('nb_samp', 64600),
+        'crop': CROP_MODE,
+    }
+    if params.get('ssl_config_path'):
+        key['ssl_config_sha256'] = file_sha256(params['ssl_config_path'])
+    for option in SSL_LAYER_OPTIONS:
+        if params.get(option) is not None:
+            key[option] = params[option]
+    return key
+
+
+class FixedCropDataset(Dataset):
+    """
+    The first nb_samp samples of each clip, without augmentation. When the
+    source sample rates are known only that window is decoded.
+    """
+
+    def __init__(self, paths, nb_samp: int, source_rates=None):
+        self.paths = list(paths)
+        self.nb_samp = nb_samp
+        self.source_rates = None if source_rates is None else np.asarray(source_rates, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        if self.source_rates is None:
+            waveform = load_audio(self.paths[index])
+        else:
+            waveform = load_audio_window(self.paths[index], 0, self.nb_samp, int(self.source_rates[index]))
+        return as_model_input(fix_length(waveform, self.nb_samp)), index
+
+
+class SSLFeatureDataset(Dataset):
+    """Reads cached SSL features through np.memmap; returns (features, label)."""
+
+    def __init__(self, subset_dir: Path):
+        self.subset_dir = Path(subset_dir)
+        with open(self.subset_dir / 'meta.json', 'r') as f:
+            self.meta = json.load(f)
+        self.samples_df = load_csv_index(self.subset_dir / 'index.csv')
+        self._labels = self.samples_df.map_categories('label', label_to_int, np.int8)
+        self._features = None
+
+    def __len__(self) -> int:
+        return len(self.samples_df)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_features'] = None
+        return state
+
+    @property
+    def features(self) -> np.memmap:
+        if self._features is None:
+            self._features = np.memmap(self.subset_dir / 'features.f16', dtype=np.float16, mode='r',
+                                       shape=tuple(self.meta['shape']))
+        return self._features
+
+    def __getitem__(self, index):
+        return torch.from_numpy(self.features[index].astype(np.float32)), int(self._labels[index])
+
+
+def load_cached_subset(cache_dir: str, subset: str, model_config: dict) -> SSLFeatureDataset:
+    """Open a cached subset, refusing caches built with another checkpoint or crop."""
+    subset_dir = Path(cache_dir) / subset
+    if not (subset_dir / 'meta.json').exists():
+        raise FileNotFoundError(f"SSL feature cache not found at: {subset_dir}. Run brspeech_ssl_cache.py first.")
+    dataset = SSLFeatureDataset(subset_dir)
+    expected = cache_key(model_config)
+    if dataset.meta['key'] != expected:
+        raise ValueError(f"Stale SSL feature cache in {subset_dir}: built for {dataset.meta['key']}, "
+                         f"current settings are {expected}. Re-run brspeech_ssl_cache.py.")
+    return dataset
+
+
+def _features_of(output) -> torch.Tensor:
+    return output if torch.is_tensor(output) else output[0]
+
+
+def freeze_with_cached_features(model: torch.nn.Module, output_type: str) -> torch.nn.Module:
+    """
+    Freeze the SSL front end and make it return its input unchanged, so the
+    model can be fed cached features directly. The module stays in place, so
+    checkpoints keep the full state dict and load normally with --test_only.
+    """
+    frontend, method = find_ssl_frontend(model)
+    frontend.requires_grad_(False)
+
+    if output_type == 'tensor':
+        passthrough = lambda x, *args, **kwargs: x
+    else:
+        from transformers.modeling_outputs import BaseModelOutput
+        passthrough = lambda x, *args, **kwargs: BaseModelOutput(last_hidden_state=x)
+
+    setattr(frontend, method, passthrough)
+    return model
+
+
+def extract_subset(model, samples_df: pd.DataFrame, subset_dir: Path, key: dict,
+                   nb_samp: int, batch_size: int, num_workers: int, device: torch.device):
+    if len(samples_df) == 0:
+        raise ValueError(f"No clips to cache for {subset_dir.name}: its metadata CSV is empty")
+    frontend, method = find_ssl_frontend(model)
+    extract = getattr(frontend, method)
+
+    loader = DataLoader(
+        FixedCropDataset(samples_df['path'], nb_samp, samples_df.get('sample_rate')),
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        pin_memory=device.type == 'cuda',
+    )
+    subset_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = subset_dir / 'features.f16.tmp'
+    features = None
+    output_type = 'tensor'
+
+    with torch.inference_mode():
+        for batch_idx, (batch_x, idx) in enumerate(loader):
+            output = extract(batch_x.to(device, non_blocking=True))
+            if not torch.is_tensor(output):
+                output_type = 'model_output'
+            feats = _features_of(output).to(torch.float16).cpu().numpy()
+            if features is None:
+                shape = (len(samples_df),) + feats.shape[1:]
+                features = np.memmap(tmp_path, dtype=np.float16, mode='w+', shape=shape)
+                logger.info(f"Feature store shape {shape}, {features.nbytes / 1e9:.1f} GB")
+            features[idx.numpy()] = feats
+            if batch_idx % 500 == 0:
+                logger.info(f"  {subset_dir.name}: {batch_idx * batch_size}/{len(samples_df)}")
+
+    features.flush()
+    del features
+    os.replace(tmp_path, subset_dir / 'features.f16')
+    samples_df[['path', 'label', 'synth']].to_csv(subset_dir / 'index.csv', index=False)
+    meta = {'key': key, 'shape': [len(samples_df)] + list(feats.shape[1:]), 'output_type': output_type}
+    # meta.json is written last: its presence marks a complete cache
+    with open(subset_dir / 'meta.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cache frozen wav2vec2 features for BrSpeech')
+    parser.add_argument('--config', type=str, required=True, help='Path to config file')
+    parser.add_argument('--out_dir', type=str, default='fine_tuned_models/ssl_cache')
+    parser.add_argument('--subsets', nargs='+', default=['train', 'val', 'test'])
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--device', type=str, default='cuda')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the cache key matches')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        model_config = yaml.safe_load(f)
+    device = torch.device(args.device if torch.cuda.is_available() else 'cpu')
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+    key = cache_key(model_config)
+    logger.info(f"Cache key: {key}")
+
+    model = None
+    for subset in args.subsets:
+        subset_dir = Path(args.out_dir) / subset
+        meta_path = subset_dir / 'meta.json'
+        if meta_path.exists() and not args.force:
+            with open(meta_path, 'r') as f:
+                if json.load(f)['key'] == key:
+                    logger.info(f"✅ {subset}: cache is up to date")
+                    continue
+            logger.info(f"{subset}: cache key changed, rebuilding")
+        if meta_path.exists():
+            meta_path.unlink()
+
+        if model is None:
+            model = build_model(model_config, device)
+            model.to(device)
+            model.eval()
+
+        samples_df = pd.read_csv(Path(model_config['data']['root_dir']) / f"{subset}.csv")
+        extract_subset(model, samples_df, subset_dir, key, nb_samp, args.batch_size, args.num_workers, device)
+        logger.info(f"✅ {subset}: cached {len(samples_df)} clips in {subset_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Small student models for distill_brspeech.py.
+
+Both take the same (B, nb_samp) waveform batch as W2V+AASIST and return one
+logit per clip, shape (B, 1), so train_nn, brspeech_eval and
+brspeech_export treat them like the teacher:
+
+    mel_cnn   log-mel spectrogram -> 2-D conv blocks -> mean/max pooling
+    raw_cnn   strided 1-D convs on the raw waveform -> mean/max pooling
+
+The names are served through get_model by brspeech_models (build_model and
+local_models); any other model name still goes to the upstream factory.
+"""
+
+import torch
+import torch.nn as nn
+
+from brspeech_audio import SAMPLE_RATE
+
+
+def _pool_time(x: torch.Tensor) -> torch.Tensor:
+    """Concatenated mean and max over the last (time) axis."""
+    return torch.cat([x.mean(dim=-1), x.amax(dim=-1)], dim=1)
+
+
+class MelCNN(nn.Module):
+    """
+    Log-mel front end with per-clip mean/variance normalization and
+    conv-BN-ReLU-pool blocks; the mel transform runs inside the model so
+    exported artifacts still take raw waveforms.
+    """
+
+    def __init__(self, n_mels: int = 64, n_fft: int = 512, hop_length: int = 160,
+                 channels=(32, 64, 128, 128), dropout: float = 0.3, nb_samp: int = 64600):
+        super().__init__()
+        import torchaudio
+
+        self.melspec = torchaudio.transforms.MelSpectrogram(
+            sample_rate=SAMPLE_RATE, n_fft=n_fft, hop_length=hop_length, n_mels=n_mels)
+        blocks, in_channels = [], 1
+        for out_channels in channels:
+            blocks += [
+                nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1, bias=False),
+                nn.BatchNorm2d(out_channels),
+                nn.ReLU(inplace=True),
+                nn.MaxPool2d(2),
+            ]
+            in_channels = out_channels
+        self.blocks = nn.Sequential(*blocks)
+        self.dropout = nn.Dropout(dropout)
+        self.fc = nn.Linear(2 * in_channels, 1)
+
+    def forward(self, x):
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            mel = torch.log(self.melspec(x.float()) + 1e-6)
+        mel = (mel - mel.mean(dim=-1, keepdim=True)) / (mel.std(dim=-1, keepdim=True) + 1e-5)
+        features = self.blocks(mel.unsqueeze(1)).mean(dim=2)  # (B, C, frames)
+        return self.fc(self.dropout(_pool_time(features)))
+
+
+class RawCNN(nn.Module):
+    """Strided 1-D convolutions on the waveform, then conv-BN-ReLU-pool blocks."""
+
+    def __init__(self, channels=(64, 64, 128, 128), first_kernel: int = 80, first_stride: int = 4,
+                 pool: int = 4, dropout: float = 0.3, nb_samp: int = 64600):
+        super().__init__()
+        layers = [
+            nn.Conv1d(1, channels[0], kernel_size=first_kernel, stride=first_stride, bias=False),
+            nn.BatchNorm1d(channels[0]),
+            nn.ReLU(inplace=True),
+            nn.MaxPool1d(pool),
+        ]
+        for in_channels, out_channels in zip(channels[:-1], channels[1:]):
+            layers += [
+                nn.Conv1d(in_channels, out_channels, kernel_size=3, padding=1, bias=False),
+                nn.BatchNorm1d(out_channels),
+                nn.ReLU(inplace=True),
+                nn.MaxPool1d(pool),
+            ]
+        self.blocks = nn.Sequential(*layers)
+        self.dropout = nn.Dropout(dropout)
+        self.fc = nn.Linear(2 * channels[-1], 1)
+
+    def forward(self, x):
+        return self.fc(self.dropout(_pool_time(self.blocks(x.unsqueeze(1)))))
+
+
+STUDENT_MODELS = {
+    'mel_cnn': MelCNN,
+    'raw_cnn': RawCNN,
+}
+
+
+def build_student(name: str, parameters: dict, device) -> nn.Module:
+    if name not in STUDENT_MODELS:
+        raise ValueError(f"Unknown student model: {name} (expected one of {sorted(STUDENT_MODELS)})")
+    return STUDENT_MODELS[name](**parameters).to(device)
@@ -0,0 +1,497 @@
+#!/usr/bin/env python
+"""
+BrSpeech Hyperparameter Sweep
+Runs train_brspeech.py trials over a search space from a sweep YAML
+(configs/sweep_lr_wd.yaml) with successive halving or ASHA:
+
+    rungs        epochs min_epochs, min_epochs * eta, ... up to max_epochs
+    promotion    the best 1/eta of the trials finished at a rung (by the val
+                 EER of their last train_nn validation pass) train on to the
+                 next rung, continuing from their final resume state
+    asha         promotes as soon as a trial is in the top 1/eta of the
+                 results so far; successive_halving waits for the whole rung
+
+Trials run concurrently, one per entry of workers.devices (GPUs or CPU
+slots). They share one data cache in <out_dir>/cache: the audio is decoded
+once into int16 shards (brspeech_shards.py) and the sample indexes are built
+before any trial starts, so trials only memory-map them.
+
+Every trial, start and result is appended to <out_dir>/sweep_log.jsonl.
+Running the same command again resumes an interrupted sweep from that log:
+unfinished trials continue from their latest resume state. The ranking is
+written to <out_dir>/sweep_summary.json after every result.
+
+    python brspeech_sweep.py --sweep configs/sweep_lr_wd.yaml
+    python brspeech_sweep.py --sweep configs/sweep_lr_wd.yaml --synthetic 4 --devices cpu cpu \
+        --num_trials 4 --max_epochs 2 --out_dir fine_tuned_models/sweep_smoke
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import logging
+import math
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from train_brspeech import load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SUBSETS = ['train', 'val', 'test']
+SWEEP_LOG = 'sweep_log.jsonl'
+SWEEP_SUMMARY = 'sweep_summary.json'
+METRICS = ('eer', 'max_source_eer', 'min_dcf')
+
+
+def set_key(config: dict, dotted: str, value):
+    """config['a']['b'] = value for dotted key 'a.b'."""
+    *parents, key = dotted.split('.')
+    for parent in parents:
+        config = config.setdefault(parent, {})
+    config[key] = value
+
+
+def merge(base: dict, overrides: dict) -> dict:
+    """Recursive dict update, returns `base`."""
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merge(base[key], value)
+        else:
+            base[key] = copy.deepcopy(value)
+    return base
+
+
+def sample_params(space: dict, seed: int, trial: int) -> dict:
+    """
+    Parameters of one random-search trial. A list is a choice; a dict has a
+    distribution (uniform, loguniform or int) with low and high.
+    """
+    rng = np.random.default_rng([seed, trial])
+    params = {}
+    for key, spec in space.items():
+        if isinstance(spec, list):
+            params[key] = spec[int(rng.integers(len(spec)))]
+            continue
+        low, high = float(spec['low']), float(spec['high'])
+        distribution = spec.get('distribution', 'uniform')
+        if distribution == 'loguniform':
+            params[key] = float(math.exp(rng.uniform(math.log(low), math.log(high))))
+        elif distribution == 'uniform':
+            params[key] = float(rng.uniform(low, high))
+        elif distribution == 'int':
+            params[key] = int(rng.integers(int(low), int(high) + 1))
+        else:
+            raise ValueError(f"Unknown distribution for {key}: {distribution}")
+    return params
+
+
+def grid_params(space: dict) -> list:
+    """Every combination of the listed values, in a fixed order."""
+    if not all(isinstance(spec, list) for spec in space.values()):
+        raise ValueError("Grid search needs a list of values for every parameter")
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def rung_epochs(min_epochs: int, max_epochs: int, eta: int) -> list:
+    """Epochs of each rung: min_epochs * eta ** k, capped at max_epochs."""
+    rungs = [min_epochs]
+    while rungs[-1] < max_epochs:
+        rungs.append(min(rungs[-1] * eta, max_epochs))
+    return rungs
+
+
+class HalvingScheduler:
+    """
+    Successive halving over rungs of training epochs. Jobs are (trial, rung);
+    the metric is lower-is-better, failed jobs count as inf and are never
+    promoted.
+
+    asynchronous=True is ASHA: a trial is promoted as soon as it is in the
+    top 1/eta of the results of its rung so far, and new trials start
+    whenever nothing is promotable. Otherwise a rung is promoted only when
+    it is complete, which leaves devices idle at the end of each rung.
+    """
+
+    def __init__(self, rungs: list, eta: int, num_trials: int, asynchronous: bool = True):
+        self.rungs = rungs
+        self.eta = eta
+        self.num_trials = num_trials
+        self.asynchronous = asynchronous
+        self.num_created = 0
+        self.started = set()
+        self.running = set()
+        self.results = {}
+
+    def _entered(self, rung: int) -> list:
+        return [trial for trial, r in self.started if r == rung]
+
+    def _ranked(self, rung: int) -> list:
+        return sorted((value, trial) for (trial, r), value in self.results.items() if r == rung)
+
+    def _complete(self, rung: int) -> bool:
+        if rung == 0:
+            ready = self.num_created >= self.num_trials
+        else:
+            ready = self._complete(rung - 1) and not self._promotable(rung - 1)
+        return ready and all((trial, rung) in self.results for trial in self._entered(rung))
+
+    def _promotable(self, rung: int) -> list:
+        ranked = self._ranked(rung)
+        if self.asynchronous:
+            keep = len(ranked) // self.eta
+        elif self._complete(rung):
+            keep = max(len(ranked) // self.eta, 1)
+        else:
+            return []
+        return [trial for value, trial in ranked[:keep]
+                if math.isfinite(value) and (trial, rung + 1) not in self.started]
+
+    def next_job(self):
+        """(trial, rung) to run next, or None if nothing can start now."""
+        # Jobs of an interrupted sweep first
+        interrupted = sorted(self.started - set(self.results) - self.running)
+        if interrupted:
+            return interrupted[0]
+        for rung in reversed(range(len(self.rungs) - 1)):
+            promotable = self._promotable(rung)
+            if promotable:
+                return promotable[0], rung + 1
+        if self.num_created < self.num_trials:
+            return self.num_created, 0
+        return None
+
+    def start(self, trial: int, rung: int):
+        self.num_created = max(self.num_created, trial + 1)
+        self.started.add((trial, rung))
+        self.running.add((trial, rung))
+
+    def finish(self, trial: int, rung: int, value):
+        self.running.discard((trial, rung))
+        self.results[(trial, rung)] = float('inf') if value is None or not math.isfinite(value) else value
+
+
+def read_log(log_path: Path) -> list:
+    if not log_path.exists():
+        return []
+    with open(log_path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_log(log_path: Path, event: dict):
+    with open(log_path, 'a') as f:
+        f.write(json.dumps({**event, 'time': time.time()}) + '\n')
+
+
+def shards_current(subset_dir: Path, csv_path: Path) -> bool:
+    meta_path = subset_dir / 'meta.json'
+    if not meta_path.exists() or not (subset_dir / 'index.csv').exists():
+        return False
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    return meta.get('source_mtime_ns') == os.stat(csv_path).st_mtime_ns
+
+
+def prepare_cache(model_config: dict, cache_dir: Path, use_shards: bool, workers: int) -> dict:
+    """
+    Decode the audio into shards and build the sample indexes once, before
+    any trial starts. Returns the `data` overrides of every trial.
+    """
+    from brspeech_sample_index import load_csv_index
+
+    data = model_config['data']
+    if data.get('ssl_feature_cache'):
+        logger.info(f"Trials share the SSL feature cache {data['ssl_feature_cache']}")
+        return {}
+    metadata_dir = Path(data['root_dir'])
+    if not (use_shards or data.get('backend') == 'shards'):
+        for subset in SUBSETS:
+            load_csv_index(metadata_dir / f"{subset}.csv")
+        logger.info(f"Trials share the sample indexes next to {metadata_dir}/*.csv (FLAC decoded per trial)")
+        return {}
+
+    from brspeech_shards import build_subset
+
+    shard_dir = Path(data['shard_dir']) if data.get('backend') == 'shards' else cache_dir / 'shards'
+    for subset in SUBSETS:
+        csv_path = metadata_dir / f"{subset}.csv"
+        subset_dir = shard_dir / subset
+        if shards_current(subset_dir, csv_path):
+            logger.info(f"✅ Shards for {subset} are up to date in {subset_dir}")
+        else:
+            logger.info(f"Decoding {csv_path} into {subset_dir}...")
+            build_subset(csv_path, subset_dir, workers, 2048 * 1024 * 1024)
+        load_csv_index(subset_dir / 'index.csv')
+    return {'backend': 'shards', 'shard_dir': str(shard_dir)}
+
+
+def trial_config(base: dict, overrides: dict, params: dict, data_overrides: dict) -> dict:
+    """Config of one trial: base + sweep overrides + trial parameters + shared cache."""
+    config = merge(copy.deepcopy(base), overrides)
+    for key, value in params.items():
+        set_key(config, key, value)
+    config['data'].update(data_overrides)
+    # Promotion continues from the final resume state; the rung metric comes from val_metrics.jsonl
+    merge(config, {
+        'checkpointing': {'enabled': True, 'keep_final': True},
+        'validation': {'streaming_metrics': True, 'async_eval': False, 'early_stopping_patience': None},
+    })
+    return config
+
+
+def metric_value(record: dict, metric: str) -> float:
+    if metric == 'max_source_eer':
+        return max(record['per_source_eer'].values(), default=record['eer'])
+    return record[metric]
+
+
+def count_lines(path: Path) -> int:
+    if not path.exists():
+        return 0
+    with open(path, 'r') as f:
+        return sum(1 for _ in f)
+
+
+def trained_checkpoint(trial_dir: Path):
+    """Checkpoint train_nn returned for the last run of a trial, or None."""
+    path = trial_dir / 'training_result.json'
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        return json.load(f).get('checkpoint')
+
+
+def last_validation(metrics_path: Path, skip_lines: int):
+    """Last train_nn validation record written after line `skip_lines`, or None."""
+    if not metrics_path.exists():
+        return None
+    with open(metrics_path, 'r') as f:
+        records = [json.loads(line) for line in itertools.islice(f, skip_lines, None) if line.strip()]
+    return next((r for r in reversed(records) if r.get('kind') == 'epoch'), None)
+
+
+class TrialJob:
+    """One train_brspeech.py process training a trial up to a rung's epochs."""
+
+    def __init__(self, trial: int, rung: int, epochs: int, trial_dir: Path, device: str, threads: int):
+        self.trial = trial
+        self.rung = rung
+        self.epochs = epochs
+        self.trial_dir = trial_dir
+        self.device = device
+        self.metrics_path = trial_dir / 'val_metrics.jsonl'
+        self.skip_lines = count_lines(self.metrics_path)
+        self.start_time = time.time()
+
+        env = {k: v for k, v in os.environ.items() if k not in ('WORLD_SIZE', 'RANK', 'LOCAL_RANK')}
+        if device.startswith('cuda'):
+            env['CUDA_VISIBLE_DEVICES'] = device.partition(':')[2] or '0'
+            device_arg = 'cuda'
+        else:
+            env['OMP_NUM_THREADS'] = env['MKL_NUM_THREADS'] = str(threads)
+            device_arg = 'cpu'
+        cmd = [sys.executable, str(Path(__file__).parent / 'train_brspeech.py'),
+               '--config', str(trial_dir / 'config.yaml'), '--out_dir', str(trial_dir),
+               '--device', device_arg, '--epochs', str(epochs), '--resume', 'latest']
+        log_file = open(trial_dir / 'train.log', 'a')
+        self.process = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT, env=env)
+        log_file.close()
+
+    def poll(self):
+        return self.process.poll()
+
+
+def write_summary(path: Path, scheduler: HalvingScheduler, trials: dict, sweep: dict, out_dir: Path,
+                  checkpoints: dict) -> list:
+    """
+    Trials ranked by the highest rung reached, then by its metric; `checkpoints`
+    maps (trial, rung) to the checkpoint train_nn returned for that result.
+    """
+    rows = []
+    for trial, params in sorted(trials.items()):
+        rungs = {r: value for (t, r), value in scheduler.results.items() if t == trial}
+        top = max(rungs) if rungs else None
+        value = rungs[top] if top is not None else None
+        rows.append({
+            'trial': trial,
+            'params': params,
+            'epochs': scheduler.rungs[top] if top is not None else 0,
+            'metric': value if value is not None and math.isfinite(value) else None,
+            'rungs': {str(scheduler.rungs[r]): (v if math.isfinite(v) else None) for r, v in sorted(rungs.items())},
+            'checkpoint': checkpoints.get((trial, top)),
+            'running': any(t == trial for t, _ in scheduler.running),
+            'dir': str(out_dir / 'trials' / f"trial_{trial:04d}"),
+        })
+    rows.sort(key=lambda r: (-r['epochs'], r['metric'] if r['metric'] is not None else float('inf')))
+    best = rows[0] if rows and rows[0]['metric'] is not None else None
+    with open(path, 'w') as f:
+        json.dump({'scheduler': sweep['scheduler'], 'rungs': scheduler.rungs, 'num_trials': scheduler.num_trials,
+                   'finished': not scheduler.running and scheduler.next_job() is None,
+                   'best': best, 'trials': rows}, f, indent=2)
+    return rows
+
+
+def format_params(params: dict) -> str:
+    return ', '.join(f"{k.rpartition('.')[2]}={v:.3g}" if isinstance(v, float) else f"{k.rpartition('.')[2]}={v}"
+                     for k, v in params.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Successive-halving / ASHA hyperparameter sweep for train_brspeech.py')
+    parser.add_argument('--sweep', type=str, required=True, help='Sweep config (search space, scheduler, workers)')
+    parser.add_argument('--out_dir', type=str, help='Sweep directory (default: out_dir of the sweep config)')
+    parser.add_argument('--devices', nargs='+', help='Override workers.devices, e.g. cuda:0 cuda:1 or cpu cpu')
+    parser.add_argument('--num_trials', type=int, help='Override search.num_trials (random search)')
+    parser.add_argument('--min_epochs', type=int, help='Override scheduler.min_epochs')
+    parser.add_argument('--max_epochs', type=int, help='Override scheduler.max_epochs')
+    parser.add_argument('--synthetic', type=int, metavar='CLIPS',
+                        help='Run on a generated dataset with this many clips per source (smoke tests)')
+    parser.add_argument('--poll', type=float, default=5.0, help='Seconds between checks of the running trials')
+    args = parser.parse_args()
+
+    sweep = load_config(args.sweep)
+    search, scheduler_config = sweep.get('search', {}), sweep.get('scheduler', {})
+    workers = sweep.get('workers', {})
+    out_dir = Path(args.out_dir or sweep.get('out_dir', 'fine_tuned_models/sweep'))
+    (out_dir / 'trials').mkdir(parents=True, exist_ok=True)
+    log_path = out_dir / SWEEP_LOG
+
+    metric = scheduler_config.get('metric', 'eer')
+    if metric not in METRICS:
+        raise ValueError(f"Unknown sweep metric: {metric} (expected one of {', '.join(METRICS)})")
+    space = search.get('space', {})
+    if not space:
+        raise ValueError("The sweep config has an empty search.space")
+    method = search.get('method', 'random')
+    grid = grid_params(space) if method == 'grid' else None
+    num_trials = len(grid) if grid is not None else (args.num_trials or search.get('num_trials', 9))
+    eta = scheduler_config.get('reduction_factor', 3)
+    rungs = rung_epochs(args.min_epochs or scheduler_config.get('min_epochs', 1),
+                        args.max_epochs or scheduler_config.get('max_epochs', 9), eta)
+    kind = scheduler_config.get('type', 'asha')
+    if kind not in ('asha', 'successive_halving'):
+        raise ValueError(f"Unknown scheduler type: {kind}")
+    scheduler = HalvingScheduler(rungs, eta, num_trials, asynchronous=kind == 'asha')
+
+    # Replay the log of an interrupted sweep
+    trials = {}
+    checkpoints = {}
+    events = read_log(log_path)
+    for event in events:
+        if event['event'] == 'trial':
+            trials[event['trial']] = event['params']
+            scheduler.num_created = max(scheduler.num_created, event['trial'] + 1)
+        elif event['event'] == 'start':
+            scheduler.started.add((event['trial'], event['rung']))
+        elif event['event'] == 'result':
+            scheduler.results[(event['trial'], event['rung'])] = (
+                event['metric'] if event['metric'] is not None else float('inf'))
+            checkpoints[(event['trial'], event['rung'])] = event.get('checkpoint')
+    if events:
+        unfinished = len(scheduler.started) - len(scheduler.results)
+        logger.info(f"🔁 Resuming sweep from {log_path}: {len(trials)} trials, {len(scheduler.results)} results, "
+                    f"{unfinished} interrupted")
+
+    # One data cache for every trial
+    base_config = load_config(sweep['base_config'])
+    cache = sweep.get('cache', {})
+    if args.synthetic:
+        from brspeech_synthetic import make_synthetic_dataset
+
+        synthetic_dir = out_dir / 'cache' / 'synthetic'
+        if not (synthetic_dir / 'metadata' / 'test.csv').exists():
+            make_synthetic_dataset(synthetic_dir, args.synthetic, max_seconds=2.0)
+        base_config['data']['root_dir'] = str(synthetic_dir / 'metadata')
+        logger.info(f"Synthetic dataset in {synthetic_dir}")
+    data_overrides = prepare_cache(base_config, out_dir / 'cache', cache.get('shards', True),
+                                   cache.get('workers') or os.cpu_count())
+
+    devices = args.devices or workers.get('devices') or ['cpu']
+    cpu_slots = sum(1 for d in devices if not d.startswith('cuda'))
+    threads = workers.get('cpu_threads') or max(1, (os.cpu_count() or 1) // max(cpu_slots, 1))
+    logger.info(f"Sweep: {num_trials} trials ({method}), {kind} over epochs {rungs} with eta {eta}, "
+                f"metric {metric}, devices {devices}")
+
+    free = list(range(len(devices)))
+    running = {}
+    try:
+        while True:
+            for slot, job in list(running.items()):
+                returncode = job.poll()
+                if returncode is None:
+                    continue
+                del running[slot]
+                free.append(slot)
+                record = last_validation(job.metrics_path, job.skip_lines) if returncode == 0 else None
+                if returncode == 0 and record is None:
+                    # Rerun of a trial whose last run already trained these epochs: nothing new was validated
+                    record = last_validation(job.metrics_path, 0)
+                value = metric_value(record, metric) if record is not None else None
+                checkpoint = trained_checkpoint(job.trial_dir) if returncode == 0 else None
+                scheduler.finish(job.trial, job.rung, value)
+                checkpoints[(job.trial, job.rung)] = checkpoint
+                append_log(log_path, {'event': 'result', 'trial': job.trial, 'rung': job.rung, 'epochs': job.epochs,
+                                      'metric': value, 'checkpoint': checkpoint, 'returncode': returncode,
+                                      'validation': record, 'seconds': time.time() - job.start_time})
+                if value is None:
+                    logger.warning(f"❌ Trial {job.trial} (rung {job.rung}, {job.epochs} epochs) exited with "
+                                   f"{returncode} without a validation result, see {job.trial_dir / 'train.log'}")
+                else:
+                    logger.info(f"✅ Trial {job.trial} at {job.epochs} epochs: {metric} {value:.3f} | "
+                                f"{format_params(trials[job.trial])} ({time.time() - job.start_time:.0f}s)")
+                write_summary(out_dir / SWEEP_SUMMARY, scheduler, trials, sweep, out_dir, checkpoints)
+
+            while free:
+                job_key = scheduler.next_job()
+                if job_key is None:
+                    break
+                trial, rung = job_key
+                trial_dir = out_dir / 'trials' / f"trial_{trial:04d}"
+                if trial not in trials:
+                    trials[trial] = grid[trial] if grid is not None else sample_params(space, search.get('seed', 0), trial)
+                    append_log(log_path, {'event': 'trial', 'trial': trial, 'params': trials[trial]})
+                if not (trial_dir / 'config.yaml').exists():
+                    trial_dir.mkdir(parents=True, exist_ok=True)
+                    with open(trial_dir / 'config.yaml', 'w') as f:
+                        yaml.safe_dump(trial_config(base_config, sweep.get('overrides', {}), trials[trial],
+                                                    data_overrides), f, sort_keys=False)
+                slot = free.pop(0)
+                scheduler.start(trial, rung)
+                append_log(log_path, {'event': 'start', 'trial': trial, 'rung': rung, 'epochs': rungs[rung],
+                                      'device': devices[slot]})
+                running[slot] = TrialJob(trial, rung, rungs[rung], trial_dir, devices[slot], threads)
+                logger.info(f"Trial {trial} -> {rungs[rung]} epochs on {devices[slot]} | {format_params(trials[trial])}")
+
+            if not running:
+                break
+            time.sleep(args.poll)
+    except KeyboardInterrupt:
+        logger.warning("⚠️ Interrupted: stopping running trials; rerun the same command to resume")
+        for job in running.values():
+            job.process.terminate()
+            job.process.wait()
+        raise
+
+    rows = write_summary(out_dir / SWEEP_SUMMARY, scheduler, trials, sweep, out_dir, checkpoints)
+    logger.info("=== SWEEP SUMMARY ===")
+    for row in rows:
+        value = f"{row['metric']:.3f}" if row['metric'] is not None else 'failed'
+        logger.info(f"trial {row['trial']:4d} | {row['epochs']:3d} epochs | {metric} {value:>8} | "
+                    f"{format_params(row['params'])}")
+    logger.info(f"Summary saved to: {out_dir / SWEEP_SUMMARY}")
+
+
+if __name__ == "__main__":
+    main()
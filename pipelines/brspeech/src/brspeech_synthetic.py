@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Synthetic BrSpeech-shaped dataset for benchmarks and CPU-only smoke runs.
+Writes short random FLAC clips for a real corpus and the five TTS systems,
+plus metadata CSVs in the format produced by prepare_brspeech_metadata.py.
+"""
+
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+import torchaudio
+
+TTS_MODELS = ['f5tts', 'fish-speech', 'toucantts', 'xtts', 'yourtts']
+SUBSETS = {'train': 'train', 'val': 'dev', 'test': 'test'}
+
+
+def make_synthetic_dataset(out_dir, clips_per_source: int = 20, sample_rate: int = 16000,
+                           min_seconds: float = 1.0, max_seconds: float = 8.0, seed: int = 0) -> Path:
+    """
+    Create <out_dir>/audio/... and <out_dir>/metadata/{train,val,test}.csv.
+    Each subset gets `clips_per_source` clips per source; returns the metadata dir.
+    Fake clips get a spectral tilt so a model can actually separate the classes.
+    """
+    rng = np.random.default_rng(seed)
+    out_dir = Path(out_dir)
+    metadata_dir = out_dir / 'metadata'
+    metadata_dir.mkdir(parents=True, exist_ok=True)
+
+    for subset, split in SUBSETS.items():
+        rows = []
+        for synth in ['bonafide'] + TTS_MODELS:
+            source_dir = out_dir / 'audio' / ('real' if synth == 'bonafide' else synth) / split
+            source_dir.mkdir(parents=True, exist_ok=True)
+            for i in range(clips_per_source):
+                num_frames = int(rng.uniform(min_seconds, max_seconds) * sample_rate)
+                noise = rng.standard_normal(num_frames).astype(np.float32)
+                if synth != 'bonafide':
+                    noise = np.convolve(noise, np.ones(4, dtype=np.float32) / 4, mode='same')
+                waveform = torch.from_numpy(0.1 * noise / (np.abs(noise).max() + 1e-9))[None, :]
+                path = source_dir / f"{synth}_{split}_{i:05d}.flac"
+                torchaudio.save(str(path), waveform, sample_rate, format='flac')
+                label = 'bonafide' if synth == 'bonafide' else 'spoof'
+                rows.append((str(path), label, synth, num_frames, sample_rate, round(num_frames / sample_rate, 4)))
+        pd.DataFrame(rows, columns=['path', 'label', 'synth', 'num_frames', 'sample_rate', 'duration']).to_csv(
+            metadata_dir / f"{subset}.csv", index=False)
+    return metadata_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a small synthetic BrSpeech-shaped dataset')
+    parser.add_argument('--out_dir', type=str, required=True)
+    parser.add_argument('--clips_per_source', type=int, default=20)
+    parser.add_argument('--max_seconds', type=float, default=8.0)
+    args = parser.parse_args()
+    metadata_dir = make_synthetic_dataset(args.out_dir, args.clips_per_source, max_seconds=args.max_seconds)
+    print(f"✅ Synthetic metadata written to {metadata_dir} "
+          f"({len(os.listdir(metadata_dir))} CSVs, {args.clips_per_source * (len(TTS_MODELS) + 1)} clips per subset)")
+
+
+if __name__ == "__main__":
+    main()
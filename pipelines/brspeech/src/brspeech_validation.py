@@ -0,0 +1,359 @@
+"""
+Cheap in-training validation and out-of-band checkpoint evaluation.
+
+train_nn validates inline on the loader it gets as data_test while the
+training device waits. Validation is split in two:
+
+- train_nn gets a fixed subset of the val set, stratified per label and
+  synth source, so its per-epoch pass takes seconds. InLoopValidator scores
+  the same subset every N optimizer updates into a StreamingMetrics
+  (brspeech_metrics.py) and appends EER, AUC, min DCF and per-source EER to
+  <out_dir>/val_metrics.jsonl.
+- BackgroundEvaluator runs brspeech_async_eval.py next to the training
+  process. It scores every checkpoint train_nn saves on the full val (and
+  test) sets on spare CPU cores or another device and appends one record per
+  checkpoint to <out_dir>/async_eval.jsonl.
+
+AsyncEarlyStopping reads that file from the training process and ends the run
+at the next epoch boundary once the val EER has not improved for `patience`
+evaluated checkpoints. Its best/since-best are re-derived from the file, so
+they survive a resume. EpochEarlyStopping replaces train_nn's own per-epoch
+patience in resumable runs, where that counter would restart from zero.
+"""
+
+import contextlib
+import json
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import torch
+import yaml
+from torch.utils.data import DataLoader, Subset
+
+from brspeech_eval import eer_auc, source_eers
+from brspeech_metrics import StreamingMetrics, loader_sources
+from brspeech_models import model_transform
+from brspeech_sampling import largest_remainder
+
+logger = logging.getLogger(__name__)
+
+ASYNC_RESULTS = 'async_eval.jsonl'
+ASYNC_DIR = 'async_eval'
+
+
+class StopTraining(Exception):
+    """Raised at an epoch boundary to end train_nn early."""
+
+
+def _source_column(samples_df) -> str:
+    return 'synth' if 'synth' in samples_df.columns else 'label'
+
+
+def stratified_positions(samples_df, size: int, seed: int = 0) -> np.ndarray:
+    """
+    Sorted positions of a fixed subset with a quota per (label, synth) stratum
+    proportional to its size and at least one clip from every stratum.
+    """
+    keys = np.stack([samples_df.codes('label'), samples_df.codes(_source_column(samples_df))], axis=1)
+    strata, stratum_of = np.unique(keys, axis=0, return_inverse=True)
+    stratum_of = stratum_of.reshape(-1)
+    sizes = np.bincount(stratum_of, minlength=len(strata))
+    quotas = np.minimum(np.maximum(largest_remainder(min(size, len(stratum_of)), sizes), 1), sizes)
+    rng = np.random.default_rng(seed)
+    picks = [rng.choice(np.flatnonzero(stratum_of == s), quota, replace=False) for s, quota in enumerate(quotas)]
+    return np.sort(np.concatenate(picks))
+
+
+def subset_loader(dataset, size: int, batch_size: int, loader_kwargs: dict, seed: int = 0) -> DataLoader:
+    """Loader over a fixed stratified subset of `dataset` (see stratified_positions)."""
+    positions = stratified_positions(dataset.samples_df, size, seed)
+    logger.info(f"Validation subset: {len(positions)} of {len(dataset)} clips")
+    return DataLoader(Subset(dataset, positions.tolist()), batch_size=batch_size, shuffle=False, **loader_kwargs)
+
+
+def stream_loader(model, loader, device: torch.device, metrics: StreamingMetrics, sources=None):
+    """Run every batch of `loader` through the model in eval mode into `metrics`."""
+    was_training = model.training
+    model.eval()
+    offset = 0
+    try:
+        with torch.inference_mode():
+            for batch_x, batch_y in loader:
+                output = model(batch_x.to(device, non_blocking=True))
+                metrics.update(output, batch_y, None if sources is None else sources[offset:offset + len(batch_y)])
+                offset += len(batch_y)
+    finally:
+        model.train(was_training)
+    return metrics
+
+
+def metrics_record(labels, scores, sources) -> dict:
+    """EER/AUC overall and EER per fake source, in percent, plus accuracy at 0.5."""
+    eer, auc = eer_auc(labels, scores)
+    return {
+        'clips': int(len(labels)),
+        'eer': eer * 100,
+        'auc': auc,
+        'accuracy': float(np.mean((scores > 0.5) == (labels == 1)) * 100),
+        'per_source_eer': {k: v * 100 for k, v in source_eers(labels, scores, sources).items()},
+    }
+
+
+class InLoopValidator:
+    """
+    Scores the validation subset every `every_steps` optimizer updates.
+
+    Usage:
+        with InLoopValidator(val_loader, 500, out_dir / 'val_metrics.jsonl', device):
+            train_nn(...)
+    """
+
+    def __init__(self, loader, every_steps: int, metrics_path, device: torch.device):
+        self.loader = loader
+        self.sources = loader_sources(loader)
+        self.metrics = StreamingMetrics(sorted(set(self.sources)) if self.sources is not None else ())
+        self.every_steps = every_steps
+        self.metrics_path = Path(metrics_path)
+        self.device = device
+        self.model = None
+        self.updates = 0
+        self._stack = contextlib.ExitStack()
+
+    def _attach(self, model):
+        self.model = model
+        return model
+
+    def _step_post_hook(self, optimizer, args, kwargs):
+        # Accumulating optimizers only update when no micro-batches are pending
+        if getattr(optimizer, 'micro_steps', 0) != 0:
+            return
+        self.updates += 1
+        if self.model is not None and self.updates % self.every_steps == 0:
+            self.run()
+
+    def run(self):
+        start = time.perf_counter()
+        self.metrics.reset()
+        stream_loader(self.model, self.loader, self.device, self.metrics, self.sources)
+        record = {'kind': 'in_loop', 'update': self.updates, **self.metrics.record(),
+                  'seconds': time.perf_counter() - start}
+        with open(self.metrics_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        worst = max(record['per_source_eer'].items(), key=lambda kv: kv[1], default=('-', float('nan')))
+        logger.info(f"update {self.updates}: val subset EER {record['eer']:.2f}% | AUC {record['auc']:.4f} | "
+                    f"worst source {worst[0]} {worst[1]:.2f}% ({record['seconds']:.1f}s)")
+
+    def __enter__(self):
+        from torch.optim.optimizer import register_optimizer_step_post_hook
+
+        self.metrics_path.parent.mkdir(parents=True, exist_ok=True)
+        self._stack.enter_context(model_transform(self._attach))
+        self._stack.callback(register_optimizer_step_post_hook(self._step_post_hook).remove)
+        logger.info(f"In-loop validation every {self.every_steps} updates on {len(self.loader.dataset)} clips "
+                    f"-> {self.metrics_path}")
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+        return False
+
+
+class BackgroundEvaluator:
+    """
+    Runs brspeech_async_eval.py on `out_dir` for the duration of training.
+    On exit it signals the evaluator that training is done; with wait=True
+    it waits until the last checkpoints are scored.
+    """
+
+    def __init__(self, model_config: dict, out_dir, device: str = 'cpu', threads: Optional[int] = None,
+                 subsets=('val',), wait: bool = True):
+        self.model_config = model_config
+        self.out_dir = Path(out_dir)
+        self.device = device
+        self.threads = threads
+        self.subsets = list(subsets)
+        self.wait = wait
+        self.eval_dir = self.out_dir / ASYNC_DIR
+        self.done_file = self.eval_dir / 'DONE'
+        self.process = None
+
+    def __enter__(self):
+        self.eval_dir.mkdir(parents=True, exist_ok=True)
+        self.done_file.unlink(missing_ok=True)
+        config_path = self.eval_dir / 'config.yaml'
+        with open(config_path, 'w') as f:
+            yaml.safe_dump(self.model_config, f, sort_keys=False)
+        cmd = [sys.executable, str(Path(__file__).parent / 'brspeech_async_eval.py'),
+               '--config', str(config_path), '--watch_dir', str(self.out_dir),
+               '--device', self.device, '--subsets', *self.subsets]
+        if self.threads:
+            cmd += ['--threads', str(self.threads)]
+        log_file = open(self.eval_dir / 'evaluator.log', 'a')
+        self.process = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+        log_file.close()
+        logger.info(f"Background evaluator started (pid {self.process.pid}, {self.device}): "
+                    f"results in {self.out_dir / ASYNC_RESULTS}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.done_file.touch()
+        if exc_type is not None or not self.wait:
+            if exc_type is not None:
+                self.process.terminate()
+            return False
+        logger.info("Waiting for the background evaluator to score the last checkpoints...")
+        if self.process.wait() != 0:
+            logger.warning(f"⚠️ Background evaluator exited with {self.process.returncode}, "
+                           f"see {self.eval_dir / 'evaluator.log'}")
+        return False
+
+
+def read_results(results_path, subset: str = 'val') -> list:
+    """Records of async_eval.jsonl for one subset, in evaluation order."""
+    results_path = Path(results_path)
+    if not results_path.exists():
+        return []
+    with open(results_path, 'r') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [r for r in records if r.get('subset') == subset]
+
+
+class _StoppingLoader:
+    """Proxy around the train DataLoader checking the early-stopping rule before every epoch."""
+
+    def __init__(self, loader, stopping: 'AsyncEarlyStopping'):
+        self._loader = loader
+        self._stopping = stopping
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def __iter__(self):
+        self._stopping.check()
+        return iter(self._loader)
+
+
+class AsyncEarlyStopping:
+    """
+    Early stopping on the background evaluator's val results.
+    metric 'eer' is the pooled val EER, 'max_source_eer' the EER of the worst TTS source.
+    """
+
+    def __init__(self, results_path, patience: int, metric: str = 'eer'):
+        if metric not in ('eer', 'max_source_eer'):
+            raise ValueError(f"Unknown early-stopping metric: {metric}")
+        self.results_path = Path(results_path)
+        self.patience = patience
+        self.metric = metric
+        self.best = None
+        self.since_best = 0
+
+    def _value(self, record: dict) -> float:
+        if self.metric == 'max_source_eer':
+            return max(record['per_source_eer'].values(), default=record['eer'])
+        return record['eer']
+
+    def poll(self) -> bool:
+        """Re-read the results; True if `patience` checkpoints in a row did not improve on the best."""
+        self.best, self.since_best = None, 0
+        for record in read_results(self.results_path):
+            value = self._value(record)
+            if np.isnan(value):
+                continue
+            if self.best is None or value < self._value(self.best):
+                self.best, self.since_best = record, 0
+            else:
+                self.since_best += 1
+        return self.best is not None and self.since_best >= self.patience
+
+    @property
+    def best_checkpoint(self) -> Optional[str]:
+        return self.best['checkpoint'] if self.best else None
+
+    def check(self):
+        from brspeech_distributed import reduce_values
+
+        # Every rank decides together, at the same epoch boundary
+        stop = reduce_values({'stop': float(self.poll())}, 'max')['stop'] > 0
+        if stop:
+            raise StopTraining(
+                f"No val {self.metric} improvement in {self.patience} evaluated checkpoints; "
+                f"best {self._value(self.best):.2f}% at {self.best_checkpoint}" if self.best else
+                "Early stopping requested by another rank")
+
+    def wrap_loader(self, loader):
+        return _StoppingLoader(loader, self)
+
+
+class EpochEarlyStopping:
+    """
+    train_nn's per-epoch early stopping on the val loss, with a state that
+    can be saved in resume states.
+
+    train_nn keeps its patience counter internally, so a resumed run would
+    start counting again. In resumable runs train_nn's early stopping is
+    turned off and this class counts instead: it reads every train_nn
+    validation pass from a ValidationMetrics and stops at the next epoch
+    boundary after `patience` passes without improvement. Register
+    state/load_state with the TrainingCheckpointer.
+    """
+
+    def __init__(self, validation_metrics, patience: int, metric: str = 'loss'):
+        self.validation_metrics = validation_metrics
+        self.patience = patience
+        self.metric = metric
+        self.best = None
+        self.best_checkpoint = None
+        self.since_best = 0
+        self._seen = 0
+
+    def _newest_checkpoint(self) -> Optional[str]:
+        """Newest checkpoint train_nn has saved, i.e. the one of the epoch just validated."""
+        from brspeech_async_eval import find_checkpoints
+
+        metrics_path = self.validation_metrics.metrics_path
+        found = find_checkpoints(metrics_path.parent) if metrics_path is not None else []
+        return str(found[-1]) if found else None
+
+    def update(self):
+        """Count the validation passes made since the last call."""
+        history = self.validation_metrics.history
+        for record in history[self._seen:]:
+            value = record[self.metric]
+            if np.isnan(value):
+                continue
+            if self.best is None or value < self.best:
+                self.best, self.since_best = value, 0
+                self.best_checkpoint = self._newest_checkpoint()
+            else:
+                self.since_best += 1
+        self._seen = len(history)
+
+    def state(self) -> dict:
+        self.update()
+        return {'best': self.best, 'since_best': self.since_best, 'best_checkpoint': self.best_checkpoint}
+
+    def load_state(self, state: dict):
+        self.best, self.since_best = state['best'], state['since_best']
+        self.best_checkpoint = state.get('best_checkpoint')
+        self._seen = len(self.validation_metrics.history)
+
+    def check(self):
+        from brspeech_distributed import reduce_values
+
+        self.update()
+        stop = reduce_values({'stop': float(self.best is not None and self.since_best >= self.patience)}, 'max')['stop'] > 0
+        if stop:
+            raise StopTraining(f"No val {self.metric} improvement in {self.patience} epochs; best {self.best:.4f}"
+                               if self.best is not None else "Early stopping requested by another rank")
+
+    def wrap_loader(self, loader):
+        return _StoppingLoader(loader, self)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Distillation Check
+Runs the pieces of distill_brspeech.py that do not need a trained teacher on
+a small synthetic dataset (brspeech_synthetic.py), on CPU:
+
+    student config   student_model_config: the distillation.student model
+                     block, its training overrides, the teacher crop length,
+                     and a nb_samp mismatch rejected; both students built
+                     and run on a batch, one logit per clip
+    criterion        Distiller.criterion against the loss written out by
+                     hand: hard + soft term with pending teacher logits, the
+                     plain hard-label loss when `pending` is None or under
+                     no_grad (validation), invalid alpha / criterion rejected
+    teacher cache    teacher_key / build_teacher_cache / load_teacher_cache:
+                     a cache built with a randomly initialised raw_cnn teacher
+                     loads back unchanged under the same key and is refused
+                     after the crop count or the checkpoint file changes;
+                     DistillationDataset hands out cached crops and logits
+
+Exits non-zero if any check fails.
+
+    python check_distillation.py --config configs/aasist_w2v_brspeech.yaml
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from brspeech_students import build_student
+from brspeech_synthetic import make_synthetic_dataset
+from distill_brspeech import (DistillationDataset, Distiller, build_teacher_cache, load_teacher_cache,
+                              student_model_config, teacher_key)
+from train_brspeech import build_train_config, create_dataloaders, load_config
+
+
+def check_student_config(model_config: dict) -> list:
+    config = student_model_config(model_config)
+    distill = model_config['distillation']
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+    results = [
+        ('student_model_config: model block', config['model']['name'] == distill['student']['name']
+         and config['model']['parameters']['nb_samp'] == nb_samp),
+        ('student_model_config: training overrides', all(
+            config['training'][k] == v for k, v in (distill.get('training') or {}).items())),
+        ('student_model_config: no distillation, cache or sampling', 'distillation' not in config
+         and config['data']['ssl_feature_cache'] is None and config['sampling'] == {}),
+        ('student_model_config: teacher config untouched', 'distillation' in model_config),
+    ]
+    mismatched = {**model_config, 'distillation': {
+        **distill, 'student': {'name': distill['student']['name'], 'parameters': {'nb_samp': nb_samp // 2}}}}
+    try:
+        student_model_config(mismatched)
+        results.append(('student_model_config: nb_samp mismatch rejected', False))
+    except ValueError:
+        results.append(('student_model_config: nb_samp mismatch rejected', True))
+
+    for name in ['mel_cnn', 'raw_cnn']:
+        student = build_student(name, {'nb_samp': nb_samp}, torch.device('cpu')).eval()
+        with torch.inference_mode():
+            output = student(torch.randn(3, nb_samp))
+        results.append((f"build_student('{name}'): (B, 1) logits", tuple(output.shape) == (3, 1)))
+    return results
+
+
+def check_criterion(temperature: float, alpha: float) -> list:
+    distiller = Distiller(temperature, alpha)
+    criterion = distiller.criterion(torch.nn.BCEWithLogitsLoss)()
+    generator = torch.Generator().manual_seed(0)
+    student = torch.randn(16, 1, generator=generator, requires_grad=True)
+    target = torch.randint(0, 2, (16, 1), generator=generator).float()
+    teacher = torch.randn(16, generator=generator)
+
+    bce = torch.nn.functional.binary_cross_entropy_with_logits
+    hard = bce(student, target)
+    soft = bce(student / temperature, torch.sigmoid(teacher.reshape(16, 1) / temperature))
+    expected = (1 - alpha) * hard + alpha * temperature ** 2 * soft
+
+    distiller.pending = teacher
+    with_teacher = criterion(student, target)
+    with torch.no_grad():
+        under_no_grad = criterion(student, target)
+    distiller.pending = None
+    without_teacher = criterion(student, target)
+    with_teacher.backward()
+
+    results = [
+        ('Distiller: hard + soft term', torch.allclose(with_teacher, expected)),
+        ('Distiller: gradient reaches the student', student.grad is not None and bool(student.grad.abs().sum() > 0)),
+        ('Distiller: hard only without pending logits', torch.allclose(without_teacher, hard)),
+        ('Distiller: hard only under no_grad', torch.allclose(under_no_grad, hard)),
+    ]
+    try:
+        Distiller(temperature, 1.5)
+        results.append(('Distiller: alpha outside [0, 1] rejected', False))
+    except ValueError:
+        results.append(('Distiller: alpha outside [0, 1] rejected', True))
+    try:
+        distiller.criterion(torch.nn.MSELoss)
+        results.append(('Distiller: non-BCE criterion rejected', False))
+    except ValueError:
+        results.append(('Distiller: non-BCE criterion rejected', True))
+    return results
+
+
+def check_teacher_cache(model_config: dict, work_dir: Path, crops: int) -> list:
+    config = student_model_config(model_config)
+    train_config = build_train_config(config, torch.device('cpu'))
+    train_dataset = create_dataloaders(config, train_config)[0].dataset
+
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+    teacher = build_student('raw_cnn', {'nb_samp': nb_samp}, torch.device('cpu')).eval()
+    checkpoint = work_dir / 'teacher.pth'
+    torch.save(teacher.state_dict(), checkpoint)
+    cache_dir = work_dir / 'teacher_cache'
+
+    key = teacher_key(model_config, str(checkpoint), crops)
+    logits, offsets = build_teacher_cache(teacher, train_dataset, cache_dir, key, batch_size=4 * crops,
+                                          num_workers=0, device=torch.device('cpu'))
+    cached = load_teacher_cache(cache_dir, teacher_key(model_config, str(checkpoint), crops))
+    results = [
+        ('teacher cache: shape (clips, crops)', logits.shape == offsets.shape == (len(train_dataset), crops)),
+        ('teacher cache: same key loads it back', cached is not None
+         and np.array_equal(cached[0], logits) and np.array_equal(cached[1], offsets)),
+        ('teacher cache: other crop count refused',
+         load_teacher_cache(cache_dir, teacher_key(model_config, str(checkpoint), crops + 1)) is None),
+    ]
+    stat = os.stat(checkpoint)
+    os.utime(checkpoint, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    results.append(('teacher cache: rewritten checkpoint refused',
+                    load_teacher_cache(cache_dir, teacher_key(model_config, str(checkpoint), crops)) is None))
+
+    dataset = DistillationDataset(train_dataset, logits, offsets)
+    x, y, teacher_logit = dataset[0]
+    results += [
+        ('DistillationDataset: nb_samp crop', tuple(x.shape) == (nb_samp,)),
+        ('DistillationDataset: label and a cached logit', y == int(train_dataset._labels[0])
+         and np.isclose(logits[0], teacher_logit).any()),
+    ]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the distillation config, loss and teacher cache on CPU')
+    parser.add_argument('--config', type=str, required=True, help='Teacher config with a distillation block')
+    parser.add_argument('--clips_per_source', type=int, default=2, help='Synthetic clips per source and subset')
+    parser.add_argument('--work_dir', type=str, help='Scratch directory (default: a temporary directory)')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model_config = load_config(args.config)
+    distill = model_config['distillation']
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(args.work_dir or tmp)
+        synthetic_dir = work_dir / 'synthetic'
+        make_synthetic_dataset(synthetic_dir, args.clips_per_source, max_seconds=6.0)
+        model_config['data'].update({'root_dir': str(synthetic_dir / 'metadata'), 'backend': 'flac',
+                                     'ssl_feature_cache': None})
+        model_config['dataloader'] = {'num_workers': 0, 'pin_memory': False}
+
+        results = check_student_config(model_config)
+        results += check_criterion(distill.get('temperature', 2.0), distill.get('alpha', 0.5))
+        results += check_teacher_cache(model_config, work_dir, distill.get('teacher_crops', 4))
+
+    print()
+    for name, ok in results:
+        print(f"{'✅' if ok else '❌'} {name}")
+    failed = [name for name, ok in results if not ok]
+    print(f"\n{len(results) - len(failed)}/{len(results)} checks passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+"""
+BrSpeech Knowledge Distillation
+Trains a small CPU-friendly student (brspeech_students.py, or any upstream
+get_model name such as plain AASIST) against a trained W2V+AASIST teacher:
+
+1. Teacher logits are cached once over the train set, for `teacher_crops`
+   fixed crops per clip spread evenly over the clip:
+
+       <teacher_cache>/teacher_logits.npy   float32 (num_clips, crops)
+       <teacher_cache>/offsets.npy          int64 crop starts, same shape
+       <teacher_cache>/meta.json            cache key (teacher checkpoint, train index, nb_samp, crops)
+
+   A cache whose key does not match the current settings is rebuilt.
+2. train_nn trains the student on those crops (one at random per clip and
+   epoch) with the loss
+       (1 - alpha) * BCE(student, label) + alpha * T^2 * BCE(student / T, sigmoid(teacher / T))
+   The teacher is not loaded while the student trains.
+3. Student and teacher are scored on the test set with brspeech_eval.evaluate
+   (the same scores schema as --test_only) and compared per TTS source.
+4. Both are benchmarked on CPU, each in a fresh process: batch-1 latency,
+   batched throughput, load time and peak RSS.
+
+Everything goes to <out_dir>/distill_report.json; <out_dir>/student_config.yaml
+is the --config to use with the student checkpoint elsewhere. Step-level resume, DDP and
+per-epoch sampling are not used in this mode.
+
+    python distill_brspeech.py --config configs/aasist_w2v_brspeech.yaml \\
+        --teacher_checkpoint fine_tuned_models/w2v_aasist_lr_5e-06_wd_5e-07/best.pth
+"""
+
+import argparse
+import contextlib
+import copy
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+import yaml
+from torch.utils.data import DataLoader, Dataset
+
+from brspeech_audio import as_model_input, fix_length, load_audio, load_audio_window
+from brspeech_eval import autocast_context, eer_auc, evaluate, load_model, log_results
+from brspeech_models import SSL_LAYER_OPTIONS
+from brspeech_ssl_cache import file_sha256
+from brspeech_validation import metrics_record
+from train_brspeech import build_train_config, create_dataloaders, dataloader_kwargs, load_config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+# --- reading crops ----------------------------------------------------------
+
+def clip_length(dataset, index: int):
+    """Clip length in samples from the shard or seek metadata, or None if only decoding tells."""
+    if dataset.shards is not None:
+        return dataset.shards.num_samples(index)
+    if dataset.seek_decode:
+        return int(dataset._num_samples[index])
+    return None
+
+
+def read_crop(dataset, index: int, start: int, waveform=None) -> torch.Tensor:
+    """The nb_samp window at `start` of clip `index`, through the dataset's backend."""
+    nb_samp = dataset.nb_samp
+    if waveform is not None:
+        window = waveform[start:start + nb_samp]
+    elif dataset.shards is not None:
+        window = dataset.shards.read(index, start, nb_samp)
+    elif dataset.seek_decode:
+        window = load_audio_window(dataset.samples_df.path(index), start, nb_samp, int(dataset._source_rates[index]))
+    else:
+        window = load_audio(dataset.samples_df.path(index))[start:start + nb_samp]
+    return as_model_input(fix_length(window, nb_samp))
+
+
+def crop_offsets(num_samples: int, nb_samp: int, crops: int) -> np.ndarray:
+    """`crops` window starts spread evenly from the head to the tail of the clip."""
+    return np.linspace(0, max(num_samples - nb_samp, 0), crops).astype(np.int64)
+
+
+class TeacherCropDataset(Dataset):
+    """All cached crops of a clip: ((crops, nb_samp) windows, (crops,) offsets, index)."""
+
+    def __init__(self, dataset, crops: int):
+        self.dataset = dataset
+        self.crops = crops
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        num_samples, waveform = clip_length(self.dataset, index), None
+        if num_samples is None:
+            waveform = load_audio(self.dataset.samples_df.path(index))
+            num_samples = len(waveform)
+        offsets = crop_offsets(num_samples, self.dataset.nb_samp, self.crops)
+        windows = torch.stack([read_crop(self.dataset, index, int(start), waveform) for start in offsets])
+        return windows, torch.from_numpy(offsets), index
+
+
+# --- teacher logit cache ----------------------------------------------------
+
+def train_index_path(model_config: dict) -> Path:
+    data = model_config['data']
+    if data.get('backend', 'flac') == 'shards':
+        return Path(data['shard_dir']) / 'train' / 'index.csv'
+    return Path(data['root_dir']) / 'train.csv'
+
+
+def teacher_key(model_config: dict, checkpoint_path: str, crops: int) -> dict:
+    """Everything that changes the cached logits; a mismatch invalidates the cache."""
+    params = model_config['model']['parameters']
+    stat = os.stat(checkpoint_path)
+    key = {
+        'teacher': model_config['model']['name'],
+        'checkpoint': str(Path(checkpoint_path).resolve()),
+        'checkpoint_size': stat.st_size,
+        'checkpoint_mtime_ns': stat.st_mtime_ns,
+        'train_index_sha256': file_sha256(str(train_index_path(model_config))),
+        'nb_samp': params.get('nb_samp', 64600),
+        'crops': crops,
+    }
+    for option in SSL_LAYER_OPTIONS:
+        if params.get(option) is not None:
+            key[option] = params[option]
+    return key
+
+
+def load_teacher_cache(cache_dir: Path, key: dict):
+    """(logits, offsets) of a complete cache built with `key`, else None."""
+    meta_path = cache_dir / 'meta.json'
+    if not meta_path.exists():
+        return None
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    if meta['key'] != key:
+        logger.info(f"Teacher cache key changed, rebuilding {cache_dir}")
+        return None
+    return np.load(cache_dir / 'teacher_logits.npy'), np.load(cache_dir / 'offsets.npy')
+
+
+def build_teacher_cache(teacher, dataset, cache_dir: Path, key: dict, batch_size: int, num_workers: int,
+                        device: torch.device, bf16: bool = False):
+    """Score every crop of every train clip with the teacher; meta.json is written last."""
+    crops = key['crops']
+    loader = DataLoader(TeacherCropDataset(dataset, crops), batch_size=max(1, batch_size // crops),
+                        shuffle=False, num_workers=num_workers, pin_memory=device.type == 'cuda')
+    logits = np.zeros((len(dataset), crops), dtype=np.float32)
+    offsets = np.zeros((len(dataset), crops), dtype=np.int64)
+    with torch.inference_mode():
+        for batch_idx, (windows, batch_offsets, idx) in enumerate(loader):
+            with autocast_context(device, bf16):
+                output = teacher(windows.to(device, non_blocking=True).flatten(0, 1))
+            logits[idx.numpy()] = output.float().reshape(len(idx), crops).cpu().numpy()
+            offsets[idx.numpy()] = batch_offsets.numpy()
+            if batch_idx % 500 == 0:
+                logger.info(f"  teacher logits: {batch_idx * loader.batch_size}/{len(dataset)}")
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    (cache_dir / 'meta.json').unlink(missing_ok=True)
+    for name, array in (('teacher_logits', logits), ('offsets', offsets)):
+        with open(cache_dir / f"{name}.npy.tmp", 'wb') as f:
+            np.save(f, array)
+        os.replace(cache_dir / f"{name}.npy.tmp", cache_dir / f"{name}.npy")
+    with open(cache_dir / 'meta.json', 'w') as f:
+        json.dump({'key': key, 'shape': list(logits.shape)}, f, indent=2)
+
+    labels = dataset._labels.astype(int)
+    eer, auc = eer_auc(labels, logits.mean(axis=1))
+    logger.info(f"✅ Cached {logits.size} teacher logits in {cache_dir} "
+                f"(teacher on train: EER {eer * 100:.2f}%, AUC {auc:.4f})")
+    return logits, offsets
+
+
+# --- student training -------------------------------------------------------
+
+class DistillationDataset(Dataset):
+    """One cached crop per clip and epoch, picked at random: (waveform, label, teacher logit)."""
+
+    def __init__(self, dataset, logits: np.ndarray, offsets: np.ndarray):
+        if len(logits) != len(dataset):
+            raise ValueError(f"Teacher cache has {len(logits)} clips, the train set {len(dataset)}")
+        self.dataset = dataset
+        self.logits = logits
+        self.offsets = offsets
+
+    @property
+    def samples_df(self):
+        return self.dataset.samples_df
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        crop = np.random.randint(self.logits.shape[1])
+        x = read_crop(self.dataset, index, int(self.offsets[index, crop]))
+        return x, int(self.dataset._labels[index]), float(self.logits[index, crop])
+
+
+class _DistillingLoader:
+    """Proxy around the train DataLoader handing train_nn (x, y) and the distiller the teacher logits."""
+
+    def __init__(self, loader, distiller: 'Distiller'):
+        self._loader = loader
+        self._distiller = distiller
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def __iter__(self):
+        try:
+            for batch_x, batch_y, teacher_logits in self._loader:
+                self._distiller.pending = teacher_logits
+                yield batch_x, batch_y
+        finally:
+            self._distiller.pending = None
+
+
+class Distiller:
+    """
+    Soft-target loss against cached teacher logits.
+
+    train_nn only passes (output, labels) to its criterion, so the criterion
+    class is subclassed to also read the teacher logits of the current batch,
+    which the train loader proxy leaves in `pending`. Validation batches
+    (no grad, or no pending logits) get the plain hard-label loss.
+    """
+
+    def __init__(self, temperature: float = 2.0, alpha: float = 0.5):
+        if not 0.0 <= alpha <= 1.0:
+            raise ValueError(f"alpha must be in [0, 1], got {alpha}")
+        self.temperature = temperature
+        self.alpha = alpha
+        self.pending = None
+
+    def criterion(self, base: type) -> type:
+        if not issubclass(base, torch.nn.BCEWithLogitsLoss):
+            raise ValueError(f"Distillation needs a BCEWithLogitsLoss criterion, got {base.__name__}")
+        distiller = self
+
+        class DistillationCriterion(base):
+            def forward(self, input, target):
+                hard = super().forward(input, target)
+                teacher = distiller.pending
+                if teacher is None or not torch.is_grad_enabled() or teacher.numel() != input.numel():
+                    return hard
+                t = distiller.temperature
+                teacher = teacher.to(input.device, input.dtype).reshape(input.shape)
+                soft = F.binary_cross_entropy_with_logits(input / t, torch.sigmoid(teacher / t))
+                return (1 - distiller.alpha) * hard + distiller.alpha * t * t * soft
+
+        DistillationCriterion.__name__ = base.__name__
+        return DistillationCriterion
+
+    def wrap_loader(self, loader):
+        return _DistillingLoader(loader, self)
+
+
+def student_model_config(model_config: dict) -> dict:
+    """The config with the model block replaced by distillation.student and its training overrides."""
+    distill = model_config['distillation']
+    config = copy.deepcopy(model_config)
+    nb_samp = model_config['model']['parameters'].get('nb_samp', 64600)
+    params = dict(distill['student'].get('parameters') or {})
+    if params.setdefault('nb_samp', nb_samp) != nb_samp:
+        raise ValueError(f"Student nb_samp {params['nb_samp']} must match the teacher crop length {nb_samp}")
+    config['model'] = {'name': distill['student']['name'], 'parameters': params}
+    config['training'].update(distill.get('training') or {})
+    config['training']['activation_checkpointing'] = False  # wav2vec2 only
+    config['data']['ssl_feature_cache'] = None
+    config['sampling'] = {}  # every epoch covers the whole cache
+    config.pop('distillation')
+    return config
+
+
+# --- evaluation and benchmark -----------------------------------------------
+
+def read_scores(scores_file) -> pd.DataFrame:
+    scores_file = Path(scores_file)
+    return pd.read_parquet(scores_file) if scores_file.suffix == '.parquet' else pd.read_csv(scores_file)
+
+
+def score_test_set(model, test_loader, scores_file, device, eval_config: dict) -> dict:
+    """evaluate() into the --test_only scores schema, plus EER/AUC overall and per TTS source."""
+    from brspeech_metrics import loader_sources
+
+    results = evaluate(
+        model,
+        test_loader.dataset,
+        scores_file,
+        device,
+        batch_size=eval_config.get('batch_size', 64),
+        num_workers=eval_config.get('num_workers', 4),
+        bf16=eval_config.get('bf16', False),
+    )
+    log_results(results, scores_file)
+    return {**results, **scores_record(scores_file, loader_sources(test_loader)), 'scores_file': str(scores_file)}
+
+
+def scores_record(scores_file, sources) -> dict:
+    scores_df = read_scores(scores_file)
+    labels = scores_df['true_label'].to_numpy()
+    if sources is None:
+        sources = np.where(labels == 1, 'bonafide', 'spoof')
+    return metrics_record(labels, scores_df['prediction_score'].to_numpy(), sources)
+
+
+def checkpoint_parameters(checkpoint_path) -> int:
+    from brspeech_checkpoints import load_state
+
+    return int(sum(t.numel() for t in load_state(checkpoint_path).values() if torch.is_tensor(t)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distill a W2V+AASIST checkpoint into a small CPU student')
+    parser.add_argument('--config', type=str, required=True, help='Teacher config with a distillation block')
+    parser.add_argument('--teacher_checkpoint', type=str, help='Override distillation.teacher_checkpoint')
+    parser.add_argument('--student', type=str, help='Override distillation.student.name')
+    parser.add_argument('--temperature', type=float, help='Override distillation.temperature')
+    parser.add_argument('--alpha', type=float, help='Override distillation.alpha (weight of the soft-target loss)')
+    parser.add_argument('--batch_size', type=int, help='Override batch size')
+    parser.add_argument('--epochs', type=int, help='Override number of epochs')
+    parser.add_argument('--lr', type=float, help='Override learning rate')
+    parser.add_argument('--weight_decay', type=float, help='Override weight decay')
+    parser.add_argument('--grad_accum_steps', type=int, help='Micro-batches per optimizer update')
+    parser.add_argument('--precision', type=str, choices=['fp32', 'bf16', 'fp16'], help='Training autocast precision')
+    parser.add_argument('--device', type=str, default='cuda', help='Device for the teacher cache and training')
+    parser.add_argument('--student_checkpoint', type=str, help='Skip training; evaluate and benchmark this student')
+    parser.add_argument('--teacher_scores', type=str,
+                        help='Existing --test_only scores file of the teacher (skips scoring it again)')
+    parser.add_argument('--skip_teacher_eval', action='store_true', help='Do not score the teacher on the test set')
+    parser.add_argument('--threads', type=int, default=4, help='CPU threads for the benchmark')
+    parser.add_argument('--bench_runs', type=int, default=50, help='Batch-1 runs per model')
+    parser.add_argument('--bench_batch', type=int, default=32)
+    parser.add_argument('--skip_benchmark', action='store_true')
+    parser.add_argument('--out_dir', type=str,
+                        help='Output directory (default: fine_tuned_models/distill_<student>_T<temperature>_a<alpha>)')
+    args = parser.parse_args()
+
+    model_config = load_config(args.config)
+    distill = model_config.setdefault('distillation', {})
+    if args.teacher_checkpoint:
+        distill['teacher_checkpoint'] = args.teacher_checkpoint
+    if args.student:
+        distill['student'] = {'name': args.student, 'parameters': {}}
+    if args.temperature is not None:
+        distill['temperature'] = args.temperature
+    if args.alpha is not None:
+        distill['alpha'] = args.alpha
+    if not distill.get('teacher_checkpoint'):
+        raise ValueError("No teacher checkpoint: set distillation.teacher_checkpoint or --teacher_checkpoint")
+    if model_config['data'].get('ssl_feature_cache'):
+        raise ValueError("The student needs waveforms; distillation cannot use data.ssl_feature_cache")
+    teacher_checkpoint = distill['teacher_checkpoint']
+    temperature, alpha = distill.get('temperature', 2.0), distill.get('alpha', 0.5)
+    crops = distill.get('teacher_crops', 4)
+
+    config = student_model_config(model_config)
+    student_name = config['model']['name']
+    device = torch.device(args.device if torch.cuda.is_available() else 'cpu')
+    logger.info(f"Using device: {device}")
+    out_dir = Path(args.out_dir or Path("fine_tuned_models") / f"distill_{student_name}_T{temperature}_a{alpha}")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    eval_config = model_config.get('evaluation', {})
+    # --config for --test_only, brspeech_export.py and brspeech_serve.py with the student checkpoint
+    with open(out_dir / 'student_config.yaml', 'w') as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+
+    from brspeech_mixed_precision import TrainingMode
+
+    training_mode = TrainingMode.from_config(config, device, args)
+    distiller = Distiller(temperature, alpha)
+    train_config = build_train_config(config, device, args, training_mode, distiller=distiller)
+    train_loader, val_loader, test_loader = create_dataloaders(config, train_config)
+    train_dataset = train_loader.dataset
+
+    report = {
+        'distillation': {'teacher_checkpoint': teacher_checkpoint, 'student': config['model'],
+                         'temperature': temperature, 'alpha': alpha, 'teacher_crops': crops},
+    }
+    checkpoint_path = args.student_checkpoint
+    if checkpoint_path is None:
+        # Teacher logits over the train set, once
+        cache_dir = Path(distill.get('teacher_cache') or out_dir / 'teacher_cache')
+        key = teacher_key(model_config, teacher_checkpoint, crops)
+        cached = load_teacher_cache(cache_dir, key)
+        if cached is None:
+            logger.info(f"Caching teacher logits ({crops} crops per clip) for {len(train_dataset)} train clips...")
+            teacher = load_model(model_config, teacher_checkpoint, device)
+            cached = build_teacher_cache(teacher, train_dataset, cache_dir, key,
+                                         eval_config.get('batch_size', 64), eval_config.get('num_workers', 4),
+                                         device, eval_config.get('bf16', False))
+            del teacher
+            if device.type == 'cuda':
+                torch.cuda.empty_cache()
+        else:
+            logger.info(f"✅ Teacher cache is up to date: {cache_dir}")
+        logits, offsets = cached
+
+        train_loader = distiller.wrap_loader(DataLoader(
+            DistillationDataset(train_dataset, logits, offsets),
+            batch_size=train_config.trainer_config.batch_size,
+            shuffle=True,
+            drop_last=True,
+            **dataloader_kwargs(config)
+        ))
+
+        from brspeech_models import local_models, model_transform
+        from src.train_models import train_nn
+
+        logger.info(f"Distilling into {student_name} (T={temperature}, alpha={alpha})...")
+        with contextlib.ExitStack() as stack:
+            # First: the model transforms below wrap the factory they find on entry
+            stack.enter_context(local_models())
+            if training_mode.active:
+                logger.info(f"Training mode: {training_mode.describe(train_config.trainer_config.batch_size)}")
+                stack.enter_context(model_transform(training_mode.transform))
+                train_loader = training_mode.wrap_loader(train_loader)
+            if config.get('validation', {}).get('streaming_metrics', True):
+                from brspeech_metrics import ValidationMetrics
+
+                validation_metrics = ValidationMetrics(val_loader, out_dir / 'val_metrics.jsonl')
+                val_loader = validation_metrics.wrap_loader(val_loader)
+                stack.enter_context(validation_metrics)
+            config_save_path, checkpoint_path = train_nn(
+                data_train=train_loader,
+                data_test=val_loader,
+                config=train_config,
+                model_config=config,
+                out_dir=out_dir,
+                device=device,
+            )
+        logger.info(f"Student checkpoint saved at: {checkpoint_path}")
+
+    # Per-source test metrics in the --test_only scores schema
+    scores_format = eval_config.get('scores_format', 'csv')
+    student = load_model(config, checkpoint_path, device)
+    report['student'] = {'checkpoint': str(checkpoint_path), 'parameters': checkpoint_parameters(checkpoint_path),
+                         'test': score_test_set(student, test_loader, out_dir / f"test_scores_{student_name}.{scores_format}",
+                                                device, eval_config)}
+    del student
+    teacher_test = None
+    if args.teacher_scores:
+        from brspeech_metrics import loader_sources
+
+        teacher_test = {**scores_record(args.teacher_scores, loader_sources(test_loader)),
+                        'scores_file': args.teacher_scores}
+    elif not args.skip_teacher_eval:
+        teacher = load_model(model_config, teacher_checkpoint, device)
+        teacher_test = score_test_set(teacher, test_loader,
+                                      out_dir / f"test_scores_{model_config['model']['name']}.{scores_format}",
+                                      device, eval_config)
+        del teacher
+    report['teacher'] = {'checkpoint': teacher_checkpoint, 'parameters': checkpoint_parameters(teacher_checkpoint),
+                         'test': teacher_test}
+
+    # CPU latency / throughput, each model in its own process
+    if not args.skip_benchmark:
+        from brspeech_export import benchmark_artifact, in_fresh_process, sample_inputs
+
+        waveforms, _ = sample_inputs(model_config, Path(model_config['data']['root_dir']) / 'test.csv',
+                                     max(args.bench_batch, 2))
+        logger.info(f"=== CPU BENCHMARK ({args.threads} threads) ===")
+        for role, role_config, path in (('teacher', model_config, teacher_checkpoint),
+                                        ('student', config, str(checkpoint_path))):
+            bench = in_fresh_process(benchmark_artifact, 'fp32', path, role_config, waveforms,
+                                     args.threads, args.bench_runs, args.bench_batch)
+            report[role]['cpu'] = bench
+            logger.info(f"{role:8} | load {bench['load_seconds']:.2f}s | batch-1 p50 {bench['latency_p50_ms']:.1f}ms "
+                        f"p95 {bench['latency_p95_ms']:.1f}ms | {bench['batch_clips_per_sec']:.1f} clips/s | "
+                        f"peak RSS {bench['peak_rss_mb']:.0f} MB")
+        report['speedup'] = {
+            'latency_p50': report['teacher']['cpu']['latency_p50_ms'] / report['student']['cpu']['latency_p50_ms'],
+            'throughput': report['student']['cpu']['batch_clips_per_sec'] / report['teacher']['cpu']['batch_clips_per_sec'],
+        }
+
+    logger.info("=== TEACHER vs STUDENT (test set) ===")
+    for role in ('teacher', 'student'):
+        test = report[role]['test']
+        if test is None:
+            continue
+        logger.info(f"{role:8} | {report[role]['parameters'] / 1e6:7.2f}M params | EER {test['eer']:.2f}% | "
+                    f"AUC {test['auc']:.4f}")
+        for source, eer in test['per_source_eer'].items():
+            logger.info(f"           {source:20} EER {eer:.2f}%")
+    if 'speedup' in report:
+        logger.info(f"Student CPU speed-up: {report['speedup']['latency_p50']:.1f}x batch-1 latency, "
+                    f"{report['speedup']['throughput']:.1f}x throughput")
+
+    report_path = out_dir / 'distill_report.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved to: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
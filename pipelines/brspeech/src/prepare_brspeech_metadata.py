@@ -1,50 +1,145 @@
 import os
 import csv
-from pathlib import Path
+import argparse
+from collections import defaultdict
+
+from brspeech_index import DirectoryIndex, Timer
 
 # Dataset paths inside container
 REAL_BASE = "/data/real"
 SPOOF_BASE = "/data/spoof"
 OUTPUT_DIR = "metadata"
+# Keep the manifest on a persistent volume so restarts can reuse it
+MANIFEST_PATH = os.getenv("BRSPEECH_INDEX_MANIFEST", os.path.join(OUTPUT_DIR, ".index_manifest.json"))
 
 tts_models = ['f5tts', 'fish-speech', 'toucantts', 'xtts', 'yourtts']
 splits = ['train', 'dev', 'test']
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-for split in splits:
-    index = []
-    
-    # Process real audio files
+def read_real_rows(split):
+    """Return the audio paths listed in the real-speech CSV for a split."""
     real_csv_path = os.path.join(REAL_BASE, f"{split}.csv")
-    if os.path.exists(real_csv_path):
-        with open(real_csv_path, newline='') as f:
-            reader = csv.reader(f, delimiter='|')
-            next(reader)  # Skip header
-            for row in reader:
-                audio_path = os.path.join(REAL_BASE, row[0])
-                if os.path.exists(audio_path):
+    if not os.path.exists(real_csv_path):
+        return []
+    with open(real_csv_path, newline='') as f:
+        reader = csv.reader(f, delimiter='|')
+        next(reader)  # Skip header
+        return [os.path.join(REAL_BASE, row[0]) for row in reader]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate BrSpeech metadata CSVs')
+    parser.add_argument('--workers', type=int, default=16, help='Parallel directory listings')
+    parser.add_argument('--full_rescan', action='store_true', help='Ignore the index manifest')
+    parser.add_argument('--no_probe', action='store_true',
+                        help='Skip reading audio headers (no duration/sample_rate columns)')
+    parser.add_argument('--verify_audio', action='store_true',
+                        help='Decode-check every file (cached, see brspeech_integrity.py) and leave broken ones out')
+    parser.add_argument('--verify_workers', type=int, default=os.cpu_count(), help='Decode processes for --verify_audio')
+    parser.add_argument('--drop_cross_split_duplicates', action='store_true',
+                        help='With --verify_audio, keep audio shared by several splits only in test, then dev')
+    args = parser.parse_args()
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    total_files = 0
+    with Timer() as timer, DirectoryIndex(MANIFEST_PATH, args.workers, args.full_rescan) as dir_index:
+        real_rows = {split: read_real_rows(split) for split in splits}
+
+        # One listing per audio directory instead of one stat per CSV row
+        real_dirs = {os.path.dirname(p) for rows in real_rows.values() for p in rows}
+        listings = dir_index.list_dirs(sorted(real_dirs))
+        existing = defaultdict(set)
+        for d, entry in listings.items():
+            if entry is not None:
+                existing[d] = set(entry['files'])
+
+        # All model/split trees are walked together, level by level
+        spoof_roots = {(model, split): os.path.join(SPOOF_BASE, model, split)
+                       for model in tts_models for split in splits}
+        spoof_files = dir_index.walk(spoof_roots.values(), suffix='.flac')
+
+        # Duration and sample rate let the dataset seek-decode only the crop window
+        audio_info = {}
+        dropped = set()
+        if args.verify_audio:
+            from brspeech_integrity import (IntegrityIndex, find_duplicates, leaked_copies,
+                                            write_report, INDEX_PATH)
+
+            split_of = {p: split for split, rows in real_rows.items() for p in rows
+                        if os.path.basename(p) in existing[os.path.dirname(p)]}
+            split_of.update({p: split for (_, split), root in spoof_roots.items() for p in spoof_files[root]})
+            integrity = IntegrityIndex(INDEX_PATH, args.verify_workers)
+            records = integrity.scan(split_of)
+            integrity.save()
+            # Broken files get no entry and are skipped below
+            audio_info = {p: (r['num_frames'], r['sample_rate']) for p, r in records.items() if r['status'] == 'ok'}
+            for p, r in records.items():
+                if r['status'] != 'ok':
+                    print(f"❌ Broken audio file: {p} ({r['error']})")
+            duplicates = find_duplicates(records, split_of)
+            cross = [g for g in duplicates if len(g['splits']) > 1]
+            if cross:
+                print(f"⚠️  {len(cross)} audio clips appear in more than one split")
+            if args.drop_cross_split_duplicates:
+                dropped = leaked_copies(duplicates, split_of)
+                print(f"Dropping {len(dropped)} cross-split duplicate files")
+            write_report(os.path.join(OUTPUT_DIR, 'integrity_report.json'), records, duplicates,
+                         integrity.stats, dropped)
+        elif not args.no_probe:
+            from brspeech_audio import probe_audio
+
+            all_paths = [p for rows in real_rows.values() for p in rows
+                         if os.path.basename(p) in existing[os.path.dirname(p)]]
+            all_paths += [p for files in spoof_files.values() for p in files]
+            audio_info = dir_index.probe(all_paths, probe_audio)
+
+        for split in splits:
+            index = []
+
+            # Process real audio files
+            for audio_path in real_rows[split]:
+                if os.path.basename(audio_path) in existing[os.path.dirname(audio_path)]:
                     index.append((audio_path, 'bonafide', 'bonafide'))
                 else:
                     print(f"⚠️  Real audio file not found: {audio_path}")
-    
-    # Process synthetic audio files
-    for model in tts_models:
-        spoof_path = os.path.join(SPOOF_BASE, model, split)
-        if os.path.exists(spoof_path):
-            for dirpath, _, filenames in os.walk(spoof_path):
-                for filename in filenames:
-                    if filename.endswith(".flac"):
-                        file_path = os.path.join(dirpath, filename)
-                        index.append((file_path, 'spoof', model))
-    
-    # Write metadata CSV
-    output_csv = os.path.join(OUTPUT_DIR, f"{split}.csv" if split != 'dev' else 'val.csv')
-    with open(output_csv, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["path", "label", "synth"])
-        writer.writerows(index)
-    
-    print(f"✅ Generated {output_csv} with {len(index)} samples")
-
-print(f"✅ Metadata generation complete!") 
\ No newline at end of file
+
+            # Process synthetic audio files
+            for model in tts_models:
+                for file_path in spoof_files[spoof_roots[(model, split)]]:
+                    index.append((file_path, 'spoof', model))
+
+            if dropped:
+                index = [row for row in index if row[0] not in dropped]
+
+            header = ["path", "label", "synth"]
+            if audio_info or args.verify_audio:
+                header += ["num_frames", "sample_rate", "duration"]
+                rows = []
+                for row in index:
+                    info = audio_info.get(row[0])
+                    if info is None:
+                        print(f"⚠️  Skipping unreadable audio file: {row[0]}")
+                        continue
+                    num_frames, sample_rate = info
+                    rows.append(row + (num_frames, sample_rate, round(num_frames / sample_rate, 4)))
+                index = rows
+
+            # Write metadata CSV
+            output_csv = os.path.join(OUTPUT_DIR, f"{split}.csv" if split != 'dev' else 'val.csv')
+            with open(output_csv, 'w', newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(header)
+                writer.writerows(index)
+
+            total_files += len(index)
+            print(f"✅ Generated {output_csv} with {len(index)} samples")
+
+        dir_index.save()
+
+    print(timer.report(total_files, dir_index.stats))
+    print(f"✅ Metadata generation complete!")
+
+
+if __name__ == "__main__":
+    main()
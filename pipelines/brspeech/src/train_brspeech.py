@@ -6,6 +6,8 @@ Based on the original train.py from are_audio_df_polyglots.
 """
 
 import argparse
+import contextlib
+import json
 import logging
 import os
 import sys
@@ -14,8 +16,6 @@ from pathlib import Path
 import torch
 from torch.utils.data import DataLoader
 import yaml
-import numpy as np
-import pandas as pd
 
 from src.datasets.brspeech_dataset import BrSpeechDataset
 from src.train_models import train_nn
@@ -40,46 +40,180 @@ def load_config(config_path: str) -> dict:
     return config
 
 
-def create_dataloaders(config: dict, train_config: DF_Train_Config) -> tuple:
-    """Create train, validation, and test data loaders."""
+def build_train_config(model_config: dict, device: torch.device, args=None, training_mode=None,
+                       checkpointer=None, loss_recorder=None, distiller=None) -> DF_Train_Config:
+    """
+    Create the DF_Train_Config from the YAML config and optional CLI overrides.
+    A distill_brspeech.Distiller adds its soft-target term to the criterion
+    class (innermost, so loss scaling covers it); a
+    brspeech_mixed_precision.TrainingMode swaps in its optimizer and criterion
+    classes; a brspeech_resume.TrainingCheckpointer wraps the optimizer class;
+    a brspeech_sampling.SampleLossRecorder wraps the criterion class.
+    """
+    optimizer, criterion = Adam, BCEWithLogitsLoss
+    if distiller is not None:
+        criterion = distiller.criterion(criterion)
+    if training_mode is not None:
+        optimizer, criterion = training_mode.optimizer(optimizer), training_mode.criterion(criterion)
+    if loss_recorder is not None:
+        criterion = loss_recorder.criterion(criterion)
+    if checkpointer is not None:
+        optimizer = checkpointer.optimizer(optimizer)
+    batch_size = getattr(args, 'batch_size', None)
+    epochs = getattr(args, 'epochs', None)
+    lr = getattr(args, 'lr', None)
+    weight_decay = getattr(args, 'weight_decay', None)
+    return DF_Train_Config(
+        seed=42,
+        trainer_config=_TrainerConfig(
+            optimizer=optimizer,
+            batch_size=batch_size or model_config['training']['batch_size'],
+            num_epochs=epochs or model_config['training']['epochs'],
+            early_stopping=model_config['training'].get('early_stopping', False),
+            early_stopping_patience=model_config['training'].get('early_stopping_patience', 5),
+            optimizer_parameters={
+                "lr": lr or model_config['training']['learning_rate'],
+                "weight_decay": weight_decay or model_config['training']['weight_decay']
+            },
+            criterion=criterion,
+        ),
+        root_dir=Path(model_config['data']['root_dir']),
+        rawboost_config=_RawboostConfig(algo_id=0),
+        device=device
+    )
+
+
+def dataloader_kwargs(config: dict) -> dict:
+    """DataLoader worker/prefetch settings from the `dataloader` block of the config."""
+    loader_config = config.get('dataloader', {})
+    num_workers = loader_config.get('num_workers', 4)
+    kwargs = {
+        'num_workers': num_workers,
+        'pin_memory': loader_config.get('pin_memory', True),
+    }
+    # persistent_workers and prefetch_factor are only valid with worker processes
+    if num_workers > 0:
+        kwargs['persistent_workers'] = loader_config.get('persistent_workers', False)
+        if loader_config.get('prefetch_factor') is not None:
+            kwargs['prefetch_factor'] = loader_config['prefetch_factor']
+    return kwargs
+
+
+def create_dataloaders(config: dict, train_config: DF_Train_Config, checkpointer=None, dist_ctx=None,
+                       loss_recorder=None) -> tuple:
+    """
+    Create train, validation, and test data loaders.
+    With a checkpointer the train loader uses its resumable sampler; in a
+    distributed run the train set is sharded over ranks. With a `sampling`
+    budget each epoch is a stratified subset of the train set; with a
+    `validation.subset_size` the val loader covers a fixed stratified subset.
+    """
     logger.info("Creating datasets and data loaders...")
     
     # Use the provided train_config instead of creating a new one
     df_config = train_config
     
     # Create datasets
-    train_dataset = BrSpeechDataset(df_config, subset='train')
-    val_dataset = BrSpeechDataset(df_config, subset='val')
-    test_dataset = BrSpeechDataset(df_config, subset='test')
+    dataset_kwargs = {
+        'backend': config['data'].get('backend', 'flac'),
+        'shard_dir': config['data'].get('shard_dir'),
+        'nb_samp': config['model']['parameters'].get('nb_samp', 64600),
+        'seek_decode': config['data'].get('seek_decode', False),
+    }
+    ssl_cache_dir = config['data'].get('ssl_feature_cache')
+    if ssl_cache_dir:
+        from brspeech_ssl_cache import load_cached_subset
+
+        logger.info(f"Using cached SSL features from: {ssl_cache_dir}")
+        train_dataset = load_cached_subset(ssl_cache_dir, 'train', config)
+        val_dataset = load_cached_subset(ssl_cache_dir, 'val', config)
+        test_dataset = load_cached_subset(ssl_cache_dir, 'test', config)
+    else:
+        logger.info(f"Dataset backend: {dataset_kwargs['backend']}")
+        train_dataset = BrSpeechDataset(df_config, subset='train', **dataset_kwargs)
+        val_dataset = BrSpeechDataset(df_config, subset='val', **dataset_kwargs)
+        test_dataset = BrSpeechDataset(df_config, subset='test', **dataset_kwargs)
     
     logger.info(f"Dataset sizes - Train: {len(train_dataset)}, Val: {len(val_dataset)}, Test: {len(test_dataset)}")
     
     # Create data loaders
     batch_size = config['training']['batch_size']
+    loader_kwargs = dataloader_kwargs(config)
+
+    stratified = None
+    sampling = config.get('sampling', {})
+    if sampling.get('epoch_fraction') or sampling.get('epoch_budget'):
+        from brspeech_sampling import StratifiedEpochSampler
+
+        distributed = dist_ctx is not None and dist_ctx.enabled
+        stratified = StratifiedEpochSampler.from_config(
+            train_dataset.samples_df, sampling, train_config.seed,
+            num_replicas=dist_ctx.world_size if distributed else 1,
+            rank=dist_ctx.rank if distributed else 0,
+            loss_recorder=loss_recorder,
+        )
+        logger.info(f"Every train clip is drawn within {stratified.epochs_to_cover()} epochs")
+        if loss_recorder is not None:
+            loss_recorder.allocate(len(train_dataset))
+            if checkpointer is not None:
+                checkpointer.register_state('sample_losses', loss_recorder.state, loss_recorder.load_state)
     
-    train_loader = DataLoader(
-        train_dataset,
-        batch_size=batch_size,
-        shuffle=True,
-        num_workers=4,
-        pin_memory=True,
-        drop_last=True
-    )
+    if checkpointer is not None:
+        train_loader = checkpointer.wrap_loader(DataLoader(
+            train_dataset,
+            batch_size=batch_size,
+            sampler=checkpointer.sampler(len(train_dataset), train_config.seed, stratified),
+            drop_last=True,
+            **loader_kwargs
+        ))
+    elif stratified is not None:
+        # Shards over ranks and advances the epoch itself
+        train_loader = DataLoader(
+            train_dataset,
+            batch_size=batch_size,
+            sampler=stratified,
+            drop_last=True,
+            **loader_kwargs
+        )
+    elif dist_ctx is not None and dist_ctx.enabled:
+        from brspeech_distributed import distributed_sampler, wrap_epoch_loader
+
+        train_loader = wrap_epoch_loader(DataLoader(
+            train_dataset,
+            batch_size=batch_size,
+            sampler=distributed_sampler(train_dataset, dist_ctx, train_config.seed),
+            drop_last=True,
+            **loader_kwargs
+        ))
+    else:
+        train_loader = DataLoader(
+            train_dataset,
+            batch_size=batch_size,
+            shuffle=True,
+            drop_last=True,
+            **loader_kwargs
+        )
+    if loss_recorder is not None and stratified is not None:
+        train_loader = loss_recorder.wrap_loader(train_loader)
     
-    val_loader = DataLoader(
-        val_dataset,
-        batch_size=batch_size,
-        shuffle=False,
-        num_workers=4,
-        pin_memory=True
-    )
+    val_subset_size = config.get('validation', {}).get('subset_size')
+    if val_subset_size:
+        from brspeech_validation import subset_loader
+
+        val_loader = subset_loader(val_dataset, val_subset_size, batch_size, loader_kwargs, train_config.seed)
+    else:
+        val_loader = DataLoader(
+            val_dataset,
+            batch_size=batch_size,
+            shuffle=False,
+            **loader_kwargs
+        )
     
     test_loader = DataLoader(
         test_dataset,
         batch_size=batch_size,
         shuffle=False,
-        num_workers=4,
-        pin_memory=True
+        **loader_kwargs
     )
     
     return train_loader, val_loader, test_loader
@@ -96,141 +230,334 @@ def main():
     parser.add_argument('--device', type=str, default='cuda', help='Device to use for training')
     parser.add_argument('--test_only', action='store_true', help='Run in test-only mode')
     parser.add_argument('--checkpoint_path', type=str, help='Path to checkpoint for testing')
+    parser.add_argument('--eval_batch_size', type=int, help='Batch size for --test_only scoring')
+    parser.add_argument('--bf16', action='store_true', help='bf16 autocast for --test_only scoring')
+    parser.add_argument('--scores_format', type=str, choices=['csv', 'parquet'], help='Scores file format')
+    parser.add_argument('--scores_file', type=str,
+                        help='--test_only scores path (default: <out_dir>/test_scores_<model>_<checkpoint>.<format>)')
+    parser.add_argument('--ssl_feature_cache', type=str,
+                        help='Train only the AASIST head on features cached by brspeech_ssl_cache.py')
+    parser.add_argument('--grad_accum_steps', type=int, help='Micro-batches per optimizer update')
+    parser.add_argument('--precision', type=str, choices=['fp32', 'bf16', 'fp16'],
+                        help='Training autocast precision (fp16 uses dynamic loss scaling, CUDA only)')
+    parser.add_argument('--activation_checkpointing', action='store_true',
+                        help='Recompute wav2vec2 encoder activations in backward to save memory')
+    parser.add_argument('--resume', type=str, nargs='?', const='latest',
+                        help="Resume from a step-level resume state ('latest' or a step_*.pt path)")
+    parser.add_argument('--instrument', action='store_true',
+                        help='Log per-step data-wait/forward/backward timings to train_metrics.jsonl')
+    parser.add_argument('--instrument_every', type=int, help='Steps per instrumentation record')
+    parser.add_argument('--profile_steps', type=int, nargs=2, metavar=('FIRST', 'LAST'),
+                        help='Export a torch.profiler trace for training steps FIRST..LAST (0-based)')
+    parser.add_argument('--rawboost_algo', type=int, choices=range(0, 9),
+                        help='Batched RawBoost algorithm on training batches (0 = off)')
+    parser.add_argument('--rawboost_on', type=str, choices=['device', 'cpu'],
+                        help='Run RawBoost on the training device (in the forward) or on CPU after collation')
+    parser.add_argument('--epoch_fraction', type=float,
+                        help='Train on a stratified fraction of the train set per epoch (see the sampling config)')
+    parser.add_argument('--hard_fraction', type=float,
+                        help='Part of each epoch quota drawn by per-sample loss (hard examples)')
+    parser.add_argument('--val_subset_size', type=int,
+                        help='Validate inside train_nn on a fixed stratified subset of this many val clips')
+    parser.add_argument('--val_every_steps', type=int, help='Also score the val subset every N optimizer updates')
+    parser.add_argument('--async_eval', action='store_true',
+                        help='Score every saved checkpoint on the full val set in a background process')
+    parser.add_argument('--out_dir', type=str,
+                        help='Output directory (default: fine_tuned_models/<model>_lr_<lr>_wd_<wd>)')
     
     args = parser.parse_args()
     
     # Load YAML config
     model_config = load_config(args.config)
+    if args.ssl_feature_cache:
+        model_config['data']['ssl_feature_cache'] = args.ssl_feature_cache
+    if args.test_only and model_config['data'].get('ssl_feature_cache'):
+        # The checkpoint holds the full model (front end included): score waveforms
+        logger.info("Test-only mode: ignoring data.ssl_feature_cache, scoring waveforms with the full model")
+        model_config['data']['ssl_feature_cache'] = None
     
     # Set device
     device = torch.device(args.device if torch.cuda.is_available() else 'cpu')
+
+    # Data-parallel training when launched with torchrun
+    dist_ctx = None
+    if not args.test_only:
+        from brspeech_distributed import init_distributed
+
+        dist_ctx = init_distributed(device.type, model_config.get('distributed', {}).get('backend'))
+        device = dist_ctx.device
+        if dist_ctx.enabled:
+            logger.info(f"Distributed training: {dist_ctx.world_size} ranks ({dist_ctx.backend}), "
+                        f"global batch {dist_ctx.world_size * model_config['training']['batch_size']}")
     logger.info(f"Using device: {device}")
     
-    # Create DF_Train_Config object
-    train_config = DF_Train_Config(
-        seed=42,
-        trainer_config=_TrainerConfig(
-            optimizer=Adam,
-            batch_size=args.batch_size or model_config['training']['batch_size'],
-            num_epochs=args.epochs or model_config['training']['epochs'],
-            early_stopping=model_config['training'].get('early_stopping', False),
-            early_stopping_patience=5,
-            optimizer_parameters={
-                "lr": args.lr or model_config['training']['learning_rate'],
-                "weight_decay": args.weight_decay or model_config['training']['weight_decay']
-            },
-            criterion=BCEWithLogitsLoss,
-        ),
-        root_dir=Path(model_config['data']['root_dir']),
-        rawboost_config=_RawboostConfig(algo_id=0),
-        device=device
-    )
-    
-    # Create data loaders
-    train_loader, val_loader, test_loader = create_dataloaders(model_config, train_config)
-    
+    # Gradient accumulation / mixed precision / activation checkpointing
+    training_mode = None
+    if not args.test_only:
+        from brspeech_mixed_precision import TrainingMode
+
+        training_mode = TrainingMode.from_config(model_config, device, args)
+        if training_mode.active:
+            logger.info(f"Training mode: {training_mode.describe(args.batch_size or model_config['training']['batch_size'])}")
+
     # Set up output directory
     model_name = model_config['model']['name']
-    lr = train_config.trainer_config.optimizer_parameters['lr']
-    wd = train_config.trainer_config.optimizer_parameters['weight_decay']
-    out_model_dir = Path("fine_tuned_models") / f"{model_name}_lr_{lr}_wd_{wd}"
+    lr = args.lr or model_config['training']['learning_rate']
+    wd = args.weight_decay or model_config['training']['weight_decay']
+    out_model_dir = Path(args.out_dir or Path("fine_tuned_models") / f"{model_name}_lr_{lr}_wd_{wd}")
     out_model_dir.mkdir(parents=True, exist_ok=True)
+
+    # Step-level resume states
+    checkpointer = None
+    checkpoint_config = model_config.get('checkpointing', {})
+    if not args.test_only and (checkpoint_config.get('enabled', True) or args.resume):
+        from brspeech_resume import TrainingCheckpointer, find_latest_state
+
+        resume_dir = out_model_dir / 'resume'
+        resume_from = args.resume
+        if resume_from == 'latest':
+            resume_from = find_latest_state(resume_dir)
+            if resume_from is None:
+                logger.info(f"No resume state in {resume_dir}, starting from scratch")
+        checkpointer = TrainingCheckpointer(
+            resume_dir,
+            every_steps=checkpoint_config.get('every_steps', 2000),
+            every_minutes=checkpoint_config.get('every_minutes'),
+            keep_last=checkpoint_config.get('keep_last', 2),
+            resume_from=resume_from,
+            num_replicas=dist_ctx.world_size,
+            rank=dist_ctx.rank,
+            keep_final=checkpoint_config.get('keep_final', False),
+        )
+        args.epochs = checkpointer.remaining_epochs(args.epochs or model_config['training']['epochs'])
+        if args.epochs == 0:
+            # e.g. a rerun of a finished run: its training_result.json still holds the checkpoint
+            logger.info(f"{resume_from} is at the end of the last epoch: nothing left to train")
+            if dist_ctx.enabled:
+                from brspeech_distributed import cleanup_distributed
+
+                cleanup_distributed()
+            return
+        if training_mode is not None:
+            loss_scale = training_mode.loss_scale
+            checkpointer.register_state('loss_scale', lambda: dict(vars(loss_scale)), lambda s: vars(loss_scale).update(s))
+
+    validation_config = model_config.setdefault('validation', {})
+    if args.val_subset_size is not None:
+        validation_config['subset_size'] = args.val_subset_size
+    if args.val_every_steps is not None:
+        validation_config['every_steps'] = args.val_every_steps
+    if args.async_eval:
+        validation_config['async_eval'] = True
+
+    # Per-sample losses for hard-example sampling
+    loss_recorder = None
+    sampling = model_config.setdefault('sampling', {})
+    if args.epoch_fraction is not None:
+        sampling['epoch_fraction'] = args.epoch_fraction
+    if args.hard_fraction is not None:
+        sampling['hard_fraction'] = args.hard_fraction
+    if not args.test_only and sampling.get('hard_fraction') and (sampling.get('epoch_fraction') or sampling.get('epoch_budget')):
+        from brspeech_sampling import SampleLossRecorder
+
+        loss_recorder = SampleLossRecorder()
+
+    # train_nn's patience counter is not part of the resume states: count it ourselves instead
+    resumable_early_stopping = (checkpointer is not None and model_config['training'].get('early_stopping', False)
+                                and validation_config.get('streaming_metrics', True))
+    if resumable_early_stopping:
+        model_config['training']['early_stopping'] = False
+
+    # Create DF_Train_Config object
+    train_config = build_train_config(model_config, device, args, training_mode, checkpointer, loss_recorder)
+
+    # Create data loaders
+    train_loader, val_loader, test_loader = create_dataloaders(model_config, train_config, checkpointer, dist_ctx,
+                                                               loss_recorder)
     
     # If in test_only mode, load model and run test
     if args.test_only:
         if not args.checkpoint_path:
             raise ValueError("Must provide --checkpoint_path in test-only mode")
         
-        from src.models import get_model
+        from brspeech_eval import load_model, evaluate, log_results
         
         logger.info(f"Running in test-only mode with checkpoint: {args.checkpoint_path}")
         
         # Load model from config
-        model = get_model(model_config['model']['name'], model_config['model']['parameters'], device)
-        model.load_state_dict(torch.load(args.checkpoint_path, map_location=device))
-        model.to(device)
-        model.eval()
+        model = load_model(model_config, args.checkpoint_path, device)
         
         # Generate scores file for analysis
-        test_loss = 0
-        all_scores = []
-        all_labels = []
-        all_paths = []
-        criterion = BCEWithLogitsLoss().to(device)
-        
-        with torch.no_grad():
-            batch_idx = 0
-            for batch_x, batch_y in test_loader:
-                batch_x = batch_x.to(device)
-                batch_y = batch_y.to(device).float().unsqueeze(1)
-                
-                output = model(batch_x)
-                loss = criterion(output, batch_y)
-                test_loss += loss.item()
-                
-                # Collect scores and labels
-                scores = torch.sigmoid(output).cpu().numpy().flatten()
-                labels = batch_y.cpu().numpy().flatten()
-                
-                # Get file paths for this batch
-                batch_start = batch_idx * test_loader.batch_size
-                batch_end = min(batch_start + len(scores), len(test_loader.dataset))
-                batch_paths = []
-                for i in range(batch_start, batch_end):
-                    if i < len(test_loader.dataset.samples_df):
-                        path = test_loader.dataset.samples_df.iloc[i]['path']
-                        batch_paths.append(path)
-                    else:
-                        batch_paths.append(f"batch_{batch_idx}_sample_{i-batch_start}")
-                
-                all_scores.extend(scores)
-                all_labels.extend(labels)
-                all_paths.extend(batch_paths)
-                batch_idx += 1
-
-        # Save scores to file
-        scores_df = pd.DataFrame({
-            'path': all_paths,
-            'true_label': all_labels,  # 1=real, 0=fake
-            'prediction_score': all_scores,
-            'predicted_label': (np.array(all_scores) > 0.5).astype(int)
-        })
-        
-        # Create output directory if it doesn't exist
-        output_dir = "fine_tuned_models"
-        os.makedirs(output_dir, exist_ok=True)
-        
-        scores_file = f"{output_dir}/test_scores_{model_config['model']['name']}.csv"
-        scores_df.to_csv(scores_file, index=False)
-        
-        # Simple accuracy calculation
-        accuracy = np.mean(scores_df['predicted_label'] == scores_df['true_label']) * 100
-        avg_loss = test_loss / len(test_loader)
-        
-        n_real = np.sum(scores_df['true_label'] == 1)
-        n_fake = np.sum(scores_df['true_label'] == 0)
-        
-        logger.info(f"Test Set Results:")
-        logger.info(f"  Loss: {avg_loss:.4f}")
-        logger.info(f"  Accuracy (threshold=0.5): {accuracy:.2f}%")
-        logger.info(f"  Dataset: {n_real} real, {n_fake} fake samples")
-        logger.info(f"  Scores saved to: {scores_file}")
+
+        eval_config = model_config.get('evaluation', {})
+        scores_format = args.scores_format or eval_config.get('scores_format', 'csv')
+        # One file per checkpoint, in --out_dir when given
+        output_dir = Path(args.out_dir or "fine_tuned_models")
+        scores_file = args.scores_file or str(
+            output_dir / f"test_scores_{model_config['model']['name']}_{Path(args.checkpoint_path).stem}.{scores_format}")
+
+        results = evaluate(
+            model,
+            test_loader.dataset,
+            scores_file,
+            device,
+            batch_size=args.eval_batch_size or eval_config.get('batch_size', 64),
+            num_workers=eval_config.get('num_workers', 4),
+            bf16=args.bf16 or eval_config.get('bf16', False),
+        )
+        log_results(results, scores_file)
         logger.info(f"  Copy file for analysis: docker cp container_name:/{scores_file} ./")
         return
     
+    # Batched RawBoost on collated training batches (the per-sample dataset RawBoost stays off)
+    augment_config = model_config.get('augmentation', {})
+    rawboost_algo = args.rawboost_algo if args.rawboost_algo is not None else augment_config.get('rawboost_algo', 0)
+    rawboost_on = args.rawboost_on or augment_config.get('rawboost_on', 'device')
+    rawboost = None
+    if rawboost_algo:
+        from brspeech_rawboost import BatchRawBoost, augment_loader
+
+        if model_config['data'].get('ssl_feature_cache'):
+            raise ValueError("RawBoost needs waveforms; it cannot be used with --ssl_feature_cache")
+        rawboost = BatchRawBoost(rawboost_algo, **augment_config.get('rawboost_params', {}))
+        logger.info(f"RawBoost algorithm {rawboost_algo} on {rawboost_on} batches")
+        if rawboost_on == 'cpu':
+            train_loader = augment_loader(train_loader, rawboost)
+
+    # SSL layer options: train_nn gets a config with truncated SSL paths and without the options
+    from brspeech_models import model_transform, prepare_ssl_layers
+
+    train_model_config, ssl_layers_transform = prepare_ssl_layers(model_config)
+
     # Train the model using the original train_nn function
     logger.info("Starting training...")
-    config_save_path, checkpoint_path = train_nn(
-        data_train=train_loader,
-        data_test=val_loader,
-        config=train_config,
-        model_config=model_config,
-        out_dir=out_model_dir,
-        device=device,
-    )
+    with contextlib.ExitStack() as stack:
+        if dist_ctx.enabled:
+            from brspeech_distributed import cleanup_distributed
+
+            stack.callback(cleanup_distributed)  # runs last, after the hooks below are removed
+
+        # The wav2vec2 backbone is read from its safetensors copy when there is one
+        from brspeech_checkpoints import fast_loading
+
+        stack.enter_context(fast_loading())
+
+        if ssl_layers_transform is not None:
+            # First, so the layer weights exist before DDP wrapping and resume-state loading
+            stack.enter_context(model_transform(ssl_layers_transform))
+
+        if rawboost is not None and rawboost_on == 'device':
+            from brspeech_rawboost import augment_on_device
+
+            stack.enter_context(model_transform(augment_on_device(rawboost)))
+
+        instrument_config = model_config.get('instrumentation', {})
+        if args.instrument or args.profile_steps or instrument_config.get('enabled', False):
+            from brspeech_instrument import StepInstrumentation
+
+            instrumentation = StepInstrumentation(
+                out_model_dir / 'train_metrics.jsonl',
+                device,
+                log_every=args.instrument_every or instrument_config.get('log_every', 50),
+                profile_steps=args.profile_steps,
+                profile_dir=out_model_dir / 'profiler',
+                write=dist_ctx.is_main,
+            )
+            train_loader = instrumentation.wrap_loader(train_loader)
+            stack.enter_context(instrumentation)
+        # Cheap in-loop validation and out-of-band full evaluation (rank 0 only)
+        if validation_config.get('every_steps') and dist_ctx.is_main:
+            from brspeech_validation import InLoopValidator
+
+            stack.enter_context(InLoopValidator(val_loader, validation_config['every_steps'],
+                                                out_model_dir / 'val_metrics.jsonl', device))
+        if validation_config.get('async_eval') and dist_ctx.is_main:
+            from brspeech_validation import BackgroundEvaluator
+
+            stack.enter_context(BackgroundEvaluator(
+                model_config, out_model_dir,
+                device=validation_config.get('async_device', 'cpu'),
+                threads=validation_config.get('async_threads'),
+                subsets=validation_config.get('async_subsets', ['val']),
+                wait=validation_config.get('wait_for_async_eval', True),
+            ))
+        if validation_config.get('streaming_metrics', True):
+            from brspeech_metrics import ValidationMetrics
+
+            # EER/AUC/min DCF per source of every train_nn validation pass (the in-loop check keeps the raw loader)
+            validation_metrics = ValidationMetrics(val_loader, out_model_dir / 'val_metrics.jsonl',
+                                                   write=dist_ctx.is_main)
+            val_loader = validation_metrics.wrap_loader(val_loader)
+            stack.enter_context(validation_metrics)
+        epoch_stopping = None
+        if resumable_early_stopping:
+            from brspeech_validation import EpochEarlyStopping
+
+            epoch_stopping = EpochEarlyStopping(validation_metrics,
+                                                model_config['training'].get('early_stopping_patience', 5))
+            checkpointer.register_state('early_stopping', epoch_stopping.state, epoch_stopping.load_state)
+            train_loader = epoch_stopping.wrap_loader(train_loader)
+        early_stopping = None
+        if validation_config.get('early_stopping_patience'):
+            from brspeech_validation import ASYNC_RESULTS, AsyncEarlyStopping
+
+            early_stopping = AsyncEarlyStopping(out_model_dir / ASYNC_RESULTS,
+                                                validation_config['early_stopping_patience'],
+                                                validation_config.get('early_stopping_metric', 'eer'))
+            train_loader = early_stopping.wrap_loader(train_loader)
+
+        if model_config['data'].get('ssl_feature_cache'):
+            from brspeech_ssl_cache import freeze_with_cached_features
+
+            output_type = train_loader.dataset.meta['output_type']
+            logger.info("SSL front end frozen: feeding cached features to the AASIST head")
+            stack.enter_context(model_transform(lambda m: freeze_with_cached_features(m, output_type)))
+
+        if training_mode is not None and training_mode.active:
+            stack.enter_context(model_transform(training_mode.transform))
+            train_loader = training_mode.wrap_loader(train_loader)
+
+        if checkpointer is not None:
+            stack.enter_context(checkpointer)
+
+        train_out_dir = out_model_dir
+        if dist_ctx.enabled:
+            from brspeech_distributed import RankOutputDir, ddp_transform
+
+            find_unused = model_config.get('distributed', {}).get('find_unused_parameters', False)
+            stack.enter_context(model_transform(ddp_transform(dist_ctx, find_unused)))
+            if training_mode is not None:
+                # Sees the DDP wrapper: micro-batches that do not end an update skip the all-reduce
+                stack.enter_context(model_transform(training_mode.attach_model))
+            train_out_dir = stack.enter_context(RankOutputDir(out_model_dir, dist_ctx))
+
+        from brspeech_validation import StopTraining
+
+        try:
+            config_save_path, checkpoint_path = train_nn(
+                data_train=train_loader,
+                data_test=val_loader,
+                config=train_config,
+                model_config=train_model_config,
+                out_dir=train_out_dir,
+                device=device,
+            )
+        except StopTraining as e:
+            logger.info(f"Early stopping: {e}")
+            stopped_by_epochs = epoch_stopping is not None and epoch_stopping.since_best >= epoch_stopping.patience
+            stopping = epoch_stopping if stopped_by_epochs else early_stopping
+            config_save_path, checkpoint_path = out_model_dir, stopping.best_checkpoint
     
     logger.info(f"Training completed! Model saved at: {config_save_path}")
     logger.info(f"Checkpoint saved at: {checkpoint_path}")
+    if dist_ctx.is_main:
+        # Read by brspeech_sweep.py to report the checkpoint behind a trial's result
+        with open(out_model_dir / 'training_result.json', 'w') as f:
+            json.dump({'checkpoint': str(checkpoint_path) if checkpoint_path else None}, f)
+    if checkpoint_config.get('safetensors') and checkpoint_path and Path(checkpoint_path).is_file() and dist_ctx.is_main:
+        from brspeech_checkpoints import convert_checkpoint
+
+        logger.info(f"Safetensors copy for fast loading: {convert_checkpoint(checkpoint_path)}")
     
     # Test on test set if available
     if test_loader:
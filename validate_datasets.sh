@@ -99,4 +99,5 @@ fi
 log "INFO" "✅ Spoof data structure looks good."
 
 log "INFO" "🎉 All dataset validations passed successfully!"
+log "INFO" "Structure only: run ./run_docker.sh with --verify-audio to decode-check every audio file."
 exit 0 
\ No newline at end of file